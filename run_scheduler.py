@@ -2,11 +2,15 @@ import logging
 import os
 import threading
 from flask import Flask, jsonify, request
-from utils.scheduler_api import reconcile_tasks, run_scheduler, log_scheduled_jobs
+from utils.scheduler_api import reconcile_tasks, run_scheduler, log_scheduled_jobs, async_job_runner
+from utils.config import run_config_migrations
+from utils.tgservice_api import tgservice_client
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+run_config_migrations()
+
 app = Flask(__name__)
 
 @app.route('/reconcile', methods=['POST', 'GET'])
@@ -26,6 +30,10 @@ def trigger_reconciliation():
         logger.error(f"执行任务核对时发生错误: {e}", exc_info=True)
         return jsonify({"success": False, "message": f"内部错误: {e}"}), 500
 
+@app.route('/executor/stats', methods=['GET'])
+def executor_stats():
+    return jsonify({"success": True, "stats": async_job_runner.get_stats(), "tgservice_client": tgservice_client.get_stats()}), 200
+
 def start_scheduler_thread():
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from tgservice import client_manager as client_manager_module
+from tgservice.client_manager import ClientManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(client_manager_module, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(client_manager_module, "get_config_snapshot", lambda: {"api_id": 1, "api_hash": "hash", "users": []})
+    manager = ClientManager()
+    manager.lazy_mode = True
+    return manager
+
+
+def test_remove_idle_client_deletes_session_file(manager, tmp_path):
+    session_file = tmp_path / "alice.session"
+    session_file.write_bytes(b"")
+    manager._register_idle("alice", "Alice")
+    manager.get_limiter("alice")
+
+    assert asyncio.run(manager.remove_client("alice")) is True
+    assert not session_file.exists()
+    assert "alice" not in manager.get_all_clients_status()
+    assert "alice" not in manager._limiters
+
+
+def test_remove_failed_client_deletes_session_file(manager, tmp_path):
+    session_file = tmp_path / "bob.session"
+    session_file.write_bytes(b"")
+    manager._clients["bob"] = {"client": None, "nickname": "Bob", "status": "connect_failed"}
+
+    assert asyncio.run(manager.remove_client("bob")) is True
+    assert not session_file.exists()
+
+
+def test_remove_unknown_client_keeps_files(manager, tmp_path):
+    session_file = tmp_path / "carol.session"
+    session_file.write_bytes(b"")
+
+    assert asyncio.run(manager.remove_client("carol")) is False
+    assert session_file.exists()
+
+
+def _config_with_users(*session_names):
+    return {"api_id": 1, "api_hash": "hash", "revision": 2, "users": [
+        {"session_name": name, "nickname": name, "status": "logged_in"} for name in session_names
+    ]}
+
+
+def test_apply_config_keeps_pending_session(manager):
+    manager._clients["session_1"] = {"client": None, "nickname": "Alice", "status": "connected"}
+    manager.mark_pending("session_1")
+
+    changes = asyncio.run(manager.apply_config(_config_with_users()))
+    assert changes["removed"] == []
+    assert "session_1" in manager.get_all_clients_status()
+
+    asyncio.run(manager.apply_config(_config_with_users("session_1")))
+    assert "session_1" not in manager._pending_sessions
+
+
+def test_apply_config_detaches_pending_session_after_grace(manager, monkeypatch):
+    monkeypatch.setattr(client_manager_module, "PENDING_SESSION_GRACE", 0)
+    manager._clients["session_1"] = {"client": None, "nickname": "Alice", "status": "connected"}
+    manager.mark_pending("session_1")
+
+    changes = asyncio.run(manager.apply_config(_config_with_users()))
+    assert changes["removed"] == ["session_1"]
+    assert "session_1" not in manager.get_all_clients_status()
+
+
+def test_blocked_sessions_accessor(manager):
+    manager._register_idle("alice", "Alice")
+    manager._register_idle("bob", "Bob")
+    manager.get_limiter("alice").block(60, "flood_wait")
+
+    blocked = manager.get_blocked_sessions()
+    assert list(blocked) == ["alice"]
+    assert blocked["alice"]["nickname"] == "Alice"
+    assert sorted(manager.get_session_names()) == ["alice", "bob"]
+    assert manager.get_nickname("bob") == "Bob"
+    assert manager.get_nickname("carol") == "未知用户"
+
+
+class _FakeClient:
+    def __init__(self, *args, hang=False):
+        self.hang = hang
+        self.connected = not args
+        self.disconnects = 0
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        self.connected = True
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self):
+        if self.hang:
+            await asyncio.sleep(60)
+        return {"id": 1}
+
+    async def disconnect(self):
+        self.disconnects += 1
+        self.connected = False
+
+
+def test_check_client_disconnects_hung_client_before_reconnect(manager, monkeypatch):
+    created = []
+
+    def fake_telegram_client(*args):
+        created.append(_FakeClient(*args))
+        return created[-1]
+
+    monkeypatch.setattr(client_manager_module, "TelegramClient", fake_telegram_client)
+    old_client = _FakeClient(hang=True)
+    manager._clients["alice"] = {"client": old_client, "nickname": "Alice", "status": "connected"}
+
+    result = asyncio.run(manager.check_client("alice", timeout=0.01))
+    assert result == {"healthy": True, "reconnected": True}
+    assert old_client.disconnects == 1
+    assert len(created) == 1
+    assert manager.get_client("alice") is created[0]
@@ -0,0 +1,163 @@
+import json
+import os
+
+import pytest
+
+from utils import config
+from utils.config_store import SqliteConfigStore
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "CONFIG_FILE", str(tmp_path / "config_data.json"))
+    monkeypatch.setattr(config, "CONFIG_LOCK_FILE", str(tmp_path / "config_data.lock"))
+    monkeypatch.setattr(config, "_sqlite_store", None)
+    monkeypatch.setattr(config, "CONFIG_WRITE_COALESCE_SECONDS", 0)
+    monkeypatch.setattr(config, "_config_cache", {"key": None, "snapshot": None, "text": None, "index": None})
+    monkeypatch.setattr(config, "_pending_write", {"config": None, "base_revision": None, "base_key": None, "timer": None})
+    yield tmp_path
+    timer = config._pending_write["timer"]
+    if timer is not None:
+        timer.cancel()
+
+
+def _write_on_disk(path, data):
+    # 模拟其他进程直接写入配置文件，并保证文件 stat 发生变化
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def _read_on_disk(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_save_config_bumps_revision(config_dir):
+    cfg = config.load_config()
+    assert cfg["revision"] == 1
+    cfg["scheduler_enabled"] = True
+    config.save_config(cfg)
+    assert _read_on_disk(config.CONFIG_FILE)["revision"] == 2
+    assert config.get_config_snapshot()["scheduler_enabled"] is True
+
+
+def test_save_config_rejects_stale_revision(config_dir):
+    first = config.load_config()
+    second = config.load_config()
+    first["scheduler_enabled"] = True
+    config.save_config(first)
+    second["api_id"] = 1
+    with pytest.raises(config.ConfigConflictError):
+        config.save_config(second)
+    assert _read_on_disk(config.CONFIG_FILE)["api_id"] is None
+
+
+def test_coalesced_writes_flush_once(config_dir, monkeypatch):
+    config.load_config()
+    monkeypatch.setattr(config, "CONFIG_WRITE_COALESCE_SECONDS", 3600)
+    cfg = config.load_config()
+    cfg["api_id"] = 1
+    config.save_config(cfg)
+    cfg = config.load_config()
+    cfg["api_hash"] = "hash"
+    config.save_config(cfg)
+    assert _read_on_disk(config.CONFIG_FILE)["revision"] == 1
+
+    assert config.flush_config() is True
+    on_disk = _read_on_disk(config.CONFIG_FILE)
+    assert (on_disk["revision"], on_disk["api_id"], on_disk["api_hash"]) == (3, 1, "hash")
+    assert config.flush_config() is False
+
+
+def test_flush_raises_when_disk_changed(config_dir, monkeypatch):
+    config.load_config()
+    monkeypatch.setattr(config, "CONFIG_WRITE_COALESCE_SECONDS", 3600)
+    cfg = config.load_config()
+    cfg["api_id"] = 1
+    config.save_config(cfg)
+
+    external = _read_on_disk(config.CONFIG_FILE)
+    external.update(revision=5, api_hash="other")
+    # 绕过 _refresh_cache 的检测，直接验证落盘时的 revision 校验
+    monkeypatch.setattr(config, "_current_source_key", lambda: config._pending_write["base_key"])
+    _write_on_disk(config.CONFIG_FILE, external)
+
+    with pytest.raises(config.ConfigConflictError):
+        config.flush_config()
+    on_disk = _read_on_disk(config.CONFIG_FILE)
+    assert (on_disk["revision"], on_disk["api_id"], on_disk["api_hash"]) == (5, None, "other")
+    assert config._pending_write["config"] is None
+
+
+def test_pending_write_yields_to_external_change(config_dir, monkeypatch):
+    config.load_config()
+    monkeypatch.setattr(config, "CONFIG_WRITE_COALESCE_SECONDS", 3600)
+    cfg = config.load_config()
+    cfg["api_id"] = 1
+    config.save_config(cfg)
+    stale = config.load_config()
+
+    external = _read_on_disk(config.CONFIG_FILE)
+    external.update(revision=5, api_hash="other")
+    _write_on_disk(config.CONFIG_FILE, external)
+
+    snapshot = config.get_config_snapshot()
+    assert (snapshot["revision"], snapshot["api_hash"]) == (5, "other")
+    assert config._pending_write["config"] is None
+
+    stale["api_id"] = 2
+    with pytest.raises(config.ConfigConflictError):
+        config.save_config(stale)
+    assert config.flush_config() is False
+    assert _read_on_disk(config.CONFIG_FILE)["revision"] == 5
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_update_config_items(config_dir, monkeypatch, backend):
+    if backend == "sqlite":
+        monkeypatch.setattr(config, "_sqlite_store", SqliteConfigStore(str(config_dir / "config_data.db")))
+    cfg = config.load_config()
+    cfg["bots"] = [{"bot_username": "a", "strategy": "s1"}, {"bot_username": "b", "strategy": "s1"}]
+    cfg["checkin_tasks"] = [{"user_telegram_id": 1, "bot_username": "a"}, {"user_telegram_id": 1, "bot_username": "b"}]
+    config.save_config(cfg)
+    stale = config.load_config()
+
+    config.update_config_items(upserts={"bots": [{"bot_username": "b", "strategy": "s2"}, {"bot_username": "c"}]},
+                               deletes={"bots": [{"bot_username": "a"}],
+                                        "checkin_tasks": [{"user_telegram_id": 1, "bot_username": "a"}]})
+
+    snapshot = config.get_config_snapshot()
+    assert [bot["bot_username"] for bot in snapshot["bots"]] == ["b", "c"]
+    assert snapshot["bots"][0]["strategy"] == "s2"
+    assert [task["bot_username"] for task in snapshot["checkin_tasks"]] == ["b"]
+    assert snapshot["revision"] == stale["revision"] + 1
+    # 整体保存基于旧 revision 的配置会被拒绝，不会覆盖单条目修改
+    with pytest.raises(config.ConfigConflictError):
+        config.save_config(stale)
+
+    config._config_cache["key"] = None
+    reloaded = config.load_config()
+    assert [bot["bot_username"] for bot in reloaded["bots"]] == ["b", "c"]
+    assert reloaded["revision"] == snapshot["revision"]
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+@pytest.mark.parametrize("change", ["upserts", "deletes"])
+def test_update_config_items_rejects_missing_identity(config_dir, monkeypatch, backend, change):
+    if backend == "sqlite":
+        monkeypatch.setattr(config, "_sqlite_store", SqliteConfigStore(str(config_dir / "config_data.db")))
+    cfg = config.load_config()
+    cfg["bots"] = [{"bot_username": "a"}, {"strategy": "s1"}]
+    config.save_config(cfg)
+    before = config.get_config_snapshot()
+
+    with pytest.raises(ValueError):
+        config.update_config_items(**{change: {"bots": [{"bot_username": "b"}, {"strategy": "s1"}]}})
+
+    config._config_cache["key"] = None
+    reloaded = config.load_config()
+    assert reloaded["bots"] == [dict(bot) for bot in before["bots"]]
+    assert reloaded["revision"] == before["revision"]
@@ -0,0 +1,77 @@
+import pytest
+
+from utils.config_store import SqliteConfigStore
+
+
+def _config(bot_names, **settings):
+    return {"api_id": 1, **settings, "bots": [{"bot_username": name, "strategy": "start_button_alert"} for name in bot_names]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteConfigStore(str(tmp_path / "config_data.db"))
+
+
+def _positions(store):
+    return dict(store._connect().execute("SELECT row_key, position FROM bots").fetchall())
+
+
+def test_save_and_load_round_trip(store):
+    store.save(_config(["a", "b"], revision=7, scheduler_enabled=True))
+    config = store.load()
+    assert [bot["bot_username"] for bot in config["bots"]] == ["a", "b"]
+    assert config["scheduler_enabled"] is True
+    # revision 由 meta 表维护，不会保存调用方传入的值
+    assert config["revision"] == store.get_revision() == 1
+
+
+def test_deleting_one_row_does_not_rewrite_following_rows(store):
+    store.save(_config(["a", "b", "c", "d"]))
+    assert store.save(_config(["a", "c", "d"])) == 1
+    assert _positions(store) == {"a": 0, "c": 2, "d": 3}
+
+    assert store.save(_config(["a", "c", "d", "e"])) == 1
+    assert _positions(store)["e"] == 4
+    assert [bot["bot_username"] for bot in store.load()["bots"]] == ["a", "c", "d", "e"]
+
+
+def test_reordering_renumbers_rows(store):
+    store.save(_config(["a", "b", "c"]))
+    store.save(_config(["c", "a", "b"]))
+    assert [bot["bot_username"] for bot in store.load()["bots"]] == ["c", "a", "b"]
+
+
+def test_duplicate_identity_is_rejected(store):
+    store.save(_config(["a"]))
+    with pytest.raises(ValueError):
+        store.save(_config(["a", "b", "a"]))
+    assert [bot["bot_username"] for bot in store.load()["bots"]] == ["a"]
+    assert store.get_revision() == 1
+
+
+def test_entries_without_identity_are_kept(store):
+    config = _config(["a"])
+    config["bots"] += ["legacy_bot", "legacy_bot"]
+    store.save(config)
+    assert store.load()["bots"][1:] == ["legacy_bot", "legacy_bot"]
+
+
+def test_apply_changes_writes_single_rows(store):
+    store.save(_config(["a", "b", "c"]))
+    store.apply_changes(upserts={"bots": [{"bot_username": "b", "strategy": "other"}, {"bot_username": "d"}]},
+                        deletes={"bots": [{"bot_username": "a"}]})
+    bots = store.load()["bots"]
+    assert [bot["bot_username"] for bot in bots] == ["b", "c", "d"]
+    assert bots[0]["strategy"] == "other"
+    assert store.get_revision() == 2
+
+    with pytest.raises(ValueError):
+        store.apply_changes(upserts={"bots": [{"strategy": "missing_username"}]})
+    assert store.get_revision() == 2
+
+
+def test_unique_index_conflict_is_not_silently_replaced(store):
+    store.save({"web_users": [{"id": 1, "username": "admin"}]})
+    with pytest.raises(Exception):
+        store.save({"web_users": [{"id": 1, "username": "admin"}, {"id": 2, "username": "admin"}]})
+    assert store.load()["web_users"] == [{"id": 1, "username": "admin"}]
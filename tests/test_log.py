@@ -0,0 +1,246 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+import pytest
+
+from utils import log
+
+
+@pytest.fixture
+def log_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(log, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(log, "DB_FILE", str(tmp_path / "checkin_log.db"))
+    monkeypatch.setattr(log, "LOG_ARCHIVE_DIR", str(tmp_path / "log_archive"))
+    monkeypatch.setattr(log, "_db_initialized", False)
+    monkeypatch.setattr(log, "_local", threading.local())
+    # 迁移时的名称映射依赖策略模块和配置文件，测试中使用空映射
+    monkeypatch.setattr(log, "_legacy_identity_maps", lambda: ({}, {}, {}))
+    return tmp_path / "checkin_log.db"
+
+
+def _entry(nickname="alice", telegram_id=1001, message="签到成功"):
+    return {
+        "timestamp": "2026-01-02T08:00:00",
+        "checkin_type": "计划任务",
+        "user_telegram_id": telegram_id,
+        "user_nickname": nickname,
+        "target_type": "bot",
+        "target_identifier": "emby_bot",
+        "target_name": "emby_bot",
+        "strategy_id": "start_button_alert",
+        "success": True,
+        "message": message,
+    }
+
+
+def test_concurrent_dimension_inserts(log_db):
+    log.init_log_db()
+    thread_count = 8
+    barrier = threading.Barrier(thread_count)
+    results = []
+
+    def worker(index):
+        barrier.wait()
+        # 每个线程使用独立连接，同时写入同一个尚不存在的用户/目标维度
+        results.append(log.save_checkin_logs([_entry(message=f"签到成功 {index}")]))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [1] * thread_count
+    conn = sqlite3.connect(log.DB_FILE)
+    assert conn.execute("SELECT COUNT(*) FROM checkin_records").fetchone()[0] == thread_count
+    assert conn.execute("SELECT COUNT(*) FROM log_users").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM log_targets").fetchone()[0] == 1
+    conn.close()
+
+
+class _RacingConnection:
+    """在首次访问 log_users 时，让另一个连接抢先插入同一个维度行。"""
+
+    def __init__(self, conn, competing_insert):
+        self._conn = conn
+        self._competing_insert = competing_insert
+        self.raced = False
+
+    def execute(self, sql, params=()):
+        if "log_users" in sql and not self.raced:
+            self.raced = True
+            if sql.lstrip().upper().startswith("SELECT"):
+                cursor = self._conn.execute(sql, params)
+                self._competing_insert()
+                return cursor
+            self._competing_insert()
+        return self._conn.execute(sql, params)
+
+
+def test_dimension_id_survives_competing_insert(log_db):
+    conn = log._get_connection()
+
+    def competing_insert():
+        other = sqlite3.connect(log.DB_FILE)
+        other.execute("INSERT INTO log_users (dim_key, telegram_id, nickname) VALUES ('1001', 1001, 'alice')")
+        other.commit()
+        other.close()
+
+    racing = _RacingConnection(conn, competing_insert)
+    with conn:
+        dim_id = log._dimension_id(racing, "log_users", "1001", {"telegram_id": 1001, "nickname": "alice"})
+    assert racing.raced
+    assert conn.execute("SELECT id FROM log_users WHERE dim_key = '1001'").fetchone()[0] == dim_id
+
+
+def test_dimension_id_reuses_existing_row(log_db):
+    conn = log._get_connection()
+    first = log._dimension_id(conn, "log_strategies", "start_button_alert")
+    log._local.dimension_ids = {}
+    assert log._dimension_id(conn, "log_strategies", "start_button_alert") == first
+
+
+def _create_baseline_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE checkin_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            checkin_type TEXT,
+            user_nickname TEXT,
+            target_type TEXT,
+            target_name TEXT,
+            success INTEGER,
+            message TEXT
+        )
+    ''')
+    conn.executemany('''
+        INSERT INTO checkin_records (timestamp, checkin_type, user_nickname, target_type, target_name, success, message)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def test_migration_from_baseline_schema(log_db, monkeypatch):
+    _create_baseline_db(log_db, [
+        ("2026-01-01T08:00:00", "计划任务 (点击签到按钮)", "alice", "bot", "emby_bot", 1, "签到成功，获得 10 积分"),
+        ("2026-01-01T09:00:00", "手动签到 (群组发送签到)", "bob", "chat", "Emby 群", 0, "今日已重复签到"),
+        ("2026-01-02T08:00:00", "计划任务 (点击签到按钮)", "alice2", "bot", "emby_bot", 0, "网络错误"),
+    ])
+    monkeypatch.setattr(log, "_legacy_identity_maps", lambda: (
+        {"点击签到按钮": "start_button_alert", "群组发送签到": "chat_send_checkin"},
+        {"alice": 1001, "alice2": 1001, "bob": 1002},
+        {"Emby 群": -100123},
+    ))
+
+    log.init_log_db()
+
+    conn = sqlite3.connect(log.DB_FILE)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == log._LOG_MIGRATIONS[-1][0]
+    assert conn.execute("SELECT COUNT(*) FROM log_users").fetchone()[0] == 2
+    stats = conn.execute("SELECT day, attempts, successes, duplicates, failures FROM checkin_daily_stats ORDER BY day, successes DESC").fetchall()
+    conn.close()
+    assert stats == [("2026-01-01", 1, 1, 0, 0), ("2026-01-01", 1, 0, 1, 0), ("2026-01-02", 1, 0, 0, 1)]
+
+    records = {record["id"]: record for record in log.iter_checkin_logs()}
+    assert [records[i]["user_nickname"] for i in (1, 2, 3)] == ["alice", "bob", "alice2"]
+    assert records[1]["user_telegram_id"] == records[3]["user_telegram_id"] == 1001
+    assert records[1]["strategy_id"] == "start_button_alert"
+    assert (records[2]["target_identifier"], records[2]["target_name"]) == ("-100123", "Emby 群")
+    assert log.has_successful_checkin("2026-01-01", 1001, "bot", "emby_bot")
+
+
+def test_failed_migration_rolls_back(log_db, monkeypatch):
+    _create_baseline_db(log_db, [
+        ("2026-01-01T08:00:00", "计划任务 (点击签到按钮)", "alice", "bot", "emby_bot", 1, "签到成功"),
+    ])
+
+    def broken_identity_maps():
+        raise RuntimeError("配置读取失败")
+
+    monkeypatch.setattr(log, "_legacy_identity_maps", broken_identity_maps)
+    with pytest.raises(RuntimeError):
+        log.init_log_db()
+
+    conn = sqlite3.connect(log.DB_FILE)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 4
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "log_users" not in tables and "checkin_records_v5" not in tables
+    assert conn.execute("SELECT user_nickname FROM checkin_records").fetchall() == [("alice",)]
+    conn.close()
+
+
+def test_record_keeps_nickname_at_write_time(log_db):
+    log.save_checkin_logs([_entry(nickname="alice")])
+    log.save_checkin_logs([_entry(nickname="alice2", message="签到成功，第二天")])
+    nicknames = [record["user_nickname"] for record in log.iter_checkin_logs()]
+    assert nicknames == ["alice", "alice2"]
+
+
+def test_missing_message_fts_recreated_on_init(log_db):
+    log.save_checkin_logs([_entry(message="签到成功，获得 10 积分")])
+    conn = log._get_connection()
+    if not log._fts_available(conn):
+        pytest.skip("当前 SQLite 不支持 FTS5 trigram")
+    with conn:
+        for name in ("checkin_records_fts_ai", "checkin_records_fts_ad", "checkin_records_fts_au"):
+            conn.execute(f"DROP TRIGGER {name}")
+        conn.execute("DROP TABLE checkin_records_fts")
+    log._db_initialized = False
+
+    log.init_log_db()
+    assert log._fts_available(conn)
+    hits = conn.execute(
+        "SELECT rowid FROM checkin_records_fts WHERE checkin_records_fts MATCH ?", ('"10 积分"',)).fetchall()
+    assert len(hits) == 1
+
+
+def test_log_writer_retries_failed_batch(log_db, monkeypatch):
+    results = iter([0, 0, 1])
+    monkeypatch.setattr(log, "save_checkin_logs", lambda batch: next(results))
+    writer = log.CheckinLogWriter(max_retries=3, retry_delay=0)
+
+    writer._write_batch([_entry()])
+    assert writer.get_stats()["written"] == 1
+    assert writer.get_stats()["retries"] == 2
+    assert writer.get_stats()["dropped"] == 0
+
+
+def test_log_writer_drops_batch_after_max_retries(log_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(log, "save_checkin_logs", lambda batch: calls.append(batch) or 0)
+    writer = log.CheckinLogWriter(max_retries=2, retry_delay=0)
+
+    writer._write_batch([_entry(), _entry(message="签到失败")])
+    assert len(calls) == 3
+    assert writer.get_stats()["dropped"] == 2
+    assert writer.get_stats()["written"] == 0
+
+
+def test_search_includes_archived_records(log_db):
+    recent = _entry(message="请明天再来 (重复签到)")
+    recent["timestamp"] = datetime.now().replace(microsecond=0).isoformat()
+    old = _entry(message="请明天再来")
+    old["timestamp"] = "2025-01-02T08:00:00"
+    log.save_checkin_logs([old, recent])
+    assert log.archive_old_logs(retention_days=30) == 1
+
+    result = log.search_checkin_logs("明天再来", limit=1)
+    assert [record["timestamp"] for record in result["records"]] == [recent["timestamp"]]
+    assert result["next_offset"] == 1
+
+    result = log.search_checkin_logs("明天再来", offset=1, limit=1)
+    assert [record["timestamp"] for record in result["records"]] == ["2025-01-02T08:00:00"]
+    assert result["next_offset"] is None
+
+    result = log.search_checkin_logs("明天再来", start_date_str="2025-01-01", end_date_str="2025-01-31")
+    assert [record["message"] for record in result["records"]] == ["请明天再来"]
+
+
+def test_dimension_display_name_reverted(log_db):
+    for nickname in ("alice", "bob", "alice"):
+        log.save_checkin_logs([_entry(nickname=nickname)])
+    conn = log._get_connection()
+    assert conn.execute("SELECT nickname FROM log_users WHERE dim_key = '1001'").fetchone()[0] == "alice"
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import scheduler_api
+
+
+@pytest.fixture
+def scheduled_jobs(monkeypatch):
+    jobs = []
+    monkeypatch.setattr(scheduler_api.scheduler, "add_job", lambda *args, **kwargs: jobs.append(kwargs))
+    return jobs
+
+
+def _window_end_in(seconds):
+    return lambda task_config, now: now + timedelta(seconds=seconds)
+
+
+def test_defer_counts_attempts(scheduled_jobs, monkeypatch):
+    monkeypatch.setattr(scheduler_api, "_retry_window_end", _window_end_in(3600))
+    run_at = scheduler_api.defer_checkin_task(1, "bot", "emby_bot", {}, 30, "Deferred", attempt=1)
+    assert run_at is not None
+    assert scheduled_jobs[0]["kwargs"] == {"attempt": 2}
+
+    limit = scheduler_api.CHECKIN_RETRY_MAX_ATTEMPTS
+    assert scheduler_api.defer_checkin_task(1, "bot", "emby_bot", {}, 30, "Deferred", attempt=limit) is None
+    assert len(scheduled_jobs) == 1
+
+
+def test_defer_respects_retry_window(scheduled_jobs, monkeypatch):
+    monkeypatch.setattr(scheduler_api, "_retry_window_end", _window_end_in(60))
+    assert scheduler_api.defer_checkin_task(1, "bot", "emby_bot", {}, 600, "Deferred") is None
+    assert scheduled_jobs == []
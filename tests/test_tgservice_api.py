@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from utils.tgservice_api import CircuitBreaker, TGServiceClient
+
+
+def _client(handler, threshold=1, cooldown=0.05):
+    client = TGServiceClient(base_url="http://tgservice", max_retries=0, transport=httpx.MockTransport(handler))
+    client.breaker = CircuitBreaker(threshold=threshold, cooldown=cooldown)
+    return client
+
+
+def _resolve(client):
+    return client.call("resolve_entity", "/entities/resolve", {}, "解析实体")
+
+
+def test_breaker_allows_single_probe_after_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow_request() is False
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow_request() is True
+    assert breaker.allow_request() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request() is True
+
+
+def test_breaker_recovers_after_unexpected_error_in_probe():
+    responses = iter([ValueError("boom"), ValueError("boom again"), {"success": True}])
+
+    def handler(request):
+        outcome = next(responses)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(200, json=outcome)
+
+    client = _client(handler)
+
+    async def scenario():
+        assert (await _resolve(client))["success"] is False
+        assert client.breaker.state == "open"
+        await asyncio.sleep(0.06)
+        # 半开状态下的探测请求抛出非网络异常，也必须释放探测名额并重新熔断
+        assert (await _resolve(client))["success"] is False
+        assert client.breaker.state == "open"
+        await asyncio.sleep(0.06)
+        return await _resolve(client)
+
+    assert asyncio.run(scenario()) == {"success": True}
+    assert client.breaker.state == "closed"
+
+
+def test_cancelled_probe_releases_breaker():
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def slow_handler(request):
+            started.set()
+            await asyncio.sleep(10)
+            return httpx.Response(200, json={"success": True})
+
+        client = _client(slow_handler)
+        client.breaker.record_failure()
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(_resolve(client))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert client.breaker.allow_request() is True
+
+    asyncio.run(scenario())
+
+
+def test_unregistered_loop_does_not_keep_pool():
+    client = _client(lambda request: httpx.Response(200, json={"success": True}))
+    assert asyncio.run(_resolve(client)) == {"success": True}
+    assert len(client._clients) == 0
+
+
+def test_registered_loop_reuses_pool():
+    client = _client(lambda request: httpx.Response(200, json={"success": True}))
+
+    async def scenario():
+        client.register_loop(asyncio.get_running_loop())
+        await _resolve(client)
+        pooled = client._clients[asyncio.get_running_loop()]
+        await _resolve(client)
+        assert client._clients[asyncio.get_running_loop()] is pooled
+        await client.aclose()
+        assert pooled.is_closed
+        assert len(client._clients) == 0
+
+    asyncio.run(scenario())
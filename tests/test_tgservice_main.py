@@ -0,0 +1,40 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+from telethon import errors
+
+from tgservice.entity_cache import EntityCache
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    # 导入时会按相对路径读取 data/ 下的配置，切到临时目录避免触碰仓库
+    monkeypatch.chdir(tmp_path)
+    main = importlib.import_module("tgservice.main")
+    monkeypatch.setattr(main.client_manager, "entity_cache", EntityCache(str(tmp_path / "entity_cache.db")))
+    return main
+
+
+class _ForbiddenPeerClient:
+    async def send_message(self, entity, message):
+        raise errors.PeerIdInvalidError(request=None)
+
+
+def test_strategy_entity_error_invalidates_cache(service, monkeypatch):
+    cache = service.client_manager.entity_cache
+
+    async def fake_get_entity(session_name, client, identifier):
+        return SimpleNamespace(id=-100123, title="Emby 群")
+
+    monkeypatch.setattr(service.client_manager, "get_entity", fake_get_entity)
+    invalidated = []
+    monkeypatch.setattr(cache, "invalidate", lambda session_name, identifier=None: invalidated.append((session_name, identifier)))
+
+    request = service.ActionRequest(session_name="alice", target_entity_identifier=-100123,
+                                    strategy_id="send_custom_message", task_config={"message_content": "冒泡"})
+    result = asyncio.run(service._run_strategy(request, _ForbiddenPeerClient()))
+
+    assert result["success"] is False
+    assert invalidated == [("alice", -100123)]
@@ -1,19 +1,76 @@
-import asyncio, re, base64, httpx, io, json
+import asyncio, re, base64, httpx, io, json, time
+from contextlib import contextmanager
 from telethon import events, errors
-from utils.config import load_config
+from utils.config import get_config_snapshot
+
+# Telegram 要求等待的限流错误：需要把等待时间交给调用方处理，而不是当作普通失败吞掉
+FLOOD_WAIT_ERRORS = (errors.FloodWaitError, errors.SlowModeWaitError)
+
+# 目标实体无效或不可访问的错误：缓存的 id / access_hash 可能已失效，需要让调用方清除实体缓存
+ENTITY_ERRORS = (ValueError, errors.PeerIdInvalidError, errors.ChannelPrivateError, errors.ChannelInvalidError,
+                 errors.ChatIdInvalidError, errors.UserIdInvalidError, errors.InputUserDeactivatedError)
+
+class PhaseTimer:
+    """按阶段累计一次签到执行的耗时（毫秒），同名阶段多次出现时累加。"""
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - phase_started)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds * 1000
+
+    def as_dict(self):
+        timings = {name: round(ms, 1) for name, ms in self.phases.items()}
+        timings["total"] = round((time.perf_counter() - self._started) * 1000, 1)
+        return timings
+
+class StrategyContext:
+    """一次执行的上下文：会话名及 ClientManager 缓存的当前账号信息，避免策略中重复调用 get_me。"""
+
+    def __init__(self, session_name=None, me=None):
+        self.session_name = session_name
+        self.me = me
 
 class CheckinStrategy:
-    def __init__(self, client, target_entity, logger, nickname_for_logging, task_config=None):
+    def __init__(self, client, target_entity, logger, nickname_for_logging, task_config=None, timer=None, rate_limiter=None,
+                 context=None):
         self.client = client
         self.target_entity = target_entity
         self.logger = logger
         self.nickname_for_logging = nickname_for_logging
         self.task_config = task_config if task_config else {}
         self.timeout_seconds = 10
+        self.timer = timer if timer else PhaseTimer()
+        self.rate_limiter = rate_limiter
+        self.context = context if context else StrategyContext()
+        self.flood_error = None
+        self.entity_error = None
+
+    def _record_error(self, error):
+        """策略内部吞掉的异常若与目标实体有关，记下来交给 execute_action 清除实体缓存。"""
+        if isinstance(error, ENTITY_ERRORS):
+            self.entity_error = error
+
+    async def _throttle(self):
+        """发送消息或点击按钮前从会话令牌桶取令牌，避免同一账号短时间内突发请求触发 FloodWait。"""
+        if self.rate_limiter:
+            with self.timer.phase("rate_limit"):
+                await self.rate_limiter.throttle_message()
 
     async def send_command(self, command_text):
         target_display_name = getattr(self.target_entity, 'username', getattr(self.target_entity, 'title', str(self.target_entity.id)))
-        await self.client.send_message(self.target_entity, command_text)
+        await self._throttle()
+        with self.timer.phase("send_command"):
+            await self.client.send_message(self.target_entity, command_text)
         self.logger.info(f"用户 {self.nickname_for_logging}: 已发送命令 '{command_text}' 给 {target_display_name}")
 
     async def _parse_response_text(self, text_content):
@@ -54,8 +111,15 @@ class CheckinStrategy:
                         if message_obj.chat_id != self.target_entity.id:
                             self.logger.warning(f"用户 {self.nickname_for_logging}: 按钮所在消息的chat_id ({message_obj.chat_id}) 与目标实体ID ({self.target_entity.id}) 不匹配。不点击。")
                             return None
-                        return await button.click()
+                        await self._throttle()
+                        with self.timer.phase("button_click"):
+                            return await button.click()
+                    except FLOOD_WAIT_ERRORS as e:
+                        # 点击常在事件处理器中进行，异常无法向上传递，先记下交给 execute_action 处理
+                        self.flood_error = e
+                        return e
                     except Exception as e:
+                        self._record_error(e)
                         self.logger.error(f"用户 {self.nickname_for_logging}: 点击按钮 '{current_button_text}' (消息 ID {message_obj.id}) 失败: {e}", exc_info=True)
                         return e
         self.logger.warning(f"用户 {self.nickname_for_logging}: 在消息 ID {message_obj.id} 中未找到符合关键词 '{keywords}' 的按钮。")
@@ -99,7 +163,8 @@ class CheckinStrategy:
         self.logger.info(f"用户 {self.nickname_for_logging}: (_execute_initial_step) 等待来自 {target_display_name_log} 的初始响应 (超时: {self.timeout_seconds} 秒)...")
 
         try:
-            await asyncio.wait_for(action_taken_event.wait(), timeout=self.timeout_seconds)
+            with self.timer.phase("wait_initial_response"):
+                await asyncio.wait_for(action_taken_event.wait(), timeout=self.timeout_seconds)
         except asyncio.TimeoutError:
             self.logger.warning(f"用户 {self.nickname_for_logging}: (_execute_initial_step) 等待初始响应超时。")
             result_holder["value"] = (None, None, asyncio.TimeoutError("等待初始响应超时"))
@@ -110,6 +175,12 @@ class CheckinStrategy:
         
         return result_holder["value"]
 
+    async def _get_me(self):
+        if self.context.me is None:
+            with self.timer.phase("get_me"):
+                self.context.me = await self.client.get_me()
+        return self.context.me
+
     async def execute(self):
         raise NotImplementedError("子类必须实现 execute 方法")
 
@@ -142,11 +213,13 @@ class StartCommandButtonAlertStrategy(CheckinStrategy):
 
     async def _process_follow_up_message(self):
         self.logger.info(f"用户 {self.nickname_for_logging}: 等待后续聊天消息 (默认2.5秒)。")
-        await asyncio.sleep(2.5) 
-        messages_after_click = await self.client.get_messages(self.target_entity, limit=1)
+        with self.timer.phase("follow_up_sleep"):
+            await asyncio.sleep(2.5) 
+        with self.timer.phase("get_messages"):
+            messages_after_click = await self.client.get_messages(self.target_entity, limit=1)
         if messages_after_click:
             if messages_after_click[0].sender_id == self.target_entity.id or \
-               messages_after_click[0].sender_id == (await self.client.get_me()).id:
+               messages_after_click[0].sender_id == (await self._get_me()).id:
                 chat_response_text = messages_after_click[0].text
                 self.logger.info(f"用户 {self.nickname_for_logging}: 机器人后续聊天响应: {chat_response_text}")
                 return await self._parse_response_text(chat_response_text)
@@ -199,17 +272,23 @@ class CheckinCommandTextStrategy(CheckinStrategy):
             command_to_send = self.task_config.get("command", "/checkin")
 
             async with self.client.conversation(self.target_entity, timeout=self.timeout_seconds) as conv:
-                await conv.send_message(command_to_send)
+                await self._throttle()
+                with self.timer.phase("send_command"):
+                    await conv.send_message(command_to_send)
                 self.logger.info(f"用户 {self.nickname_for_logging}: (对话内)已发送命令 '{command_to_send}' 给 {target_display_name}")
                 
-                response = await conv.get_response()
+                with self.timer.phase("wait_response"):
+                    response = await conv.get_response()
                 response_message_text = response.text
                 self.logger.info(f"用户 {self.nickname_for_logging}: 收到来自 {target_display_name} 的响应: {response_message_text[:100]}...")
                 result = await self._parse_response_text(response_message_text)
         except asyncio.TimeoutError:
             self.logger.warning(f"用户 {self.nickname_for_logging}: 等待响应超时。")
             result = {"success": False, "message": "等待响应超时。"}
+        except FLOOD_WAIT_ERRORS:
+            raise
         except Exception as e:
+            self._record_error(e)
             self.logger.error(f"用户 {self.nickname_for_logging}: 处理响应时发生错误: {e}", exc_info=True)
             result = {"success": False, "message": f"处理响应时发生错误: {e}"}
             
@@ -226,19 +305,25 @@ class SendMessageToChatStrategy(CheckinStrategy):
 
         target_display_name = getattr(self.target_entity, 'title', str(self.target_entity.id))
         try:
-            await self.client.send_message(self.target_entity, message_content)
+            await self._throttle()
+            with self.timer.phase("send_message"):
+                await self.client.send_message(self.target_entity, message_content)
             self.logger.info(f"用户 {self.nickname_for_logging}: 消息已成功发送到 {target_display_name}。")
             return {"success": True, "message": f"消息已成功发送到 {target_display_name}。"}
         except errors.ChatWriteForbiddenError:
             self.logger.error(f"用户 {self.nickname_for_logging}: 没有权限向 {target_display_name} 发送消息。")
             return {"success": False, "message": f"没有权限向 {target_display_name} 发送消息。"}
+        except FLOOD_WAIT_ERRORS:
+            raise
         except Exception as e:
+            self._record_error(e)
             self.logger.error(f"用户 {self.nickname_for_logging}: 发送消息到 {target_display_name} 时发生错误: {e}", exc_info=True)
             return {"success": False, "message": f"发送消息时发生错误: {e}"}
 
 class MathCaptchaStrategy(CheckinStrategy):
-    def __init__(self, client, target_entity, logger, nickname_for_logging, task_config=None):
-        super().__init__(client, target_entity, logger, nickname_for_logging, task_config)
+    def __init__(self, client, target_entity, logger, nickname_for_logging, task_config=None, timer=None, rate_limiter=None,
+                 context=None):
+        super().__init__(client, target_entity, logger, nickname_for_logging, task_config, timer, rate_limiter, context)
         self.initial_button_text_keywords = task_config.get("initial_button_keywords", ['签到'])
         self.action_event = None
         self.timeout_seconds = task_config.get("timeout", 30) 
@@ -263,11 +348,13 @@ class MathCaptchaStrategy(CheckinStrategy):
 
     async def _process_math_follow_up(self):
         self.logger.info(f"用户 {self.nickname_for_logging}: 等待数学验证后续聊天消息 (默认5秒)。")
-        await asyncio.sleep(5)
-        messages_after_click = await self.client.get_messages(self.target_entity, limit=1)
+        with self.timer.phase("follow_up_sleep"):
+            await asyncio.sleep(5)
+        with self.timer.phase("get_messages"):
+            messages_after_click = await self.client.get_messages(self.target_entity, limit=1)
         if messages_after_click:
             if messages_after_click[0].sender_id == self.target_entity.id or \
-               messages_after_click[0].sender_id == (await self.client.get_me()).id:
+               messages_after_click[0].sender_id == (await self._get_me()).id:
                 chat_response_text = messages_after_click[0].text
                 self.logger.info(f"用户 {self.nickname_for_logging}: 机器人后续聊天响应: {chat_response_text}")
                 return await self._parse_response_text(chat_response_text)
@@ -283,7 +370,8 @@ class MathCaptchaStrategy(CheckinStrategy):
         
         message_to_use_for_buttons = message_obj_from_event
         try:
-            refetched_message = await self.client.get_messages(self.target_entity, ids=message_obj_from_event.id)
+            with self.timer.phase("get_messages"):
+                refetched_message = await self.client.get_messages(self.target_entity, ids=message_obj_from_event.id)
             if refetched_message:
                 buttons_repr_refetch = "No buttons"
                 if hasattr(refetched_message, 'buttons') and refetched_message.buttons:
@@ -439,7 +527,8 @@ class MathCaptchaStrategy(CheckinStrategy):
             self.client.add_event_handler(active_captcha_handler, events.MessageEdited(chats=self.target_entity.id, from_users=self.target_entity.id))
 
             self.logger.info(f"用户 {self.nickname_for_logging}: MathCaptcha等待验证码消息 (超时: {self.timeout_seconds} 秒)...")
-            await asyncio.wait_for(self.action_event.wait(), timeout=self.timeout_seconds)
+            with self.timer.phase("wait_captcha"):
+                await asyncio.wait_for(self.action_event.wait(), timeout=self.timeout_seconds)
             self.logger.info(f"用户 {self.nickname_for_logging}: MathCaptchaStrategy 操作完成。最终结果: {current_result}")
 
         except asyncio.TimeoutError:
@@ -448,7 +537,10 @@ class MathCaptchaStrategy(CheckinStrategy):
                 current_result = {"success": False, "message": f"等待验证码消息超时。初始弹框提示: '{initial_alert_text_for_timeout_msg}'"}
             else:
                  current_result = {"success": False, "message": f"操作超时，当前验证码阶段状态: {current_captcha_state}, 部分结果: {current_result.get('message')}"}
+        except FLOOD_WAIT_ERRORS:
+            raise
         except Exception as e_execute:
+            self._record_error(e_execute)
             self.logger.error(f"用户 {self.nickname_for_logging}: MathCaptchaStrategy execute 发生意外错误: {e_execute}", exc_info=True)
             current_result = {"success": False, "message": f"执行策略时发生意外错误: {e_execute}"}
         finally:
@@ -465,10 +557,11 @@ class MathCaptchaStrategy(CheckinStrategy):
         return current_result
 
 class VisionCaptchaStrategy(CheckinStrategy):
-    def __init__(self, client, target_entity, logger, nickname_for_logging, task_config=None):
-        super().__init__(client, target_entity, logger, nickname_for_logging, task_config)
+    def __init__(self, client, target_entity, logger, nickname_for_logging, task_config=None, timer=None, rate_limiter=None,
+                 context=None):
+        super().__init__(client, target_entity, logger, nickname_for_logging, task_config, timer, rate_limiter, context)
         self.timeout_seconds = task_config.get("timeout", 60)
-        llm_settings = load_config().get('llm_settings', {})
+        llm_settings = get_config_snapshot().get('llm_settings', {})
         self.base_api_url = llm_settings.get('api_url', '').strip().rstrip('/')
         self.api_key = llm_settings.get('api_key')
         self.model_name = llm_settings.get('model_name')
@@ -547,16 +640,20 @@ class VisionCaptchaStrategy(CheckinStrategy):
 
         try:
             async with self.client.conversation(self.target_entity, timeout=self.timeout_seconds) as conv:
-                await conv.send_message(command_to_send)
+                await self._throttle()
+                with self.timer.phase("send_command"):
+                    await conv.send_message(command_to_send)
                 self.logger.info(f"用户 {self.nickname_for_logging}: (对话内)已发送命令 '{command_to_send}'")
                 
-                response_message = await conv.get_response()
+                with self.timer.phase("wait_response"):
+                    response_message = await conv.get_response()
 
                 if response_message and response_message.photo:
                     self.logger.info(f"用户 {self.nickname_for_logging}: 收到图片消息，准备下载并识别。")
                     
                     image_bytes_io = io.BytesIO()
-                    await self.client.download_media(response_message.photo, file=image_bytes_io)
+                    with self.timer.phase("download_media"):
+                        await self.client.download_media(response_message.photo, file=image_bytes_io)
                     image_bytes = image_bytes_io.getvalue()
 
                     available_options = []
@@ -570,7 +667,8 @@ class VisionCaptchaStrategy(CheckinStrategy):
                         self.logger.warning(f"用户 {self.nickname_for_logging}: 收到图片消息但未找到任何按钮选项。")
                         return {"success": False, "message": "收到图片消息但未找到任何按钮选项。"}
 
-                    api_result = await self._call_vision_api(image_bytes, available_options)
+                    with self.timer.phase("vision_api"):
+                        api_result = await self._call_vision_api(image_bytes, available_options)
 
                     if not api_result.get("success"):
                         return {"success": False, "message": api_result.get("message", "图片识别失败。")}
@@ -598,7 +696,8 @@ class VisionCaptchaStrategy(CheckinStrategy):
                     else:
                         self.logger.info(f"用户 {self.nickname_for_logging}: 点击按钮后无弹框，等待后续消息。")
                         try:
-                            follow_up_message = await conv.get_response(timeout=5)
+                            with self.timer.phase("wait_follow_up"):
+                                follow_up_message = await conv.get_response(timeout=5)
                             if follow_up_message and follow_up_message.text:
                                 self.logger.info(f"用户 {self.nickname_for_logging}: 收到后续响应: {follow_up_message.text}")
                                 return await self._parse_response_text(follow_up_message.text)
@@ -623,7 +722,10 @@ class VisionCaptchaStrategy(CheckinStrategy):
         except errors.rpcerrorlist.MessageNotModifiedError:
             self.logger.warning(f"用户 {self.nickname_for_logging}: 消息未修改，这通常是良性的，但表明没有新内容。")
             return {"success": False, "message": "消息无变化，可能操作已完成或无新动态。"}
+        except FLOOD_WAIT_ERRORS:
+            raise
         except Exception as e:
+            self._record_error(e)
             self.logger.error(f"用户 {self.nickname_for_logging}: VisionCaptchaStrategy 执行时发生意外错误: {e}", exc_info=True)
             return {"success": False, "message": f"执行图片验证码策略时发生未知错误: {e}"}
 
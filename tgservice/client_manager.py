@@ -1,21 +1,52 @@
 import logging
 import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from telethon import TelegramClient
+from .session_limiter import SessionLimiter
+from .entity_cache import EntityCache
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
 
 import sys
 sys.path.append(PROJECT_ROOT)
-from utils.config import load_config
+from utils.config import get_config_snapshot
+from utils.job_schedule import get_next_checkin_times
 
 logger = logging.getLogger(__name__)
 
+CONFIG_WATCH_INTERVAL = float(os.environ.get("CONFIG_WATCH_INTERVAL", "5"))
+STARTUP_CONCURRENCY = int(os.environ.get("TG_STARTUP_CONCURRENCY", "5"))
+SESSION_CONNECT_TIMEOUT = float(os.environ.get("TG_SESSION_CONNECT_TIMEOUT", "30"))
+# persistent: 所有已登录会话常驻连接；lazy: 按需连接，空闲超时后断开
+CLIENT_MODE = os.environ.get("TG_CLIENT_MODE", "persistent").lower()
+CLIENT_IDLE_TTL = float(os.environ.get("TG_CLIENT_IDLE_TTL", "600"))
+MAX_CONNECTED_CLIENTS = int(os.environ.get("TG_MAX_CONNECTED_CLIENTS", "0"))
+PREWARM_LEAD = float(os.environ.get("TG_PREWARM_LEAD", "120"))
+LAZY_MAINTENANCE_INTERVAL = 30
+# 启动预取时同一会话相邻两次解析之间的间隔，避免 ResolveUsername 触发限流
+ENTITY_PREFETCH_DELAY = float(os.environ.get("TG_ENTITY_PREFETCH_DELAY", "1"))
+# 登录后 Web 应用写入配置前的宽限期，期间配置中暂时没有该会话也不会被断开
+PENDING_SESSION_GRACE = float(os.environ.get("TG_PENDING_SESSION_GRACE", "300"))
+
 class ClientManager:
     def __init__(self):
         self._clients = {}
         self._temp_login_clients = {}
-        self.config = load_config()
+        self._limiters = {}
+        self._connect_waiters = {}
+        self._connecting = set()
+        self._last_used = {}
+        self._leases = {}
+        self._pending_sessions = {}
+        self.lazy_mode = CLIENT_MODE == "lazy"
+        self.entity_cache = EntityCache(os.path.join(DATA_DIR, 'entity_cache.db'))
+        self.startup_progress = {"total": 0, "done": 0, "connected": 0, "failed": 0,
+                                 "started_at": None, "finished_at": None}
+        self.config = get_config_snapshot()
+        self._config_lock = asyncio.Lock()
 
     def create_temp_login_client(self, phone_number: str):
         if phone_number in self._temp_login_clients:
@@ -52,42 +83,99 @@ class ClientManager:
                 except OSError as e:
                     logger.error(f"删除临时会话文件 {session_file_path} 时出错: {e}")
 
+    def _mark_connecting(self, session_name, nickname):
+        """登记一个即将连接的会话，让 wait_for_client 在连接完成前可以等待它。"""
+        waiter = self._connect_waiters.get(session_name)
+        if waiter is None or waiter.is_set():
+            self._connect_waiters[session_name] = asyncio.Event()
+        if self.get_client(session_name) is None:
+            self._clients[session_name] = {"client": None, "nickname": nickname, "status": "connecting"}
+
     async def initialize_clients(self):
+        """以有限并发连接所有已登录会话，并在 startup_progress 中记录就绪进度。"""
         logger.info("正在初始化所有Telegram客户端...")
         api_id = self.config.get('api_id')
         api_hash = self.config.get('api_hash')
+        progress = self.startup_progress
+        progress.update(total=0, done=0, connected=0, failed=0, started_at=time.time(), finished_at=None)
 
         if not api_id or not api_hash:
             logger.warning("API ID 或 API Hash 未配置，无法初始化客户端。")
+            progress["finished_at"] = time.time()
             return
 
-        for user in self.config.get('users', []):
-            if user.get('status') == 'logged_in' and user.get('session_name'):
-                session_name = user['session_name']
-                nickname = user.get('nickname', '未知用户')
+        sessions = self._logged_in_sessions(self.config)
+        progress["total"] = len(sessions)
+        if self.lazy_mode:
+            for session_name, nickname in sessions.items():
+                self._register_idle(session_name, nickname)
+            progress.update(done=len(sessions), finished_at=time.time())
+            logger.info(f"按需连接模式: 已登记 {len(sessions)} 个会话，将在需要时再连接。")
+            return
+        for session_name, nickname in sessions.items():
+            self._mark_connecting(session_name, nickname)
+
+        semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+
+        async def _connect(session_name, nickname):
+            async with semaphore:
                 await self.add_or_update_client(session_name, api_id, api_hash, nickname)
+            progress["done"] += 1
+            if self.get_client(session_name):
+                progress["connected"] += 1
+            else:
+                progress["failed"] += 1
+
+        async with self._config_lock:
+            await asyncio.gather(*(_connect(name, nickname) for name, nickname in sessions.items()))
+        progress["finished_at"] = time.time()
+        logger.info(f"客户端初始化完成: {progress['connected']}/{progress['total']} 个会话已连接，"
+                    f"耗时 {progress['finished_at'] - progress['started_at']:.1f} 秒。")
+
+    async def _connect_and_authorize(self, client):
+        """连接并确认授权，返回当前账号信息（同时缓存下来供策略使用），未授权时返回 None。"""
+        await client.connect()
+        if not await client.is_user_authorized():
+            return None
+        return await client.get_me()
 
     async def add_or_update_client(self, session_name, api_id, api_hash, nickname):
-        if session_name in self._clients and self._clients[session_name]['client'].is_connected():
+        if self.get_client(session_name) and self._clients[session_name]['client'].is_connected():
             logger.info(f"用户 {nickname} (会话: {session_name}) 的客户端已存在且已连接，无需重复创建。")
             return
 
+        if session_name in self._connecting:
+            await self._connect_waiters[session_name].wait()
+            return
+
+        self._connecting.add(session_name)
+        self._mark_connecting(session_name, nickname)
         logger.info(f"用户 {nickname}: 正在为会话 {session_name} 创建新的客户端实例。")
         session_path = os.path.join(DATA_DIR, session_name)
         client = TelegramClient(session_path, api_id, api_hash)
 
         try:
-            await client.connect()
-            if await client.is_user_authorized():
-                self._clients[session_name] = {"client": client, "nickname": nickname, "status": "connected"}
+            me = await asyncio.wait_for(self._connect_and_authorize(client), timeout=SESSION_CONNECT_TIMEOUT)
+            if me:
+                self._clients[session_name] = {"client": client, "nickname": nickname, "status": "connected", "me": me}
                 logger.info(f"用户 {nickname} (会话: {session_name}): 客户端已成功连接并授权。")
             else:
                 await client.disconnect()
                 self._clients[session_name] = {"client": None, "nickname": nickname, "status": "auth_failed"}
                 logger.warning(f"用户 {nickname} (会话: {session_name}): 客户端连接后未授权，请刷新登录。")
+        except asyncio.TimeoutError:
+            self._clients[session_name] = {"client": None, "nickname": nickname, "status": "connect_timeout"}
+            logger.error(f"用户 {nickname} (会话: {session_name}): 连接客户端超时 ({SESSION_CONNECT_TIMEOUT} 秒)。")
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
         except Exception as e:
             self._clients[session_name] = {"client": None, "nickname": nickname, "status": "connect_failed"}
             logger.error(f"用户 {nickname} (会话: {session_name}): 连接客户端时发生错误: {e}", exc_info=True)
+        finally:
+            self._connecting.discard(session_name)
+            self._connect_waiters[session_name].set()
 
     async def disconnect_all(self):
         logger.info("正在断开所有客户端连接...")
@@ -107,61 +195,384 @@ class ClientManager:
         if session_name in self._clients:
             data = self._clients.pop(session_name)
             client = data.get("client")
-            if client:
-                if client.is_connected():
-                    try:
-                        await client.disconnect()
-                        logger.info(f"会话 {session_name} 已成功断开。")
-                    except Exception as e:
-                        logger.error(f"断开会话 {session_name} 时发生错误: {e}")
-                
-                session_file_path = os.path.join(DATA_DIR, f"{session_name}.session")
-                if os.path.exists(session_file_path):
-                    try:
-                        os.remove(session_file_path)
-                        logger.info(f"会话文件 {session_file_path} 已成功删除。")
-                    except OSError as e:
-                        logger.error(f"删除会话文件 {session_file_path} 时出错: {e}")
+            if client and client.is_connected():
+                try:
+                    await client.disconnect()
+                    logger.info(f"会话 {session_name} 已成功断开。")
+                except Exception as e:
+                    logger.error(f"断开会话 {session_name} 时发生错误: {e}")
+
+            # 按需连接模式下空闲会话或连接失败的会话没有客户端实例，会话文件同样需要删除
+            session_file_path = os.path.join(DATA_DIR, f"{session_name}.session")
+            if os.path.exists(session_file_path):
+                try:
+                    os.remove(session_file_path)
+                    logger.info(f"会话文件 {session_file_path} 已成功删除。")
+                except OSError as e:
+                    logger.error(f"删除会话文件 {session_file_path} 时出错: {e}")
+            self._limiters.pop(session_name, None)
+            self._last_used.pop(session_name, None)
+            self._pending_sessions.pop(session_name, None)
+            self.entity_cache.invalidate(session_name)
             logger.info(f"会话 {session_name} 已从管理器中移除。")
             return True
         else:
             logger.warning(f"尝试移除一个不存在的会话: {session_name}")
             return False
 
+    async def detach_client(self, session_name):
+        data = self._clients.pop(session_name, None)
+        if not data:
+            return False
+        client = data.get("client")
+        if client and client.is_connected():
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logger.error(f"断开会话 {session_name} 时发生错误: {e}")
+        logger.info(f"会话 {session_name} 已从配置中移除，客户端已断开。")
+        return True
+
+    def mark_pending(self, session_name):
+        """登录或手动添加的会话要等 Web 应用保存配置后才会出现在配置中，在此之前标记为待确认。"""
+        self._pending_sessions[session_name] = time.monotonic()
+
+    def _is_pending(self, session_name, now):
+        added_at = self._pending_sessions.get(session_name)
+        if added_at is None:
+            return False
+        if now - added_at < PENDING_SESSION_GRACE:
+            return True
+        del self._pending_sessions[session_name]
+        logger.warning(f"会话 {session_name} 登录后 {int(PENDING_SESSION_GRACE)} 秒内仍未写入配置，将按配置移除。")
+        return False
+
+    def _logged_in_sessions(self, config):
+        sessions = {}
+        for user in config.get('users', []):
+            if user.get('status') == 'logged_in' and user.get('session_name'):
+                sessions[user['session_name']] = user.get('nickname', '未知用户')
+        return sessions
+
+    async def apply_config(self, new_config):
+        """对比新旧配置并增量更新客户端：连接新增会话、断开已移除会话，API 凭据变化时重新绑定全部客户端。
+        刚登录、尚未写入配置的待确认会话在宽限期内不会被断开。"""
+        async with self._config_lock:
+            old_config = self.config
+            self.config = new_config
+            api_id = new_config.get('api_id')
+            api_hash = new_config.get('api_hash')
+            credentials_changed = (old_config.get('api_id'), old_config.get('api_hash')) != (api_id, api_hash)
+            desired_sessions = self._logged_in_sessions(new_config)
+
+            for session_name in desired_sessions:
+                self._pending_sessions.pop(session_name, None)
+            now = time.monotonic()
+            removed = [name for name in self._clients
+                       if name not in desired_sessions and not self._is_pending(name, now)]
+            for session_name in removed:
+                await self.detach_client(session_name)
+
+            if credentials_changed:
+                logger.info("检测到 API ID/Hash 变化，将使用新凭据重新连接所有客户端。")
+                for session_name in list(self._clients):
+                    await self.detach_client(session_name)
+
+            if not api_id or not api_hash:
+                if desired_sessions:
+                    logger.warning("API ID 或 API Hash 未配置，无法连接配置中的会话。")
+                return {"added": [], "removed": removed, "credentials_changed": credentials_changed}
+
+            added = []
+            for session_name, nickname in desired_sessions.items():
+                if session_name in self._clients:
+                    self._clients[session_name]["nickname"] = nickname
+                    continue
+                if self.lazy_mode:
+                    self._register_idle(session_name, nickname)
+                else:
+                    await self.add_or_update_client(session_name, api_id, api_hash, nickname)
+                added.append(session_name)
+
+            if added or removed or credentials_changed:
+                logger.info(f"配置变更已应用: 新增 {added}, 移除 {removed}, 凭据变化: {credentials_changed}")
+            return {"added": added, "removed": removed, "credentials_changed": credentials_changed}
+
+    async def reload_config(self):
+        snapshot = get_config_snapshot()
+        if snapshot is self.config:
+            return None
+        return await self.apply_config(snapshot)
+
+    async def watch_config(self, interval=CONFIG_WATCH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload_config()
+            except Exception as e:
+                logger.error(f"应用配置变更时发生错误: {e}", exc_info=True)
+
     def get_client(self, session_name):
         client_data = self._clients.get(session_name)
         if client_data and client_data.get("status") == "connected":
             return client_data["client"]
         return None
 
+    def get_me(self, session_name):
+        """返回连接或最近一次健康检查时缓存的当前账号信息。"""
+        client_data = self._clients.get(session_name)
+        return client_data.get("me") if client_data else None
+
+    async def wait_for_client(self, session_name, timeout):
+        """会话仍在连接中时最多等待 timeout 秒，返回已连接的客户端或 None。"""
+        client = self.get_client(session_name)
+        if client:
+            return client
+        waiter = self._connect_waiters.get(session_name)
+        if waiter is None or waiter.is_set():
+            return None
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.get_client(session_name)
+
+    def _register_idle(self, session_name, nickname):
+        if session_name not in self._clients:
+            self._clients[session_name] = {"client": None, "nickname": nickname, "status": "idle"}
+
+    def touch(self, session_name):
+        self._last_used[session_name] = time.monotonic()
+
+    async def _disconnect_idle(self, session_name, reason):
+        data = self._clients.get(session_name)
+        client = data.get("client") if data else None
+        if not client or self._leases.get(session_name):
+            return False
+        self._clients[session_name] = {"client": None, "nickname": data["nickname"], "status": "idle"}
+        try:
+            if client.is_connected():
+                await client.disconnect()
+        except Exception as e:
+            logger.error(f"断开会话 {session_name} 时发生错误: {e}")
+        logger.info(f"会话 {session_name} 已断开 ({reason})。")
+        return True
+
+    async def _evict_for_capacity(self):
+        """已连接数达到上限时，断开最久未使用且当前没有动作在执行的会话。"""
+        if not MAX_CONNECTED_CLIENTS:
+            return
+        connected = [name for name, data in self._clients.items() if data.get("status") == "connected"]
+        overflow = len(connected) + 1 - MAX_CONNECTED_CLIENTS
+        if overflow <= 0:
+            return
+        candidates = sorted((name for name in connected if not self._leases.get(name)),
+                            key=lambda name: self._last_used.get(name, 0.0))
+        for session_name in candidates[:overflow]:
+            await self._disconnect_idle(session_name, "已连接客户端数达到上限，按最近最少使用淘汰")
+        if len(candidates) < overflow:
+            logger.warning(f"已连接客户端数超过上限 {MAX_CONNECTED_CLIENTS}，但所有会话都在使用中，暂时超出上限。")
+
+    async def ensure_connected(self, session_name, timeout):
+        """返回会话的已连接客户端：按需连接模式下空闲会话会被立即连接，连接中的会话最多等待 timeout 秒。"""
+        client = await self.wait_for_client(session_name, timeout)
+        if client or not self.lazy_mode:
+            return client
+        data = self._clients.get(session_name)
+        if not data or data.get("status") not in ("idle", "connect_failed", "connect_timeout"):
+            return None
+        api_id = self.config.get('api_id')
+        api_hash = self.config.get('api_hash')
+        if not api_id or not api_hash:
+            return None
+        await self._evict_for_capacity()
+        await self.add_or_update_client(session_name, api_id, api_hash, data["nickname"])
+        self.touch(session_name)
+        return self.get_client(session_name)
+
+    @asynccontextmanager
+    async def use_client(self, session_name, timeout):
+        """在动作执行期间持有会话，防止被空闲回收或容量淘汰断开。"""
+        self._leases[session_name] = self._leases.get(session_name, 0) + 1
+        try:
+            yield await self.ensure_connected(session_name, timeout)
+        finally:
+            self._leases[session_name] -= 1
+            if not self._leases[session_name]:
+                del self._leases[session_name]
+            self.touch(session_name)
+
+    async def get_entity(self, session_name, client, identifier):
+        """优先使用持久化缓存中的实体，未命中或已过期时调用 get_entity 并写回缓存。"""
+        entity = self.entity_cache.get(session_name, identifier)
+        if entity is not None:
+            return entity
+        entity = await client.get_entity(identifier)
+        self.entity_cache.put(session_name, identifier, entity)
+        return entity
+
+    def _task_targets_by_session(self):
+        sessions = {user['telegram_id']: user['session_name'] for user in self.config.get('users', [])
+                    if user.get('session_name') and user.get('telegram_id') is not None}
+        targets = {}
+        for task in self.config.get('checkin_tasks', []):
+            session_name = sessions.get(task.get('user_telegram_id'))
+            identifier = task.get('bot_username') or task.get('target_chat_id')
+            if session_name and identifier:
+                targets.setdefault(session_name, []).append(identifier)
+        return targets
+
+    async def prefetch_task_entities(self):
+        """为 checkin_tasks 中引用的所有机器人和群组预先解析实体，只处理已连接的会话。"""
+        semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+        resolved = 0
+
+        async def _prefetch(session_name, identifiers):
+            nonlocal resolved
+            async with semaphore:
+                for identifier in identifiers:
+                    client = self.get_client(session_name)
+                    if not client:
+                        return
+                    if self.entity_cache.is_fresh(session_name, identifier):
+                        continue
+                    try:
+                        await self.get_entity(session_name, client, identifier)
+                        resolved += 1
+                    except Exception as e:
+                        logger.warning(f"预取实体 {identifier} (会话 {session_name}) 失败: {e}")
+                    await asyncio.sleep(ENTITY_PREFETCH_DELAY)
+
+        targets = self._task_targets_by_session()
+        await asyncio.gather(*(_prefetch(name, identifiers) for name, identifiers in targets.items()))
+        logger.info(f"签到目标实体预取完成，新解析 {resolved} 个实体。")
+        return resolved
+
+    def get_session_user_ids(self):
+        user_ids = {}
+        for user in self.config.get('users', []):
+            if user.get('session_name') and user.get('telegram_id') is not None:
+                user_ids[user['session_name']] = user['telegram_id']
+        return user_ids
+
+    async def _prewarm_scheduled(self):
+        next_times = await asyncio.to_thread(get_next_checkin_times)
+        if not next_times:
+            return
+        now = time.time()
+        for session_name, user_id in self.get_session_user_ids().items():
+            next_run = next_times.get(user_id)
+            data = self._clients.get(session_name)
+            if next_run is None or not data or data.get("status") != "idle":
+                continue
+            if now <= next_run <= now + PREWARM_LEAD:
+                logger.info(f"会话 {session_name} 将在 {int(next_run - now)} 秒后执行计划任务，提前连接。")
+                await self.ensure_connected(session_name, SESSION_CONNECT_TIMEOUT)
+
+    async def _reap_idle(self):
+        now = time.monotonic()
+        for session_name, data in list(self._clients.items()):
+            if data.get("status") != "connected" or self._leases.get(session_name):
+                continue
+            if now - self._last_used.setdefault(session_name, now) >= CLIENT_IDLE_TTL:
+                await self._disconnect_idle(session_name, f"空闲超过 {int(CLIENT_IDLE_TTL)} 秒")
+
+    async def run_lazy_maintenance(self, interval=LAZY_MAINTENANCE_INTERVAL):
+        """按需连接模式的后台任务：计划任务前预热连接，断开空闲超时的客户端。"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._prewarm_scheduled()
+                await self._reap_idle()
+            except Exception as e:
+                logger.error(f"维护按需连接的客户端时发生错误: {e}", exc_info=True)
+
+    def get_readiness(self):
+        progress = self.startup_progress
+        started_at = progress["started_at"]
+        finished_at = progress["finished_at"]
+        return {
+            "ready": finished_at is not None,
+            "total": progress["total"],
+            "done": progress["done"],
+            "connected": progress["connected"],
+            "failed": progress["failed"],
+            "connecting": len(self._connecting),
+            "elapsed_seconds": round((finished_at or time.time()) - started_at, 1) if started_at else 0.0,
+        }
+
+    def get_limiter(self, session_name):
+        limiter = self._limiters.get(session_name)
+        if limiter is None:
+            limiter = self._limiters[session_name] = SessionLimiter(session_name)
+        return limiter
+
+    def get_session_names(self):
+        return list(self._clients)
+
+    def get_nickname(self, session_name, default="未知用户"):
+        client_data = self._clients.get(session_name)
+        return client_data["nickname"] if client_data else default
+
+    def get_blocked_sessions(self):
+        """返回当前被 FloodWait / SlowMode 限制的会话及剩余等待时间。"""
+        blocked = {}
+        for name, data in list(self._clients.items()):
+            limiter = self._limiters.get(name)
+            info = limiter.get_block_info() if limiter else None
+            if info:
+                blocked[name] = {"nickname": data["nickname"], **info}
+        return blocked
+
     def get_all_clients_status(self):
         return {name: {"nickname": data["nickname"], "status": data["status"]} for name, data in self._clients.items()}
 
+    def get_sessions_health(self):
+        sessions = {}
+        for name, data in self._clients.items():
+            limiter = self._limiters.get(name)
+            sessions[name] = {
+                "nickname": data["nickname"],
+                "status": data["status"],
+                **(limiter.get_stats() if limiter else {}),
+            }
+        return sessions
+
     def get_active_sessions_count(self):
         return sum(1 for data in self._clients.values() if data.get("status") == "connected")
 
-    async def health_check_all_clients(self):
-        logger.info("开始执行客户端健康检查...")
+    async def check_client(self, session_name, timeout):
+        """检查单个会话：get_me 失败或超时则尝试重连，返回检查后会话是否可用及是否发生了重连。"""
+        data = self._clients.get(session_name)
+        if data and data.get("status") == "idle":
+            # 按需连接模式下空闲断开的会话无需检查，也不应被健康检查重新连上
+            return {"healthy": True, "reconnected": False}
+        if not data or session_name in self._connecting:
+            return {"healthy": data is not None and self.get_client(session_name) is not None, "reconnected": False}
+
+        client = data.get("client")
+        try:
+            if client and client.is_connected():
+                me = await asyncio.wait_for(client.get_me(), timeout=timeout)
+                if me:
+                    data["me"] = me
+                return {"healthy": True, "reconnected": False}
+        except Exception as e:
+            logger.warning(f"会话 {session_name} 的健康检查失败 (可能已断开): {type(e).__name__} {e}")
+
         api_id = self.config.get('api_id')
         api_hash = self.config.get('api_hash')
-
         if not api_id or not api_hash:
-            logger.warning("API ID 或 API Hash 未配置，无法执行健康检查。")
-            return
+            logger.warning("API ID 或 API Hash 未配置，无法重连会话。")
+            return {"healthy": False, "reconnected": False}
 
-        for session_name, data in list(self._clients.items()):
-            client = data.get("client")
-            is_connected = False
+        logger.warning(f"会话 {session_name} 未连接，尝试重新连接...")
+        # get_me 超时时旧客户端可能仍处于连接状态，先断开，避免与新客户端同时占用同一个会话文件
+        if client:
             try:
-                if client and client.is_connected():
-                    await client.get_me()
-                    is_connected = True
+                await client.disconnect()
             except Exception as e:
-                logger.warning(f"会话 {session_name} 的健康检查失败 (可能已断开): {e}")
-                is_connected = False
-
-            if not is_connected:
-                logger.warning(f"会话 {session_name} 未连接，尝试重新连接...")
-                self._clients[session_name]["status"] = "reconnecting"
-                await self.add_or_update_client(session_name, api_id, api_hash, data["nickname"])
-        logger.info("客户端健康检查完成。")
+                logger.error(f"断开会话 {session_name} 的旧客户端时发生错误: {e}")
+        self._clients[session_name] = {"client": None, "nickname": data["nickname"], "status": "reconnecting"}
+        await self.add_or_update_client(session_name, api_id, api_hash, data["nickname"])
+        return {"healthy": self.get_client(session_name) is not None, "reconnected": True}
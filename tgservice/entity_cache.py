@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from telethon import types
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_TTL = float(os.environ.get("TG_ENTITY_CACHE_TTL", str(7 * 86400)))
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS entity_cache (
+        session_name TEXT NOT NULL,
+        identifier TEXT NOT NULL,
+        entity_type TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        access_hash INTEGER,
+        username TEXT,
+        display_name TEXT,
+        flags TEXT,
+        resolved_at REAL NOT NULL,
+        PRIMARY KEY (session_name, identifier)
+    )
+'''
+
+def normalize_identifier(identifier):
+    """用户名不区分大小写且可带 @，数字 ID 统一成字符串。"""
+    text = str(identifier).strip()
+    if text.lstrip('-').isdigit():
+        return text
+    return text.lstrip('@').lower()
+
+def _entity_row(entity):
+    if isinstance(entity, types.User):
+        return "user", entity.first_name, {"bot": bool(entity.bot)}
+    if isinstance(entity, types.Channel):
+        return "channel", entity.title, {"megagroup": bool(entity.megagroup), "broadcast": bool(entity.broadcast)}
+    if isinstance(entity, types.Chat):
+        return "chat", entity.title, {}
+    return None, None, None
+
+def _build_entity(entity_type, entity_id, access_hash, username, display_name, flags):
+    """用缓存的 id / access_hash 重建 Telethon 实体对象，可直接用于发送消息和事件过滤。"""
+    if entity_type == "user":
+        return types.User(id=entity_id, access_hash=access_hash, username=username,
+                          first_name=display_name, bot=flags.get("bot", False))
+    if entity_type == "channel":
+        return types.Channel(id=entity_id, title=display_name, photo=types.ChatPhotoEmpty(), date=None,
+                             access_hash=access_hash, username=username,
+                             megagroup=flags.get("megagroup", False), broadcast=flags.get("broadcast", False))
+    if entity_type == "chat":
+        return types.Chat(id=entity_id, title=display_name, photo=types.ChatPhotoEmpty(),
+                          participants_count=0, date=None, version=0)
+    return None
+
+class EntityCache:
+    """按 (会话, 标识) 持久化实体解析结果，避免每次执行都调用 get_entity / ResolveUsername。"""
+
+    def __init__(self, db_path, ttl=ENTITY_CACHE_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def get(self, session_name, identifier):
+        """返回未过期的缓存实体，没有或已过期时返回 None。"""
+        row = self._connect().execute('''
+            SELECT entity_type, entity_id, access_hash, username, display_name, flags, resolved_at
+            FROM entity_cache WHERE session_name = ? AND identifier = ?
+        ''', (session_name, normalize_identifier(identifier))).fetchone()
+        if not row or time.time() - row[6] > self.ttl:
+            self.misses += 1
+            return None
+        try:
+            entity = _build_entity(*row[:5], json.loads(row[5] or "{}"))
+        except Exception as e:
+            logger.warning(f"无法从缓存重建实体 {identifier} (会话 {session_name}): {e}")
+            entity = None
+        if entity is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entity
+
+    def is_fresh(self, session_name, identifier):
+        row = self._connect().execute(
+            "SELECT resolved_at FROM entity_cache WHERE session_name = ? AND identifier = ?",
+            (session_name, normalize_identifier(identifier))).fetchone()
+        return bool(row) and time.time() - row[0] <= self.ttl
+
+    def put(self, session_name, identifier, entity):
+        entity_type, display_name, flags = _entity_row(entity)
+        if entity_type is None:
+            return
+        self._connect().execute('''
+            INSERT OR REPLACE INTO entity_cache
+                (session_name, identifier, entity_type, entity_id, access_hash, username, display_name, flags, resolved_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (session_name, normalize_identifier(identifier), entity_type, entity.id,
+              getattr(entity, 'access_hash', None), getattr(entity, 'username', None), display_name,
+              json.dumps(flags), time.time()))
+
+    def invalidate(self, session_name, identifier=None):
+        conn = self._connect()
+        if identifier is None:
+            deleted = conn.execute("DELETE FROM entity_cache WHERE session_name = ?", (session_name,)).rowcount
+        else:
+            deleted = conn.execute("DELETE FROM entity_cache WHERE session_name = ? AND identifier = ?",
+                                   (session_name, normalize_identifier(identifier))).rowcount
+        self.invalidations += deleted
+        return deleted
+
+    def get_stats(self):
+        count = self._connect().execute("SELECT COUNT(*) FROM entity_cache").fetchone()[0]
+        return {"entries": count, "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+from utils.job_schedule import get_next_checkin_times
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.environ.get("TG_HEALTH_CHECK_INTERVAL", "300"))
+HEALTH_CHECK_MIN_INTERVAL = float(os.environ.get("TG_HEALTH_CHECK_MIN_INTERVAL", "30"))
+HEALTH_CHECK_MAX_INTERVAL = float(os.environ.get("TG_HEALTH_CHECK_MAX_INTERVAL", "1800"))
+HEALTH_CHECK_CONCURRENCY = int(os.environ.get("TG_HEALTH_CHECK_CONCURRENCY", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("TG_HEALTH_CHECK_TIMEOUT", "15"))
+# 在会话的下一个签到作业之前提前多少秒做一次检查
+HEALTH_CHECK_PRE_TASK_LEAD = float(os.environ.get("TG_HEALTH_CHECK_PRE_TASK_LEAD", "60"))
+_SUPERVISE_INTERVAL = 10
+_JOB_TIMES_TTL = 30
+
+class SessionHealth:
+    def __init__(self, session_name):
+        self.session_name = session_name
+        self.checks = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.reconnects = 0
+        self.last_check_at = None
+        self.last_latency_ms = None
+        self.last_healthy = None
+        self.next_check_at = None
+        self.next_task_at = None
+
+    def as_dict(self):
+        now = time.time()
+        return {
+            "checks": self.checks,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "reconnects": self.reconnects,
+            "last_check_at": self.last_check_at,
+            "last_latency_ms": self.last_latency_ms,
+            "last_healthy": self.last_healthy,
+            "next_check_in": round(self.next_check_at - now, 1) if self.next_check_at else None,
+            "next_task_at": self.next_task_at,
+        }
+
+class HealthMonitor:
+    """为每个会话运行独立的健康检查协程：启动时随机错开，全局并发受限，
+    连续失败时退避，临近签到作业时提前检查，检查结果作为指标对外提供。"""
+
+    def __init__(self, client_manager):
+        self.client_manager = client_manager
+        self._semaphore = asyncio.Semaphore(HEALTH_CHECK_CONCURRENCY)
+        self._tasks = {}
+        self.sessions = {}
+        self._job_times = {}
+        self._job_times_loaded_at = 0.0
+
+    async def _next_task_at(self, session_name):
+        now = time.time()
+        if now - self._job_times_loaded_at > _JOB_TIMES_TTL:
+            self._job_times = await asyncio.to_thread(get_next_checkin_times)
+            self._job_times_loaded_at = now
+        user_id = self.client_manager.get_session_user_ids().get(session_name)
+        return self._job_times.get(user_id) if user_id is not None else None
+
+    def _next_interval(self, health, next_task_at):
+        if health.consecutive_failures:
+            interval = min(HEALTH_CHECK_MAX_INTERVAL, HEALTH_CHECK_MIN_INTERVAL * 2 ** (health.consecutive_failures - 1))
+        else:
+            interval = HEALTH_CHECK_INTERVAL
+            if next_task_at:
+                until_pre_check = next_task_at - HEALTH_CHECK_PRE_TASK_LEAD - time.time()
+                if 0 < until_pre_check < interval:
+                    interval = max(HEALTH_CHECK_MIN_INTERVAL, until_pre_check)
+        return interval * random.uniform(0.9, 1.1)
+
+    async def _check(self, session_name, health):
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                result = await self.client_manager.check_client(session_name, HEALTH_CHECK_TIMEOUT)
+            except Exception as e:
+                logger.error(f"会话 {session_name} 健康检查时发生错误: {e}", exc_info=True)
+                result = {"healthy": False, "reconnected": False}
+        health.checks += 1
+        health.last_check_at = time.time()
+        health.last_latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        health.last_healthy = result["healthy"]
+        if result["reconnected"]:
+            health.reconnects += 1
+        if result["healthy"]:
+            health.consecutive_failures = 0
+        else:
+            health.failures += 1
+            health.consecutive_failures += 1
+
+    async def _monitor(self, session_name):
+        health = self.sessions.setdefault(session_name, SessionHealth(session_name))
+        health.next_check_at = time.time() + random.uniform(0, HEALTH_CHECK_INTERVAL)
+        while True:
+            await asyncio.sleep(max(0.0, health.next_check_at - time.time()))
+            await self._check(session_name, health)
+            try:
+                health.next_task_at = await self._next_task_at(session_name)
+            except Exception as e:
+                logger.warning(f"获取会话 {session_name} 的计划任务时间失败: {e}")
+                health.next_task_at = None
+            health.next_check_at = time.time() + self._next_interval(health, health.next_task_at)
+
+    def _supervise(self):
+        current = set(self.client_manager.get_session_names())
+        for session_name in current - self._tasks.keys():
+            self._tasks[session_name] = asyncio.create_task(self._monitor(session_name))
+        for session_name in self._tasks.keys() - current:
+            self._tasks.pop(session_name).cancel()
+            self.sessions.pop(session_name, None)
+
+    async def run(self):
+        while True:
+            try:
+                self._supervise()
+            except Exception as e:
+                logger.error(f"维护会话健康检查任务时发生错误: {e}", exc_info=True)
+            await asyncio.sleep(_SUPERVISE_INTERVAL)
+
+    def get_metrics(self):
+        sessions = {name: health.as_dict() for name, health in self.sessions.items()}
+        return {
+            "monitored_sessions": len(sessions),
+            "unhealthy_sessions": sum(1 for item in sessions.values() if item["last_healthy"] is False),
+            "total_checks": sum(item["checks"] for item in sessions.values()),
+            "total_failures": sum(item["failures"] for item in sessions.values()),
+            "total_reconnects": sum(item["reconnects"] for item in sessions.values()),
+            "sessions": sessions,
+        }
@@ -2,21 +2,26 @@ import logging
 import asyncio
 import os
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Union
 from .client_manager import ClientManager, DATA_DIR
-from .checkin_strategies import get_strategy_class
+from .health_monitor import HealthMonitor
+from .checkin_strategies import get_strategy_class, PhaseTimer, StrategyContext, FLOOD_WAIT_ERRORS
 from telethon import errors
 
 import sys
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(PROJECT_ROOT)
-from utils.config import migrate_session_names
+from utils.config import run_config_migrations
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-migrate_session_names()
+run_config_migrations()
+
+# 会话仍在连接（例如服务刚启动）时，动作请求最多等待的秒数
+EXECUTE_CONNECT_WAIT = float(os.environ.get("TG_EXECUTE_CONNECT_WAIT", "20"))
 
 app = FastAPI(
     title="Telegram Service",
@@ -24,6 +29,7 @@ app = FastAPI(
 )
 
 client_manager = ClientManager()
+health_monitor = HealthMonitor(client_manager)
 
 class ActionRequest(BaseModel):
     session_name: str
@@ -39,6 +45,9 @@ class SessionManageRequest(BaseModel):
 class HealthCheckResponse(BaseModel):
     status: str = "ok"
     active_sessions: int
+    readiness: dict = {}
+    entity_cache: dict = {}
+    sessions: dict = {}
 
 class SendCodeRequest(BaseModel):
     phone: str
@@ -55,21 +64,32 @@ class ResolveEntityRequest(BaseModel):
 
 @app.post("/entities/resolve", tags=["实体解析"])
 async def resolve_entity(request: ResolveEntityRequest):
-    client = client_manager.get_client(request.session_name)
-    if not client:
-        raise HTTPException(status_code=404, detail=f"Session '{request.session_name}' not found or not connected.")
-    
-    try:
-        entity = await client.get_entity(request.entity_identifier)
-        return {
-            "success": True,
-            "id": entity.id,
-            "name": getattr(entity, 'title', getattr(entity, 'username', str(entity.id)))
-        }
-    except ValueError:
-        raise HTTPException(status_code=404, detail=f"Could not find entity: {request.entity_identifier}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async with client_manager.use_client(request.session_name, EXECUTE_CONNECT_WAIT) as client:
+        if not client:
+            raise HTTPException(status_code=404, detail=f"Session '{request.session_name}' not found or not connected.")
+
+        try:
+            entity = await client_manager.get_entity(request.session_name, client, request.entity_identifier)
+            return {
+                "success": True,
+                "id": entity.id,
+                "name": getattr(entity, 'title', getattr(entity, 'username', str(entity.id)))
+            }
+        except ValueError:
+            client_manager.entity_cache.invalidate(request.session_name, request.entity_identifier)
+            raise HTTPException(status_code=404, detail=f"Could not find entity: {request.entity_identifier}")
+        except Exception as e:
+            client_manager.entity_cache.invalidate(request.session_name, request.entity_identifier)
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/config/reload", tags=["配置"])
+async def reload_config():
+    changes = await client_manager.reload_config()
+    return {"success": True, "changed": changes is not None, "changes": changes or {}}
+
+@app.get("/config/version", tags=["配置"])
+async def config_version():
+    return {"revision": client_manager.config.get("revision", 0)}
 
 @app.get("/", tags=["通用"])
 async def root():
@@ -78,7 +98,18 @@ async def root():
 @app.get("/health", response_model=HealthCheckResponse, tags=["健康检查"])
 async def health_check():
     active_sessions = client_manager.get_active_sessions_count()
-    return HealthCheckResponse(status="ok", active_sessions=active_sessions)
+    return HealthCheckResponse(status="ok", active_sessions=active_sessions, readiness=client_manager.get_readiness(),
+                               entity_cache=client_manager.entity_cache.get_stats(),
+                               sessions=client_manager.get_sessions_health())
+
+@app.get("/health/monitors", tags=["健康检查"])
+async def health_monitor_metrics():
+    return health_monitor.get_metrics()
+
+@app.get("/ready", tags=["健康检查"])
+async def readiness_check():
+    readiness = client_manager.get_readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
 
 @app.post("/login/send_code", tags=["登录管理"])
 async def send_code(request: SendCodeRequest):
@@ -150,6 +181,7 @@ async def sign_in(request: SignInRequest):
         else:
             logger.warning(f"未找到预期的临时会话文件: {temp_session_path}")
 
+        client_manager.mark_pending(session_name)
         await client_manager.add_or_update_client(session_name, api_id, api_hash, user.first_name or user.username)
 
         return {
@@ -174,42 +206,97 @@ async def sign_in(request: SignInRequest):
     finally:
         await client_manager.remove_temp_login_client(request.phone)
 
+def _flood_wait_exception(session_name, retry_after, reason):
+    return HTTPException(
+        status_code=429,
+        detail={
+            "success": False,
+            "message": f"会话 {session_name} 被 Telegram 限流 ({reason})，需等待 {retry_after} 秒。",
+            "retry_after": retry_after,
+            "reason": reason,
+        },
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def _block_session(limiter, error, target):
+    if isinstance(error, errors.SlowModeWaitError):
+        reason, block_target = "slow_mode", target
+    else:
+        reason, block_target = "flood_wait", None
+    limiter.block(error.seconds, reason, block_target)
+    logger.warning(f"会话 {limiter.session_name} 触发 {type(error).__name__}，需等待 {error.seconds} 秒"
+                   f"{'（仅限目标 ' + str(target) + '）' if block_target is not None else ''}。")
+    return _flood_wait_exception(limiter.session_name, error.seconds, reason)
+
+@app.get("/sessions/blocked", tags=["会话管理"])
+async def blocked_sessions():
+    return {"success": True, "blocked": client_manager.get_blocked_sessions()}
+
 @app.post("/actions/execute", tags=["核心操作"])
 async def execute_action(request: ActionRequest):
-    client = client_manager.get_client(request.session_name)
-    if not client:
-        logger.error(f"动作请求失败: 未找到或未连接会话 {request.session_name}")
-        raise HTTPException(status_code=404, detail=f"Session '{request.session_name}' not found or not connected.")
+    async with client_manager.use_client(request.session_name, EXECUTE_CONNECT_WAIT) as client:
+        if not client:
+            logger.error(f"动作请求失败: 未找到或未连接会话 {request.session_name}")
+            raise HTTPException(status_code=404, detail=f"Session '{request.session_name}' not found or not connected.")
+        return await _run_strategy(request, client)
 
+async def _run_strategy(request, client):
     StrategyClass = get_strategy_class(request.strategy_id)
     if not StrategyClass:
         logger.error(f"动作请求失败: 未知的策略ID {request.strategy_id}")
         raise HTTPException(status_code=400, detail=f"Unknown strategy ID: {request.strategy_id}")
 
+    timer = PhaseTimer()
+    limiter = client_manager.get_limiter(request.session_name)
     try:
-        target_entity = await client.get_entity(request.target_entity_identifier)
-        
-        client_data = client_manager._clients.get(request.session_name, {})
-        nickname_for_logging = client_data.get("nickname", "未知用户")
-
-        strategy_instance = StrategyClass(client, target_entity, logger, nickname_for_logging, task_config=request.task_config)
-        
-        if hasattr(strategy_instance, 'execute') and callable(getattr(strategy_instance, 'execute')):
-            result = await strategy_instance.execute()
-            logger.info(f"动作执行成功: {request.dict()}, 结果: {result}")
-            return result
-        else:
-            logger.error(f"策略 {request.strategy_id} 没有 'execute' 方法。")
-            raise HTTPException(status_code=500, detail=f"Strategy '{request.strategy_id}' is not executable.")
-
+        async with limiter.slot() as queue_wait:
+            timer.add("queue_wait", queue_wait)
+            retry_after = limiter.blocked_remaining(request.target_entity_identifier)
+            if retry_after:
+                reason = limiter.block_reason if limiter.blocked_remaining() else "slow_mode"
+                raise _flood_wait_exception(request.session_name, retry_after, reason)
+
+            with timer.phase("get_entity"):
+                target_entity = await client_manager.get_entity(request.session_name, client, request.target_entity_identifier)
+
+            nickname_for_logging = client_manager.get_nickname(request.session_name)
+
+            context = StrategyContext(request.session_name, client_manager.get_me(request.session_name))
+            strategy_instance = StrategyClass(client, target_entity, logger, nickname_for_logging,
+                                              task_config=request.task_config, timer=timer, rate_limiter=limiter,
+                                              context=context)
+
+            if hasattr(strategy_instance, 'execute') and callable(getattr(strategy_instance, 'execute')):
+                with timer.phase("strategy"):
+                    result = await strategy_instance.execute()
+                if strategy_instance.flood_error:
+                    raise strategy_instance.flood_error
+                if strategy_instance.entity_error:
+                    logger.warning(f"会话 {request.session_name} 访问目标 {request.target_entity_identifier} 失败"
+                                   f" ({type(strategy_instance.entity_error).__name__})，已清除实体缓存。")
+                    client_manager.entity_cache.invalidate(request.session_name, request.target_entity_identifier)
+                result = {**result, "timings": timer.as_dict()}
+                logger.info(f"动作执行成功: {request.dict()}, 结果: {result}")
+                return result
+            else:
+                logger.error(f"策略 {request.strategy_id} 没有 'execute' 方法。")
+                raise HTTPException(status_code=500, detail=f"Strategy '{request.strategy_id}' is not executable.")
+
+    except HTTPException:
+        raise
+    except FLOOD_WAIT_ERRORS as e:
+        raise _block_session(limiter, e, request.target_entity_identifier)
     except errors.UserDeactivatedBanError as e:
         logger.error(f"会话 {request.session_name} 未授权或账户问题: {e}")
         raise HTTPException(status_code=403, detail=str(e))
     except ValueError as ve:
         logger.error(f"无法找到实体 {request.target_entity_identifier}: {ve}")
+        client_manager.entity_cache.invalidate(request.session_name, request.target_entity_identifier)
         raise HTTPException(status_code=404, detail=f"Could not find entity: {request.target_entity_identifier}")
     except Exception as e:
         logger.error(f"执行动作时发生未知错误: {e}", exc_info=True)
+        # 缓存的 access_hash 可能已失效（例如 PeerIdInvalid），下次重新解析
+        client_manager.entity_cache.invalidate(request.session_name, request.target_entity_identifier)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {type(e).__name__}")
 
 @app.post("/sessions/manage", tags=["会话管理"])
@@ -221,6 +308,7 @@ async def manage_session(request: SessionManageRequest):
         raise HTTPException(status_code=500, detail="API ID or API Hash is not configured in the service.")
 
     if request.action == "add":
+        client_manager.mark_pending(request.session_name)
         await client_manager.add_or_update_client(request.session_name, api_id, api_hash, request.nickname)
         return {"success": True, "message": f"Session '{request.session_name}' is being added."}
     elif request.action == "remove":
@@ -233,18 +321,24 @@ async def manage_session(request: SessionManageRequest):
         raise HTTPException(status_code=400, detail="Invalid action. Must be 'add' or 'remove'.")
 
 
-async def periodic_health_check():
-    while True:
-        await asyncio.sleep(300)
-        await client_manager.health_check_all_clients()
+async def initialize_and_prefetch():
+    await client_manager.initialize_clients()
+    try:
+        await client_manager.prefetch_task_entities()
+    except Exception as e:
+        logger.error(f"预取签到目标实体时发生错误: {e}", exc_info=True)
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("Telegram 服务正在启动...")
     os.makedirs('data', exist_ok=True)
-    await client_manager.initialize_clients()
-    asyncio.create_task(periodic_health_check())
-    logger.info("Telegram 服务已成功启动，并已启动后台健康检查任务。")
+    # 客户端在后台并发连接，服务可以立即接受请求；就绪进度见 /ready
+    asyncio.create_task(initialize_and_prefetch())
+    asyncio.create_task(health_monitor.run())
+    asyncio.create_task(client_manager.watch_config())
+    if client_manager.lazy_mode:
+        asyncio.create_task(client_manager.run_lazy_maintenance())
+    logger.info("Telegram 服务已成功启动，客户端正在后台连接，并已启动后台健康检查和配置监听任务。")
 
 @app.on_event("shutdown")
 async def shutdown_event():
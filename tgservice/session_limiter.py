@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+SESSION_MAX_IN_FLIGHT = int(os.environ.get("TG_SESSION_MAX_IN_FLIGHT", "2"))
+SESSION_MESSAGE_RATE = float(os.environ.get("TG_SESSION_MESSAGE_RATE", "1"))
+SESSION_MESSAGE_BURST = int(os.environ.get("TG_SESSION_MESSAGE_BURST", "3"))
+
+class TokenBucket:
+    """令牌桶：按 rate（个/秒）补充令牌，最多积累 capacity 个；令牌不足时等待而不是失败。"""
+
+    def __init__(self, rate=SESSION_MESSAGE_RATE, capacity=SESSION_MESSAGE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        self._refill()
+        return self._tokens
+
+    async def acquire(self):
+        """取出一个令牌，返回等待的秒数。"""
+        if self.rate <= 0:
+            return 0.0
+        started = time.monotonic()
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                self.throttled += 1
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        return waited
+
+class SessionLimiter:
+    """单个会话的调度器：限制同时执行的动作数，超出的请求排队等待，并记录排队深度与等待时间。"""
+
+    def __init__(self, session_name, max_in_flight=SESSION_MAX_IN_FLIGHT):
+        self.session_name = session_name
+        self.max_in_flight = max_in_flight
+        self.message_bucket = TokenBucket()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+        self.blocked_until = 0.0
+        self.block_reason = None
+        self.target_blocks = {}
+
+    def block(self, seconds, reason, target=None):
+        """记录 Telegram 要求的等待：FloodWait 封锁整个账号，慢速模式只封锁对应的群组。"""
+        until = time.time() + seconds
+        if target is None:
+            if until > self.blocked_until:
+                self.blocked_until = until
+                self.block_reason = reason
+        else:
+            self.target_blocks[str(target)] = max(until, self.target_blocks.get(str(target), 0.0))
+        return until
+
+    def blocked_remaining(self, target=None):
+        """返回账号（或账号在该目标上）还需等待的秒数，未被封锁时为 0。"""
+        now = time.time()
+        for key, until in list(self.target_blocks.items()):
+            if until <= now:
+                del self.target_blocks[key]
+        until = self.blocked_until
+        if target is not None:
+            until = max(until, self.target_blocks.get(str(target), 0.0))
+        return max(0, int(until - now + 0.999))
+
+    def get_block_info(self):
+        remaining = self.blocked_remaining()
+        targets = {target: max(0, int(until - time.time() + 0.999)) for target, until in self.target_blocks.items()}
+        if not remaining and not targets:
+            return None
+        return {
+            "blocked_until": self.blocked_until if remaining else None,
+            "remaining_seconds": remaining,
+            "reason": self.block_reason if remaining else None,
+            "targets": targets,
+        }
+
+    @asynccontextmanager
+    async def slot(self):
+        queued_at = time.monotonic()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - queued_at
+        self.last_wait = waited
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.in_flight += 1
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def throttle_message(self):
+        return await self.message_bucket.acquire()
+
+    def get_stats(self):
+        started = self.completed + self.in_flight
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "completed": self.completed,
+            "avg_wait_ms": round(self.total_wait / started * 1000, 1) if started else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "last_wait_ms": round(self.last_wait * 1000, 1),
+            "message_tokens": round(self.message_bucket.tokens, 2),
+            "message_throttled": self.message_bucket.throttled,
+            "message_wait_ms": round(self.message_bucket.total_wait * 1000, 1),
+            "blocked": self.get_block_info(),
+        }
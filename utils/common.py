@@ -26,7 +26,7 @@ def get_masked_api_credentials(config_data):
 
 def get_processed_bots_list(raw_bots_list):
     processed_bots = []
-    if not isinstance(raw_bots_list, list):
+    if not isinstance(raw_bots_list, (list, tuple)):
         logger.warning(f"get_processed_bots_list 传入参数应为列表，实际得到 {type(raw_bots_list)}。将返回空列表。")
         return []
         
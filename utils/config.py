@@ -1,13 +1,58 @@
-import json, os
+import json, os, threading, tempfile, logging, atexit
+from contextlib import contextmanager
+from utils.config_store import SqliteConfigStore, config_item_key
+from utils.config_index import ConfigIndex
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 DATA_DIR = "data"
 CONFIG_FILE = os.path.join(DATA_DIR, 'config_data.json')
+CONFIG_LOCK_FILE = os.path.join(DATA_DIR, 'config_data.lock')
+CONFIG_SCHEMA_VERSION = 2
+CONFIG_BACKEND = os.environ.get("CONFIG_BACKEND", "json").lower()
+CONFIG_WRITE_COALESCE_SECONDS = float(os.environ.get("CONFIG_WRITE_COALESCE_SECONDS", "0") or 0)
+
+logger = logging.getLogger(__name__)
+
+_sqlite_store = SqliteConfigStore() if CONFIG_BACKEND == "sqlite" else None
+
+_cache_lock = threading.RLock()
+_config_cache = {"key": None, "snapshot": None, "text": None, "index": None}
+_config_cache_stats = {"hits": 0, "misses": 0}
+_pending_write = {"config": None, "base_revision": None, "base_key": None, "timer": None}
+
+class ConfigConflictError(Exception):
+    pass
+
+class _ReadOnlyDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置快照为只读，如需修改请使用 load_config() 获取副本。")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    setdefault = pop = popitem = clear = update = _readonly
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return _ReadOnlyDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _file_key(stat_result):
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
 
 def _get_default_time_slot():
     return {"id": 1, "name": "默认时段", "start_hour": 8, "start_minute": 0, "start_second": 0, "end_hour": 22, "end_minute": 0, "end_second": 0}
 
 def _get_default_config():
     cfg = {
+        "schema_version": CONFIG_SCHEMA_VERSION,
         "api_id": None,
         "api_hash": None,
         "users": [],
@@ -31,18 +76,7 @@ def _get_default_config():
         task.setdefault("selected_time_slot_id", default_slot_id)
     return cfg
 
-def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        default_config = _get_default_config()
-        save_config(default_config)
-        return default_config
-    
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return _get_default_config()
-
+def _migrate_v1_time_slots(config):
     config.setdefault("api_id", None)
     config.setdefault("api_hash", None)
     config.setdefault("users", [])
@@ -105,25 +139,324 @@ def load_config():
     for task in config.get("checkin_tasks", []):
         if "selected_time_slot_id" not in task or migrated_to_slots_this_run:
             task["selected_time_slot_id"] = default_slot_id_for_tasks
-            
-    return config
 
-def save_config(config_data):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config_data, f, indent=2, ensure_ascii=False)
-
-def migrate_session_names():
-    config = load_config()
-    migrated = False
+def _migrate_v2_session_names(config):
     for user in config.get('users', []):
         session_name = user.get('session_name')
         if session_name and ('/' in session_name or '\\' in session_name):
             base_name = os.path.basename(session_name)
-            clean_name = os.path.splitext(base_name)[0]
-            user['session_name'] = clean_name
-            migrated = True
-    
-    if migrated:
-        save_config(config)
-        print("Configuration updated: Session names have been migrated to the new format.")
+            user['session_name'] = os.path.splitext(base_name)[0]
+
+_MIGRATIONS = [
+    (1, _migrate_v1_time_slots),
+    (2, _migrate_v2_session_names),
+]
+
+def _apply_migrations(config):
+    version = config.get("schema_version", 0)
+    if not isinstance(version, int):
+        version = 0
+    for target_version, migration in _MIGRATIONS:
+        if version < target_version:
+            migration(config)
+            version = target_version
+    config["schema_version"] = version
+    return config
+
+def _needs_migration(config):
+    version = config.get("schema_version", 0)
+    return not isinstance(version, int) or version < CONFIG_SCHEMA_VERSION
+
+def _normalize_config(config):
+    if not _needs_migration(config):
+        return config
+    return _apply_migrations(config)
+
+def _atomic_write_json(path, data):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.config_', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _update_cache(key, config):
+    text = json.dumps(config, ensure_ascii=False)
+    _config_cache["key"] = key
+    _config_cache["snapshot"] = _freeze(config)
+    _config_cache["text"] = text
+    _config_cache["index"] = None
+
+def _current_source_key():
+    if _sqlite_store is not None:
+        return ("sqlite", _sqlite_store.get_revision())
+    try:
+        return _file_key(os.stat(CONFIG_FILE))
+    except FileNotFoundError:
+        return None
+
+def _read_config_source():
+    if _sqlite_store is not None:
+        key = ("sqlite", _sqlite_store.get_revision())
+        if _sqlite_store.is_empty():
+            raise FileNotFoundError(_sqlite_store.db_path)
+        return key, _sqlite_store.load()
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        key = _file_key(os.fstat(f.fileno()))
+        return key, json.load(f)
+
+def _write_config_source(config_data):
+    if _sqlite_store is not None:
+        _sqlite_store.save(config_data)
+        config_data["revision"] = _sqlite_store.get_revision()
+        return ("sqlite", config_data["revision"])
+    _atomic_write_json(CONFIG_FILE, config_data)
+    return _file_key(os.stat(CONFIG_FILE))
+
+@contextmanager
+def _config_file_lock():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(CONFIG_LOCK_FILE, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _refresh_cache():
+    with _cache_lock:
+        key = _current_source_key()
+        if _pending_write["config"] is not None:
+            if key == _pending_write["base_key"]:
+                _config_cache_stats["hits"] += 1
+                return True
+            _discard_pending_write()
+
+        if key is not None and _config_cache["key"] == key:
+            _config_cache_stats["hits"] += 1
+            return True
+
+        _config_cache_stats["misses"] += 1
+        try:
+            key, config = _read_config_source()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        _update_cache(key, _normalize_config(config))
+        return True
+
+def _config_exists():
+    if _sqlite_store is not None:
+        return not _sqlite_store.is_empty()
+    return os.path.exists(CONFIG_FILE)
+
+def get_config_snapshot():
+    """返回共享的只读配置快照，仅在配置源（文件 mtime/size/inode 或数据库 revision）变化时才重新读取。"""
+    if _refresh_cache():
+        return _config_cache["snapshot"]
+    if not _config_exists():
+        save_config(_get_default_config())
+        return _config_cache["snapshot"]
+    return _freeze(_get_default_config())
+
+def get_config_index():
+    """返回当前配置快照的索引视图，随快照一起缓存，快照变化后首次访问时重建。"""
+    snapshot = get_config_snapshot()
+    with _cache_lock:
+        if _config_cache["snapshot"] is snapshot:
+            if _config_cache["index"] is None:
+                _config_cache["index"] = ConfigIndex(snapshot)
+            return _config_cache["index"]
+    return ConfigIndex(snapshot)
+
+def load_config():
+    """返回配置的可修改副本，修改后需调用 save_config 持久化。"""
+    if _refresh_cache():
+        return json.loads(_config_cache["text"])
+    default_config = _get_default_config()
+    if not _config_exists():
+        save_config(default_config)
+    return default_config
+
+def _cached_revision():
+    snapshot = _config_cache["snapshot"]
+    return snapshot.get("revision", 0) if snapshot is not None else 0
+
+def _check_revision(config_data, current_revision):
+    expected_revision = config_data.get("revision")
+    if expected_revision is not None and expected_revision != current_revision:
+        raise ConfigConflictError(f"配置已被其他操作修改 (当前 revision {current_revision}，提交基于 {expected_revision})。")
+
+def _coalescing_enabled():
+    return CONFIG_WRITE_COALESCE_SECONDS > 0
+
+def _discard_pending_write():
+    """合并窗口内配置源已被其他进程修改：放弃本进程尚未落盘的修改，以配置源上的新配置为准。"""
+    timer = _pending_write["timer"]
+    if timer is not None:
+        timer.cancel()
+    logger.error(f"合并写入期间配置已被其他进程修改 (基于 revision {_pending_write['base_revision']})，本进程尚未落盘的修改已放弃。")
+    _pending_write["config"] = None
+    _pending_write["base_revision"] = None
+    _pending_write["base_key"] = None
+    _pending_write["timer"] = None
+
+def save_config(config_data):
+    """加锁后原子写入配置（临时文件 + rename）。
+    若 config_data 携带的 revision 与当前配置不一致，说明期间已有其他写入，抛出 ConfigConflictError。
+    开启写合并时只更新内存中的待写配置，由 flush_config 统一落盘；
+    合并期间若其他进程修改了配置，未落盘的修改会被放弃，后续基于旧 revision 的保存同样抛出 ConfigConflictError。"""
+    with _cache_lock:
+        if _coalescing_enabled():
+            _refresh_cache()
+            if _pending_write["config"] is None:
+                _pending_write["base_revision"] = _cached_revision()
+                _pending_write["base_key"] = _config_cache["key"]
+            current_revision = _cached_revision()
+            _check_revision(config_data, current_revision)
+            config_data["revision"] = current_revision + 1
+            _pending_write["config"] = _normalize_config(json.loads(json.dumps(config_data)))
+            _update_cache(("pending", config_data["revision"]), _pending_write["config"])
+            if _pending_write["timer"] is None:
+                timer = threading.Timer(CONFIG_WRITE_COALESCE_SECONDS, _flush_pending_write)
+                timer.daemon = True
+                _pending_write["timer"] = timer
+                timer.start()
+            return
+
+        with _config_file_lock():
+            _refresh_cache()
+            current_revision = _cached_revision()
+            _check_revision(config_data, current_revision)
+            config_data["revision"] = current_revision + 1
+            key = _write_config_source(config_data)
+            _update_cache(key, _normalize_config(json.loads(json.dumps(config_data))))
+
+def flush_config():
+    """将写合并期间积累的最新配置一次性写入磁盘。
+    落盘前在文件锁内重新校验 revision，期间配置已被其他进程修改时放弃待写配置并抛出 ConfigConflictError。"""
+    with _cache_lock:
+        timer = _pending_write["timer"]
+        if timer is not None:
+            timer.cancel()
+            _pending_write["timer"] = None
+        config = _pending_write["config"]
+        if config is None:
+            return False
+
+        with _config_file_lock():
+            try:
+                _, on_disk = _read_config_source()
+                disk_revision = on_disk.get("revision", 0)
+            except (FileNotFoundError, json.JSONDecodeError):
+                disk_revision = _pending_write["base_revision"]
+            if disk_revision != _pending_write["base_revision"]:
+                base_revision = _pending_write["base_revision"]
+                _discard_pending_write()
+                _config_cache["key"] = None
+                raise ConfigConflictError(f"配置已被其他操作修改 (当前 revision {disk_revision}，合并写入基于 {base_revision})。")
+            key = _write_config_source(config)
+        _pending_write["config"] = None
+        _pending_write["base_revision"] = None
+        _pending_write["base_key"] = None
+        _update_cache(key, config)
+        return True
+
+def _apply_item_changes(config, upserts, deletes):
+    # 先校验全部条目，缺少身份字段时两种后端都在修改前拒绝
+    for changes in (deletes, upserts):
+        for collection, items in changes.items():
+            for item in items:
+                if config_item_key(collection, item) is None:
+                    raise ValueError(f"{collection} 条目缺少身份字段: {item}")
+    for collection, items in deletes.items():
+        keys = {config_item_key(collection, item) for item in items}
+        config[collection] = [item for item in config.get(collection) or [] if config_item_key(collection, item) not in keys]
+    for collection, items in upserts.items():
+        current = config.get(collection)
+        if not isinstance(current, list):
+            current = config[collection] = []
+        positions = {config_item_key(collection, item): index for index, item in enumerate(current)}
+        for item in items:
+            row_key = config_item_key(collection, item)
+            if row_key in positions:
+                current[positions[row_key]] = item
+            else:
+                positions[row_key] = len(current)
+                current.append(item)
+
+def update_config_items(upserts=None, deletes=None):
+    """按身份字段（telegram_id、bot_username、chat_id、任务的用户+目标等）新增、更新或删除集合中的条目。
+    upserts / deletes: {集合名: [条目, ...]}。SQLite 后端只写入涉及的行；JSON 后端修改后整体原子写回。
+    只影响指定的条目，不会覆盖其他操作对别的条目的修改，因此不做 revision 冲突检查。"""
+    upserts = {name: list(items) for name, items in (upserts or {}).items() if items}
+    deletes = {name: list(items) for name, items in (deletes or {}).items() if items}
+    if not upserts and not deletes:
+        return
+    with _cache_lock:
+        if _pending_write["config"] is not None:
+            flush_config()
+        with _config_file_lock():
+            if _refresh_cache():
+                config = json.loads(_config_cache["text"])
+            else:
+                config = _get_default_config()
+            _apply_item_changes(config, upserts, deletes)
+            if _sqlite_store is not None:
+                _sqlite_store.apply_changes(upserts, deletes)
+                config["revision"] = _sqlite_store.get_revision()
+                key = ("sqlite", config["revision"])
+            else:
+                config["revision"] = config.get("revision", 0) + 1
+                key = _write_config_source(config)
+            _update_cache(key, config)
+
+def _flush_pending_write():
+    try:
+        flush_config()
+    except ConfigConflictError:
+        # 冲突已在 _discard_pending_write 中记录
+        pass
+
+atexit.register(_flush_pending_write)
+
+def get_config_cache_stats():
+    with _cache_lock:
+        hits = _config_cache_stats["hits"]
+        misses = _config_cache_stats["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 4) if total else 0.0}
+
+def run_config_migrations():
+    """启动时调用：若配置的 schema_version 落后，则一次性升级并原子写回。
+    使用 SQLite 后端且数据库为空时，会先从 JSON 配置文件导入。"""
+    if _sqlite_store is not None and _sqlite_store.is_empty() and os.path.exists(CONFIG_FILE):
+        _sqlite_store.import_from_json(CONFIG_FILE)
+
+    try:
+        _, config = _read_config_source()
+    except FileNotFoundError:
+        save_config(_get_default_config())
+        return False
+    except json.JSONDecodeError as e:
+        logger.error(f"配置文件 {CONFIG_FILE} 解析失败，跳过迁移: {e}")
+        return False
+
+    if not _needs_migration(config):
+        return False
+
+    from_version = config.get("schema_version", 0)
+    _apply_migrations(config)
+    with _cache_lock, _config_file_lock():
+        key = _write_config_source(config)
+        _update_cache(key, config)
+    logger.info(f"配置已从 schema_version {from_version} 迁移到 {CONFIG_SCHEMA_VERSION}。")
+    return True
@@ -0,0 +1,81 @@
+def task_target(task):
+    if task.get('bot_username'):
+        return 'bot', str(task['bot_username'])
+    if task.get('target_chat_id') is not None:
+        return 'chat', str(task['target_chat_id'])
+    return None, None
+
+class ConfigIndex:
+    """基于某一配置快照构建的索引视图，提供按 telegram_id / bot_username / chat_id / 任务键的 O(1) 查找。"""
+
+    def __init__(self, config):
+        self.config = config
+        self._users = {}
+        self._users_by_nickname = {}
+        self._bots = {}
+        self._chats = {}
+        self._slots = {}
+        self._tasks = {}
+        self._tasks_by_user = {}
+        self._tasks_by_target = {}
+
+        for user in config.get('users', []):
+            if 'telegram_id' in user:
+                self._users[user['telegram_id']] = user
+            if user.get('nickname'):
+                self._users_by_nickname.setdefault(user['nickname'], user)
+        for bot in config.get('bots', []):
+            if isinstance(bot, dict) and bot.get('bot_username'):
+                self._bots[bot['bot_username']] = bot
+        for chat in config.get('chats', []):
+            if isinstance(chat, dict) and 'chat_id' in chat:
+                self._chats[chat['chat_id']] = chat
+        for slot in config.get('scheduler_time_slots', []):
+            if isinstance(slot, dict) and 'id' in slot:
+                self._slots[slot['id']] = slot
+        for task in config.get('checkin_tasks', []):
+            target_type, target_key = task_target(task)
+            if target_type is None:
+                continue
+            user_telegram_id = task.get('user_telegram_id')
+            self._tasks.setdefault((user_telegram_id, target_key), task)
+            self._tasks_by_user.setdefault(user_telegram_id, []).append(task)
+            self._tasks_by_target.setdefault((target_type, target_key), []).append(task)
+
+    def user(self, telegram_id):
+        return self._users.get(telegram_id)
+
+    def user_by_nickname(self, nickname):
+        return self._users_by_nickname.get(nickname)
+
+    def bot(self, bot_username):
+        return self._bots.get(bot_username)
+
+    def chat(self, chat_id):
+        return self._chats.get(chat_id)
+
+    def time_slot(self, slot_id):
+        return self._slots.get(slot_id)
+
+    def first_time_slot(self):
+        """配置中第一个有效（带 id）的时间段，任务引用的时间段无效时作为默认值。"""
+        return next(iter(self._slots.values()), None)
+
+    def task(self, user_telegram_id, identifier):
+        return self._tasks.get((user_telegram_id, str(identifier)))
+
+    def tasks_for_user(self, user_telegram_id):
+        return self._tasks_by_user.get(user_telegram_id, [])
+
+    def tasks_for_target(self, target_type, identifier):
+        return self._tasks_by_target.get((target_type, str(identifier)), [])
+
+    def target(self, target_type, identifier):
+        if target_type == 'bot':
+            return self.bot(identifier)
+        if target_type == 'chat':
+            try:
+                return self.chat(int(identifier))
+            except (TypeError, ValueError):
+                return None
+        return None
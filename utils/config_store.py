@@ -0,0 +1,265 @@
+import json, os, sqlite3, threading, logging, sys, hashlib
+from contextlib import contextmanager
+from utils.config_index import task_target
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "data"
+CONFIG_DB_FILE = os.path.join(DATA_DIR, 'config_data.db')
+CONFIG_JSON_FILE = os.path.join(DATA_DIR, 'config_data.json')
+
+def _task_row_key(task):
+    target_type, target_key = task_target(task)
+    if target_type is None:
+        return None
+    return f"{task.get('user_telegram_id')}:{target_type}:{target_key}"
+
+def _task_columns(task):
+    target_type, target_key = task_target(task)
+    return {"user_telegram_id": task.get('user_telegram_id'), "target_type": target_type, "target_key": target_key}
+
+# 集合名 -> (表名, 行主键函数, 索引列函数)
+_COLLECTIONS = {
+    "users": ("users",
+              lambda u: None if u.get('telegram_id') is None else str(u['telegram_id']),
+              lambda u: {"telegram_id": u.get('telegram_id'), "nickname": u.get('nickname')}),
+    "bots": ("bots",
+             lambda b: b.get('bot_username') or None,
+             lambda b: {"bot_username": b.get('bot_username')}),
+    "chats": ("chats",
+              lambda c: None if c.get('chat_id') is None else str(c['chat_id']),
+              lambda c: {"chat_id": c.get('chat_id')}),
+    "checkin_tasks": ("tasks", _task_row_key, _task_columns),
+    "scheduler_time_slots": ("time_slots",
+                             lambda s: None if s.get('id') is None else str(s['id']),
+                             lambda s: {"slot_id": s.get('id')}),
+    "web_users": ("web_users",
+                  lambda w: None if w.get('id') is None else str(w['id']),
+                  lambda w: {"web_user_id": w.get('id'), "username": w.get('username')}),
+}
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS users (
+        row_key TEXT PRIMARY KEY, position INTEGER NOT NULL,
+        telegram_id INTEGER, nickname TEXT, data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
+    CREATE INDEX IF NOT EXISTS idx_users_nickname ON users(nickname);
+    CREATE TABLE IF NOT EXISTS bots (
+        row_key TEXT PRIMARY KEY, position INTEGER NOT NULL,
+        bot_username TEXT, data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_bots_username ON bots(bot_username);
+    CREATE TABLE IF NOT EXISTS chats (
+        row_key TEXT PRIMARY KEY, position INTEGER NOT NULL,
+        chat_id INTEGER, data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_chats_chat_id ON chats(chat_id);
+    CREATE TABLE IF NOT EXISTS tasks (
+        row_key TEXT PRIMARY KEY, position INTEGER NOT NULL,
+        user_telegram_id INTEGER, target_type TEXT, target_key TEXT, data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_identity ON tasks(user_telegram_id, target_type, target_key);
+    CREATE INDEX IF NOT EXISTS idx_tasks_target ON tasks(target_type, target_key);
+    CREATE TABLE IF NOT EXISTS time_slots (
+        row_key TEXT PRIMARY KEY, position INTEGER NOT NULL,
+        slot_id INTEGER, data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS web_users (
+        row_key TEXT PRIMARY KEY, position INTEGER NOT NULL,
+        web_user_id INTEGER, username TEXT, data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_web_users_username ON web_users(username);
+'''
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+def config_item_key(collection, item):
+    """返回集合条目的身份键（telegram_id、bot_username、chat_id、任务的用户+目标等），缺少身份字段时返回 None。"""
+    _, key_func, _ = _COLLECTIONS[collection]
+    return key_func(item) if isinstance(item, dict) else None
+
+def _item_columns(collection, item):
+    _, _, columns_func = _COLLECTIONS[collection]
+    return columns_func(item if isinstance(item, dict) else {})
+
+class SqliteConfigStore:
+    """以 SQLite 保存配置：集合按身份键逐行存储并建索引，单个条目的增删改只写入对应的行。
+    配置中的 revision 即 meta 表中的 revision，每次写入递增。"""
+
+    def __init__(self, db_path=CONFIG_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0)")
+            self._schema_ready = True
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def get_revision(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return row[0] if row else 0
+
+    def is_empty(self):
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM settings LIMIT 1").fetchone():
+            return False
+        return all(conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+                   for table, _, _ in _COLLECTIONS.values())
+
+    def load(self):
+        conn = self._connect()
+        config = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM settings")}
+        for name, (table, _, _) in _COLLECTIONS.items():
+            config[name] = [json.loads(row[0]) for row in conn.execute(f"SELECT data FROM {table} ORDER BY position")]
+        config["revision"] = self.get_revision()
+        return config
+
+    def save(self, config):
+        """与库中现有数据比较后只写入变化的行，并在同一事务中递增 revision。
+        同一集合中出现重复的身份键时抛出 ValueError。"""
+        with self._transaction() as conn:
+            changed = self._sync_settings(conn, config)
+            for name in _COLLECTIONS:
+                changed += self._sync_collection(conn, name, config.get(name) or [])
+        return changed
+
+    def apply_changes(self, upserts=None, deletes=None):
+        """按身份键删除、新增或更新条目，只写入涉及的行。
+        upserts / deletes: {集合名: [条目, ...]}；新增的条目排在集合末尾，已有条目保持原位置。"""
+        with self._transaction() as conn:
+            for collection, items in (deletes or {}).items():
+                table = _COLLECTIONS[collection][0]
+                for item in items:
+                    conn.execute(f"DELETE FROM {table} WHERE row_key = ?", (self._identity(collection, item),))
+            for collection, items in (upserts or {}).items():
+                for item in items:
+                    self._upsert_row(conn, collection, item)
+
+    def _identity(self, collection, item):
+        row_key = config_item_key(collection, item)
+        if row_key is None:
+            raise ValueError(f"{collection} 条目缺少身份字段: {item}")
+        return row_key
+
+    def _upsert_row(self, conn, collection, item):
+        table = _COLLECTIONS[collection][0]
+        row_key = self._identity(collection, item)
+        row = conn.execute(f"SELECT position FROM {table} WHERE row_key = ?", (row_key,)).fetchone()
+        if row:
+            position = row[0]
+        else:
+            position = conn.execute(f"SELECT COALESCE(MAX(position), -1) + 1 FROM {table}").fetchone()[0]
+        self._write_row(conn, table, row_key, position, _item_columns(collection, item), _dumps(item))
+
+    def _sync_settings(self, conn, config):
+        existing = dict(conn.execute("SELECT key, value FROM settings").fetchall())
+        # revision 由 meta 表维护
+        wanted = {key: _dumps(value) for key, value in config.items() if key not in _COLLECTIONS and key != "revision"}
+        changed = 0
+        for key in existing.keys() - wanted.keys():
+            conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+            changed += 1
+        for key, value in wanted.items():
+            if existing.get(key) != value:
+                conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+                changed += 1
+        return changed
+
+    def _row_keys(self, collection, items):
+        keys = []
+        seen = set()
+        anonymous = {}
+        for item in items:
+            row_key = config_item_key(collection, item)
+            if row_key is None:
+                # 缺少身份字段的旧条目按内容寻址，与所在位置无关
+                data = _dumps(item)
+                anonymous[data] = anonymous.get(data, 0) + 1
+                row_key = f"data:{hashlib.sha1(data.encode('utf-8')).hexdigest()}:{anonymous[data]}"
+            elif row_key in seen:
+                raise ValueError(f"配置 {collection} 中存在重复条目: {row_key}")
+            seen.add(row_key)
+            keys.append(row_key)
+        return keys
+
+    def _sync_collection(self, conn, collection, items):
+        table = _COLLECTIONS[collection][0]
+        existing = {row[0]: (row[1], row[2]) for row in conn.execute(f"SELECT row_key, position, data FROM {table}")}
+        wanted = list(zip(self._row_keys(collection, items), items))
+        wanted_keys = {row_key for row_key, _ in wanted}
+
+        changed = 0
+        for row_key in existing.keys() - wanted_keys:
+            conn.execute(f"DELETE FROM {table} WHERE row_key = ?", (row_key,))
+            changed += 1
+
+        # 已有行的相对顺序不变、新条目都追加在末尾时沿用原 position，删除或修改一个条目不会改写其后的所有行；
+        # 只有调整顺序或在中间插入时才重新编号
+        kept_positions = [existing[row_key][0] for row_key, _ in wanted if row_key in existing]
+        appended_only = all(row_key not in existing for row_key, _ in wanted[len(kept_positions):])
+        keep_positions = appended_only and all(a < b for a, b in zip(kept_positions, kept_positions[1:]))
+        next_position = max((position for position, _ in existing.values()), default=-1) + 1
+        for index, (row_key, item) in enumerate(wanted):
+            if not keep_positions:
+                position = index
+            elif row_key in existing:
+                position = existing[row_key][0]
+            else:
+                position = next_position
+                next_position += 1
+            data = _dumps(item)
+            if existing.get(row_key) == (position, data):
+                continue
+            self._write_row(conn, table, row_key, position, _item_columns(collection, item), data)
+            changed += 1
+        return changed
+
+    def _write_row(self, conn, table, row_key, position, columns, data):
+        # 不使用 INSERT OR REPLACE：其他唯一索引冲突时应报错，而不是静默删除另一行
+        names = ["row_key", "position", *columns.keys(), "data"]
+        placeholders = ", ".join("?" for _ in names)
+        assignments = ", ".join(f"{name} = excluded.{name}" for name in names[1:])
+        conn.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({placeholders}) "
+                     f"ON CONFLICT (row_key) DO UPDATE SET {assignments}",
+                     (row_key, position, *columns.values(), data))
+
+    def import_from_json(self, json_path=CONFIG_JSON_FILE):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self.save(config)
+        counts = {name: len(config.get(name) or []) for name in _COLLECTIONS}
+        logger.info(f"已从 {json_path} 导入配置到 {self.db_path}: {counts}")
+        return counts
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    source = sys.argv[1] if len(sys.argv) > 1 else CONFIG_JSON_FILE
+    SqliteConfigStore().import_from_json(source)
@@ -0,0 +1,41 @@
+import os, sqlite3, logging
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_FILE = os.path.join("data", "jobs.sqlite")
+# 调度器中与签到相关的作业 ID 前缀，后面紧跟 user_telegram_id
+CHECKIN_JOB_PREFIXES = ("checkin_job_", "retry_checkin_", "deferred_checkin_")
+
+def _job_user_id(job_id):
+    for prefix in CHECKIN_JOB_PREFIXES:
+        if job_id.startswith(prefix):
+            user_part = job_id[len(prefix):].split('_', 1)[0]
+            try:
+                return int(user_part)
+            except ValueError:
+                return None
+    return None
+
+def get_next_checkin_times(db_path=JOBS_DB_FILE):
+    """直接读取 APScheduler 的作业表，返回 {user_telegram_id: 最近一次签到作业的时间戳}，无需加载调度器。"""
+    if not os.path.exists(db_path):
+        return {}
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+        try:
+            rows = conn.execute(
+                "SELECT id, next_run_time FROM apscheduler_jobs WHERE next_run_time IS NOT NULL").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"读取调度作业表 {db_path} 失败: {e}")
+        return {}
+
+    next_times = {}
+    for job_id, next_run_time in rows:
+        user_id = _job_user_id(job_id or "")
+        if user_id is None:
+            continue
+        if user_id not in next_times or next_run_time < next_times[user_id]:
+            next_times[user_id] = next_run_time
+    return next_times
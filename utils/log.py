@@ -1,21 +1,70 @@
-import sqlite3, os
-from datetime import datetime
+import sqlite3, os, threading, queue, time, atexit, re, sys, gzip, json
+from datetime import datetime, date, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
 DATA_DIR = "data"
 DB_FILE = os.path.join(DATA_DIR, 'checkin_log.db')
+LOG_WRITER_BATCH_SIZE = int(os.environ.get("LOG_WRITER_BATCH_SIZE", "100"))
+LOG_WRITER_FLUSH_INTERVAL = float(os.environ.get("LOG_WRITER_FLUSH_INTERVAL", "1.0"))
+LOG_WRITER_MAX_RETRIES = int(os.environ.get("LOG_WRITER_MAX_RETRIES", "5"))
+LOG_WRITER_RETRY_DELAY = float(os.environ.get("LOG_WRITER_RETRY_DELAY", "0.5"))
+LOG_PAGE_SIZE_MAX = 200
+LOG_ARCHIVE_DIR = os.path.join(DATA_DIR, 'log_archive')
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "90"))
+
+_LOG_COLUMNS = ("id", "timestamp", "checkin_type", "user_telegram_id", "user_nickname", "target_type",
+                "target_identifier", "target_name", "strategy_id", "success", "message", "timings")
+
+# 记录表只保存整数维度 id（以及记录当时的用户昵称），读取时通过维度表还原出显示用的字段
+_RECORD_SELECT = '''
+    SELECT r.id, r.timestamp, ct.dim_key AS checkin_type, u.telegram_id AS user_telegram_id,
+           COALESCE(r.user_nickname, u.nickname) AS user_nickname,
+           t.target_type, t.identifier AS target_identifier, t.display_name AS target_name,
+           s.dim_key AS strategy_id, r.success, r.message, r.timings
+    FROM checkin_records r
+    LEFT JOIN log_checkin_types ct ON ct.id = r.checkin_type_id
+    LEFT JOIN log_users u ON u.id = r.user_id
+    LEFT JOIN log_targets t ON t.id = r.target_id
+    LEFT JOIN log_strategies s ON s.id = r.strategy_id
+'''
 
 _db_initialized = False
- 
+_init_lock = threading.Lock()
+_local = threading.local()
+
+def _open_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-8000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # 仅对新建的数据库生效，已有数据库由 v3 迁移切换
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        _local.conn = conn
+        _local.dimension_ids = {}
+    return conn
+
+def _get_connection():
+    """返回当前线程的长连接（WAL 模式），首次使用时自动初始化表结构。"""
+    if not _db_initialized:
+        init_log_db()
+    return _open_connection()
+
 def init_log_db():
     global _db_initialized
     if _db_initialized:
         return
-    os.makedirs(DATA_DIR, exist_ok=True)
-    try:
-        with sqlite3.connect(DB_FILE) as conn:
+    with _init_lock:
+        if _db_initialized:
+            return
+        try:
+            conn = _open_connection()
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS checkin_records (
@@ -30,10 +79,309 @@ def init_log_db():
                 )
             ''')
             conn.commit()
+            _run_log_migrations(conn)
+            _ensure_message_fts(conn)
             logger.info(f"数据库 {DB_FILE} 初始化成功。")
             _db_initialized = True
-    except sqlite3.Error as e:
-        logger.error(f"初始化数据库 {DB_FILE} 时出错: {e}")
+        except sqlite3.Error as e:
+            logger.error(f"初始化数据库 {DB_FILE} 时出错: {e}")
+
+def _migrate_v1_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_checkin_records_timestamp ON checkin_records (timestamp, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_checkin_records_user ON checkin_records (user_nickname, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_checkin_records_target ON checkin_records (target_type, target_name, timestamp)')
+
+def _migrate_v2_strategy_column(conn):
+    # 每日汇总表在 v5 中随维度表一起创建
+    conn.execute('ALTER TABLE checkin_records ADD COLUMN strategy_id TEXT')
+
+def _migrate_v3_incremental_vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+
+def _create_message_fts(conn):
+    # trigram 分词器支持中文子串匹配（需要 SQLite 3.34+）；不可用时搜索退回 LIKE 扫描
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS checkin_records_fts USING fts5(
+                message, content='checkin_records', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram 分词，签到消息搜索将使用 LIKE 扫描: {e}")
+        return
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS checkin_records_fts_ai AFTER INSERT ON checkin_records BEGIN
+            INSERT INTO checkin_records_fts (rowid, message) VALUES (new.id, new.message);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS checkin_records_fts_ad AFTER DELETE ON checkin_records BEGIN
+            INSERT INTO checkin_records_fts (checkin_records_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS checkin_records_fts_au AFTER UPDATE OF message ON checkin_records BEGIN
+            INSERT INTO checkin_records_fts (checkin_records_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO checkin_records_fts (rowid, message) VALUES (new.id, new.message);
+        END
+    ''')
+    conn.execute("INSERT INTO checkin_records_fts (checkin_records_fts) VALUES ('rebuild')")
+
+def _migrate_v4_message_fts(conn):
+    _create_message_fts(conn)
+
+def _ensure_message_fts(conn):
+    # v4 迁移在 SQLite 不支持 trigram 时只记录警告，user_version 仍会前进；
+    # 每次启动补建缺失的索引，升级 SQLite 后即可启用全文搜索
+    if conn.execute('PRAGMA user_version').fetchone()[0] < 4 or _fts_available(conn):
+        return
+    with conn:
+        _create_message_fts(conn)
+    if _fts_available(conn):
+        logger.info("已补建签到消息全文索引 checkin_records_fts。")
+
+_CHECKIN_TYPE_STRATEGY_RE = re.compile(r"\((.+)\)\s*$")
+
+def _legacy_strategy_id(checkin_type, display_to_id):
+    # 旧记录只在 checkin_type 中保存了策略显示名，如 "计划任务 (点击签到按钮)"
+    match = _CHECKIN_TYPE_STRATEGY_RE.search(checkin_type or "")
+    if not match:
+        return None
+    display_name = match.group(1)
+    return display_to_id.get(display_name, display_name)
+
+def _legacy_identity_maps():
+    from tgservice.checkin_strategies import STRATEGY_DISPLAY_NAMES
+    from utils.config import get_config_snapshot
+    display_to_id = {info["name"]: strategy_id for strategy_id, info in STRATEGY_DISPLAY_NAMES.items()}
+    try:
+        config = get_config_snapshot()
+    except Exception as e:
+        logger.warning(f"迁移签到日志时无法读取配置，历史记录将按名称归档到维度表: {e}")
+        config = {}
+    nickname_to_telegram_id = {user['nickname']: user['telegram_id'] for user in config.get('users', [])
+                               if user.get('nickname') and 'telegram_id' in user}
+    chat_title_to_id = {chat['chat_title']: chat['chat_id'] for chat in config.get('chats', [])
+                        if isinstance(chat, dict) and chat.get('chat_title') and 'chat_id' in chat}
+    return display_to_id, nickname_to_telegram_id, chat_title_to_id
+
+def _migrate_v5_normalized_schema(conn):
+    # 记录表只保存维度 id，另存写入时的用户昵称：维度表中的昵称随最新记录更新，改名后历史记录保持原样
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_users (
+            id INTEGER PRIMARY KEY, dim_key TEXT NOT NULL UNIQUE, telegram_id INTEGER, nickname TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_targets (
+            id INTEGER PRIMARY KEY, dim_key TEXT NOT NULL UNIQUE, target_type TEXT, identifier TEXT, display_name TEXT
+        )
+    ''')
+    conn.execute('CREATE TABLE IF NOT EXISTS log_strategies (id INTEGER PRIMARY KEY, dim_key TEXT NOT NULL UNIQUE)')
+    conn.execute('CREATE TABLE IF NOT EXISTS log_checkin_types (id INTEGER PRIMARY KEY, dim_key TEXT NOT NULL UNIQUE)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_users_nickname ON log_users (nickname)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_targets_display_name ON log_targets (display_name)')
+    conn.execute('DROP TABLE IF EXISTS checkin_records_v5')
+    conn.execute('''
+        CREATE TABLE checkin_records_v5 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            checkin_type_id INTEGER REFERENCES log_checkin_types (id),
+            user_id INTEGER REFERENCES log_users (id),
+            target_id INTEGER REFERENCES log_targets (id),
+            strategy_id INTEGER REFERENCES log_strategies (id),
+            success INTEGER,
+            message TEXT,
+            user_nickname TEXT
+        )
+    ''')
+
+    display_to_id, nickname_to_telegram_id, chat_title_to_id = _legacy_identity_maps()
+    _local.dimension_ids = {}
+    cursor = conn.execute('''
+        SELECT id, timestamp, checkin_type, user_nickname, target_type, target_name, success, message, strategy_id
+        FROM checkin_records ORDER BY id
+    ''')
+    migrated = 0
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            entry = dict(row)
+            entry["user_telegram_id"] = nickname_to_telegram_id.get(entry["user_nickname"])
+            if entry["target_type"] == 'chat':
+                entry["target_identifier"] = chat_title_to_id.get(entry["target_name"], entry["target_name"])
+            entry["strategy_id"] = entry["strategy_id"] or _legacy_strategy_id(entry["checkin_type"], display_to_id)
+            params.append((entry["id"], entry["timestamp"], *_record_dimensions(conn, entry),
+                           1 if entry["success"] else 0, entry["message"], entry["user_nickname"]))
+        conn.executemany('''
+            INSERT INTO checkin_records_v5 (id, timestamp, checkin_type_id, user_id, target_id, strategy_id, success, message, user_nickname)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', params)
+        migrated += len(params)
+
+    conn.execute('DROP TABLE checkin_records')
+    conn.execute('ALTER TABLE checkin_records_v5 RENAME TO checkin_records')
+    conn.execute('CREATE INDEX idx_checkin_records_timestamp ON checkin_records (timestamp, id)')
+    conn.execute('CREATE INDEX idx_checkin_records_user ON checkin_records (user_id, timestamp)')
+    conn.execute('CREATE INDEX idx_checkin_records_target ON checkin_records (target_id, timestamp)')
+
+    conn.execute('DROP TABLE IF EXISTS checkin_daily_stats')
+    conn.execute('''
+        CREATE TABLE checkin_daily_stats (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL,
+            strategy_id INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            successes INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id, target_id, strategy_id)
+        ) WITHOUT ROWID
+    ''')
+    _rebuild_daily_stats(conn)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'checkin_records_fts'").fetchone():
+        _create_message_fts(conn)
+    logger.info(f"已将 {migrated} 条签到日志迁移到按维度 id 存储的新结构。")
+
+def _migrate_v6_timings(conn):
+    conn.execute('ALTER TABLE checkin_records ADD COLUMN timings TEXT')
+
+# (目标 user_version, 迁移函数)，按顺序对已有数据库执行
+_LOG_MIGRATIONS = [
+    (1, _migrate_v1_indexes),
+    (2, _migrate_v2_strategy_column),
+    (3, _migrate_v3_incremental_vacuum),
+    (4, _migrate_v4_message_fts),
+    (5, _migrate_v5_normalized_schema),
+    (6, _migrate_v6_timings),
+]
+
+# VACUUM 不能在事务中执行
+_NON_TRANSACTIONAL_MIGRATIONS = {_migrate_v3_incremental_vacuum}
+
+def _run_log_migrations(conn):
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target_version, migration in _LOG_MIGRATIONS:
+        if current_version >= target_version:
+            continue
+        if migration in _NON_TRANSACTIONAL_MIGRATIONS:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {target_version}')
+        else:
+            # sqlite3 模块不会在 DDL 前自动开启事务，显式 BEGIN 让建表、复制数据和删表一起提交或回滚
+            conn.execute('BEGIN')
+            try:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {target_version}')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                _local.dimension_ids = {}
+                raise
+        logger.info(f"签到日志数据库已迁移到 schema 版本 {target_version}。")
+        current_version = target_version
+
+def _dimension_id(conn, table, dim_key, values=None):
+    """返回维度表中 dim_key 对应的 id，不存在则插入；values 中的显示字段会更新为最新值。
+    用单条 upsert 完成，多个进程同时写入同一个新维度时不会因 UNIQUE 冲突回滚整批日志。"""
+    values = values or {}
+    # 缓存按 (表, dim_key) 记录 id 及最近写入的显示字段，显示字段变化（包括改回旧值）时重新 upsert
+    cache_key = (table, dim_key)
+    cached_values = tuple(values.items())
+    dimension_ids = _local.dimension_ids
+    cached = dimension_ids.get(cache_key)
+    if cached and cached[1] == cached_values:
+        return cached[0]
+    columns = ["dim_key", *values.keys()]
+    placeholders = ", ".join("?" for _ in columns)
+    assignments = ", ".join(f"{column} = excluded.{column}" for column in columns[1:]) or "dim_key = excluded.dim_key"
+    dim_id = conn.execute(f'''
+        INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})
+        ON CONFLICT (dim_key) DO UPDATE SET {assignments}
+        RETURNING id
+    ''', (dim_key, *values.values())).fetchone()[0]
+    dimension_ids[cache_key] = (dim_id, cached_values)
+    return dim_id
+
+def _record_dimensions(conn, log_entry):
+    user_telegram_id = log_entry.get("user_telegram_id")
+    user_nickname = log_entry.get("user_nickname")
+    user_key = str(user_telegram_id) if user_telegram_id is not None else f"nickname:{user_nickname or ''}"
+    user_id = _dimension_id(conn, "log_users", user_key, {"telegram_id": user_telegram_id, "nickname": user_nickname})
+
+    target_type = log_entry.get("target_type") or "未知"
+    target_identifier = log_entry.get("target_identifier")
+    if target_identifier is None:
+        target_identifier = log_entry.get("target_name") or ""
+    target_identifier = str(target_identifier)
+    target_id = _dimension_id(conn, "log_targets", f"{target_type}:{target_identifier}", {
+        "target_type": target_type,
+        "identifier": target_identifier,
+        "display_name": log_entry.get("target_name") or target_identifier,
+    })
+
+    strategy_id = _dimension_id(conn, "log_strategies", log_entry.get("strategy_id") or "未知")
+    checkin_type_id = _dimension_id(conn, "log_checkin_types", log_entry.get("checkin_type") or "")
+    return checkin_type_id, user_id, target_id, strategy_id
+
+def _record_row(conn, log_entry):
+    timings = log_entry.get("timings")
+    return (
+        log_entry.get("timestamp", datetime.now().isoformat()),
+        *_record_dimensions(conn, log_entry),
+        1 if log_entry.get("success", False) else 0,
+        log_entry.get("message"),
+        json.dumps(timings, separators=(',', ':')) if timings else None,
+        log_entry.get("user_nickname")
+    )
+
+def _record_from_row(row):
+    record = dict(row)
+    if record.get("timings"):
+        record["timings"] = json.loads(record["timings"])
+    return record
+
+def _user_filter(user_nickname):
+    return "r.user_id IN (SELECT id FROM log_users WHERE nickname = ?)", (user_nickname,)
+
+def _target_filter(target_name, column="r.target_id"):
+    return f"{column} IN (SELECT id FROM log_targets WHERE display_name = ? OR identifier = ?)", (target_name, target_name)
+
+def _archive_path(month_str):
+    return os.path.join(LOG_ARCHIVE_DIR, f"checkin_{month_str}.ndjson.gz")
+
+def _load_archived_records(date_str):
+    """从月度归档中读取某一天的记录；归档文件可能由多个 gzip 成员追加而成，按 id 去重。"""
+    path = _archive_path(date_str[:7])
+    if not os.path.exists(path):
+        return []
+    records = {}
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("timestamp", "").startswith(date_str):
+                    records[record["id"]] = record
+    except (OSError, EOFError, json.JSONDecodeError) as e:
+        logger.error(f"读取签到日志归档 {path} 时出错: {e}")
+    return list(records.values())
+
+def _load_live_records_by_date(target_date_str):
+    conn = _get_connection()
+    rows = conn.execute(f'''
+        {_RECORD_SELECT}
+        WHERE r.timestamp >= ? AND r.timestamp <= ?
+        ORDER BY r.timestamp DESC, r.id DESC
+    ''', (target_date_str + "T00:00:00", target_date_str + "T23:59:59.999999")).fetchall()
+    return [_record_from_row(row) for row in rows]
 
 def load_checkin_log_by_date(target_date_str):
     try:
@@ -42,53 +390,574 @@ def load_checkin_log_by_date(target_date_str):
         logger.error(f"无效的日期格式: {target_date_str}. 需要 YYYY-MM-DD 格式。")
         return []
 
-    date_start_str = target_date_str + "T00:00:00"
-    date_end_str = target_date_str + "T23:59:59.999999"
-    
-    logs_for_date = []
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT timestamp, checkin_type, user_nickname, target_type, target_name, success, message 
-                FROM checkin_records 
-                WHERE timestamp >= ? AND timestamp <= ?
-                ORDER BY timestamp DESC
-            ''', (date_start_str, date_end_str))
-            
-            rows = cursor.fetchall()
-            for row in rows:
-                logs_for_date.append(dict(row))
-            
+        logs_for_date = _load_live_records_by_date(target_date_str)
     except sqlite3.Error as e:
         logger.error(f"从 {DB_FILE} 加载日期 {target_date_str} 的签到日志时出错: {e}")
-        return [] 
-    
+        return []
+
+    archived = _load_archived_records(target_date_str)
+    if archived:
+        live_ids = {entry["id"] for entry in logs_for_date}
+        logs_for_date.extend({column: record.get(column) for column in _LOG_COLUMNS}
+                             for record in archived if record["id"] not in live_ids)
+        logs_for_date.sort(key=lambda entry: (entry["timestamp"], entry["id"]), reverse=True)
     return logs_for_date
 
-def save_daily_checkin_log(log_entry):
+def encode_log_cursor(record):
+    return f"{record['timestamp']}|{record['id']}"
+
+def decode_log_cursor(cursor_str):
+    timestamp, _, record_id = (cursor_str or '').rpartition('|')
+    if not timestamp:
+        raise ValueError(f"无效的分页游标: {cursor_str}")
+    return timestamp, int(record_id)
+
+def query_checkin_logs(date_str=None, cursor=None, limit=50, user_nickname=None, target_name=None):
+    """按 (timestamp, id) 倒序的键集分页查询，cursor 为上一页返回的 next_cursor。"""
+    limit = max(1, min(int(limit), LOG_PAGE_SIZE_MAX))
+    conditions = []
+    params = []
+    if date_str:
+        datetime.strptime(date_str, '%Y-%m-%d')
+        archived = _load_archived_records(date_str)
+        if archived:
+            return _query_with_archive(date_str, archived, cursor, limit, user_nickname, target_name)
+        conditions.append("r.timestamp >= ? AND r.timestamp <= ?")
+        params.extend([date_str + "T00:00:00", date_str + "T23:59:59.999999"])
+    if cursor:
+        cursor_timestamp, cursor_id = decode_log_cursor(cursor)
+        conditions.append("(r.timestamp, r.id) < (?, ?)")
+        params.extend([cursor_timestamp, cursor_id])
+    for value, build_filter in ((user_nickname, _user_filter), (target_name, _target_filter)):
+        if value:
+            condition, condition_params = build_filter(value)
+            conditions.append(condition)
+            params.extend(condition_params)
+
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            
-            timestamp = log_entry.get("timestamp", datetime.now().isoformat())
-            
-            success_int = 1 if log_entry.get("success", False) else 0
+        conn = _get_connection()
+        rows = conn.execute(f'''
+            {_RECORD_SELECT}
+            {where_clause}
+            ORDER BY r.timestamp DESC, r.id DESC
+            LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"分页查询签到日志时出错: {e}")
+        return {"records": [], "next_cursor": None}
 
-            cursor.execute('''
-                INSERT INTO checkin_records (timestamp, checkin_type, user_nickname, target_type, target_name, success, message)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                timestamp,
-                log_entry.get("checkin_type"),
-                log_entry.get("user_nickname"),
-                log_entry.get("target_type"),
-                log_entry.get("target_name"),
-                success_int,
-                log_entry.get("message")
-            ))
-            conn.commit()
+    records = [_record_from_row(row) for row in rows[:limit]]
+    next_cursor = encode_log_cursor(records[-1]) if len(rows) > limit else None
+    return {"records": records, "next_cursor": next_cursor}
+
+def _matches_target(record, target_name):
+    return target_name in (record.get("target_name"), str(record.get("target_identifier")))
+
+def _query_with_archive(date_str, archived, cursor, limit, user_nickname, target_name):
+    # 已归档的日期数据量很小，直接合并热库与归档后在内存中分页
+    records = {record["id"]: record for record in archived}
+    try:
+        for record in _load_live_records_by_date(date_str):
+            records[record["id"]] = record
+    except sqlite3.Error as e:
+        logger.error(f"分页查询签到日志时出错: {e}")
+    matched = [
+        {column: record.get(column) for column in _LOG_COLUMNS}
+        for record in records.values()
+        if (not user_nickname or record.get("user_nickname") == user_nickname)
+        and (not target_name or _matches_target(record, target_name))
+    ]
+    matched.sort(key=lambda record: (record["timestamp"], record["id"]), reverse=True)
+    if cursor:
+        cursor_key = decode_log_cursor(cursor)
+        matched = [record for record in matched if (record["timestamp"], record["id"]) < cursor_key]
+    page = matched[:limit]
+    next_cursor = encode_log_cursor(page[-1]) if len(matched) > limit else None
+    return {"records": page, "next_cursor": next_cursor}
+
+_FTS_MIN_QUERY_LENGTH = 3
+
+def _fts_available(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkin_records_fts'").fetchone() is not None
+
+def search_checkin_logs(query_text, offset=0, limit=50, start_date_str=None, end_date_str=None):
+    """在签到消息中全文搜索，按 bm25 相关度排序（相同时较新的记录在前）；不足 3 个字符时退回 LIKE 按时间排序。
+    热库结果之后接着返回已归档记录中的子串匹配。"""
+    query_text = (query_text or "").strip()
+    if not query_text:
+        raise ValueError("搜索关键词不能为空")
+    limit = max(1, min(int(limit), LOG_PAGE_SIZE_MAX))
+    offset = max(0, int(offset))
+    conditions = []
+    params = []
+    for value, condition, suffix in ((start_date_str, "r.timestamp >= ?", "T00:00:00"),
+                                     (end_date_str, "r.timestamp <= ?", "T23:59:59.999999")):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+            conditions.append(condition)
+            params.append(value + suffix)
+
+    conn = _get_connection()
+    if len(query_text) >= _FTS_MIN_QUERY_LENGTH and _fts_available(conn):
+        match_expr = '"' + query_text.replace('"', '""') + '"'
+        where_clause = " AND ".join(["checkin_records_fts MATCH ?", *conditions])
+        sql = f'''
+            {_RECORD_SELECT}
+            JOIN checkin_records_fts ON checkin_records_fts.rowid = r.id
+            WHERE {where_clause}
+            ORDER BY bm25(checkin_records_fts), r.timestamp DESC, r.id DESC
+            LIMIT ? OFFSET ?
+        '''
+        params = [match_expr, *params]
+    else:
+        escaped = query_text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where_clause = " AND ".join(["r.message LIKE ? ESCAPE '\\'", *conditions])
+        sql = f'''
+            {_RECORD_SELECT}
+            WHERE {where_clause}
+            ORDER BY r.timestamp DESC, r.id DESC
+            LIMIT ? OFFSET ?
+        '''
+        params = [f"%{escaped}%", *params]
+
+    rows = conn.execute(sql, (*params, limit + 1, offset)).fetchall()
+    records = [_record_from_row(row) for row in rows[:limit]]
+    if len(rows) > limit:
+        return {"records": records, "next_offset": offset + limit}
+
+    # 热库结果不足一页时接着返回已归档月份中的匹配（子串匹配，按时间倒序），偏移量在两者之间连续计算
+    archived = _search_archived_records(conn, query_text, start_date_str, end_date_str)
+    if not archived:
+        return {"records": records, "next_offset": None}
+    if records:
+        archived_offset = 0
+    else:
+        live_total = conn.execute(f"SELECT COUNT(*) FROM ({sql})", (*params, -1, 0)).fetchone()[0]
+        archived_offset = max(0, offset - live_total)
+    page = archived[archived_offset:archived_offset + limit - len(records)]
+    records.extend(page)
+    next_offset = offset + limit if archived_offset + len(page) < len(archived) else None
+    return {"records": records, "next_offset": next_offset}
+
+def _archived_months():
+    if not os.path.isdir(LOG_ARCHIVE_DIR):
+        return []
+    return sorted(name[len("checkin_"):len("checkin_") + 7] for name in os.listdir(LOG_ARCHIVE_DIR)
+                  if name.startswith("checkin_") and name.endswith(".ndjson.gz"))
+
+def _search_archived_records(conn, query_text, start_date_str=None, end_date_str=None):
+    """在日期范围内的月度归档中查找消息包含关键词的记录，跳过热库中仍存在的 id（归档后删除前中断留下的重复行）。"""
+    range_start = start_date_str + "T00:00:00" if start_date_str else ""
+    range_end = end_date_str + "T23:59:59.999999" if end_date_str else "9999"
+    needle = query_text.casefold()
+    matched = []
+    for month_str in _archived_months():
+        if not (range_start[:7] <= month_str <= range_end[:7]):
+            continue
+        for record in _iter_archived_records(month_str):
+            if range_start <= record.get("timestamp", "") <= range_end and needle in (record.get("message") or "").casefold():
+                matched.append({column: record.get(column) for column in _LOG_COLUMNS})
+    if not matched:
+        return []
+    live_ids = set()
+    record_ids = [record["id"] for record in matched]
+    for start in range(0, len(record_ids), 500):
+        chunk = record_ids[start:start + 500]
+        live_ids.update(row[0] for row in conn.execute(
+            f"SELECT id FROM checkin_records WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+    matched = [record for record in matched if record["id"] not in live_ids]
+    matched.sort(key=lambda record: (record.get("timestamp") or "", record["id"]), reverse=True)
+    return matched
+
+def _iter_archived_records(month_str):
+    path = _archive_path(month_str)
+    if not os.path.exists(path):
+        return
+    seen_ids = set()
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["id"] in seen_ids:
+                    continue
+                seen_ids.add(record["id"])
+                yield record
+    except (OSError, EOFError, json.JSONDecodeError) as e:
+        logger.error(f"读取签到日志归档 {path} 时出错: {e}")
+
+def _month_range(start_date, end_date):
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def iter_checkin_logs(start_date_str=None, end_date_str=None, user_nickname=None, target_name=None, success=None, batch_size=500):
+    """按时间顺序逐条产出日期范围内的记录（含已归档月份），服务端游标分批读取，内存占用与范围大小无关。"""
+    conn = _get_connection()
+    if start_date_str:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    else:
+        oldest = conn.execute("SELECT MIN(timestamp) FROM checkin_records").fetchone()[0]
+        candidates = [value[:7] + "-01" for value in (oldest, *_archived_months()) if value]
+        if not candidates:
+            return
+        start_date = datetime.strptime(min(candidates), '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else date.today()
+    range_start = start_date.isoformat() + "T00:00:00"
+    range_end = (end_date + timedelta(days=1)).isoformat() + "T00:00:00"
+
+    def matches(record):
+        return (not user_nickname or record.get("user_nickname") == user_nickname) \
+            and (not target_name or _matches_target(record, target_name)) \
+            and (success is None or bool(record.get("success")) == success)
+
+    conditions = ["r.timestamp >= ?", "r.timestamp < ?"]
+    filter_params = []
+    for value, build_filter in ((user_nickname, _user_filter), (target_name, _target_filter)):
+        if value:
+            condition, condition_params = build_filter(value)
+            conditions.append(condition)
+            filter_params.extend(condition_params)
+    if success is not None:
+        conditions.append("r.success = ?")
+        filter_params.append(1 if success else 0)
+
+    for month_str in _month_range(start_date, end_date):
+        archived_ids = set()
+        for record in _iter_archived_records(month_str):
+            if range_start <= record.get("timestamp", "") < range_end and matches(record):
+                archived_ids.add(record["id"])
+                yield {column: record.get(column) for column in _LOG_COLUMNS}
+
+        month_start = max(range_start, month_str + "-01")
+        month_end = min(range_end, month_str + "-32")
+        cursor = conn.execute(f'''
+            {_RECORD_SELECT}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY r.timestamp, r.id
+        ''', (month_start, month_end, *filter_params))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row["id"] not in archived_ids:
+                    yield _record_from_row(row)
+
+def _classify_result(success, message):
+    if success:
+        return "successes"
+    if message and "重复签到" in message:
+        return "duplicates"
+    return "failures"
+
+def _add_daily_stats(conn, stats):
+    """stats: {(day, user_id, target_id, strategy_id): {"attempts": n, "successes": n, ...}}"""
+    conn.executemany('''
+        INSERT INTO checkin_daily_stats (day, user_id, target_id, strategy_id, attempts, successes, duplicates, failures)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (day, user_id, target_id, strategy_id) DO UPDATE SET
+            attempts = attempts + excluded.attempts,
+            successes = successes + excluded.successes,
+            duplicates = duplicates + excluded.duplicates,
+            failures = failures + excluded.failures
+    ''', [(*key, c["attempts"], c["successes"], c["duplicates"], c["failures"]) for key, c in stats.items()])
+
+def _batch_daily_stats(rows):
+    stats = {}
+    for timestamp, _, user_id, target_id, strategy_id, success, message, *_ in rows:
+        counters = stats.setdefault((timestamp[:10], user_id, target_id, strategy_id),
+                                    {"attempts": 0, "successes": 0, "duplicates": 0, "failures": 0})
+        counters["attempts"] += 1
+        counters[_classify_result(success, message)] += 1
+    return stats
+
+def save_checkin_logs(log_entries):
+    """在单个事务中批量写入多条签到日志。"""
+    if not log_entries:
+        return 0
+    try:
+        conn = _get_connection()
+        with conn:
+            rows = [_record_row(conn, entry) for entry in log_entries]
+            conn.executemany('''
+                INSERT INTO checkin_records (timestamp, checkin_type_id, user_id, target_id, strategy_id, success, message, timings, user_nickname)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            _add_daily_stats(conn, _batch_daily_stats(rows))
+        if len(log_entries) == 1:
+            log_entry = log_entries[0]
             logger.info(f"签到日志已保存到 {DB_FILE}: 用户 {log_entry.get('user_nickname')}, 类型 {log_entry.get('target_type')}, 目标 {log_entry.get('target_name')}")
+        else:
+            logger.info(f"已批量保存 {len(log_entries)} 条签到日志到 {DB_FILE}。")
+        return len(log_entries)
     except sqlite3.Error as e:
+        # 事务回滚后缓存中可能有未落盘的维度 id
+        _local.dimension_ids = {}
         logger.error(f"保存每日签到日志到 {DB_FILE} 时出错: {e}")
+        return 0
+
+def save_daily_checkin_log(log_entry):
+    save_checkin_logs([log_entry])
+
+def _rebuild_daily_stats(conn):
+    conn.execute("DELETE FROM checkin_daily_stats")
+    conn.execute('''
+        INSERT INTO checkin_daily_stats (day, user_id, target_id, strategy_id, attempts, successes, duplicates, failures)
+        SELECT substr(timestamp, 1, 10), user_id, target_id, strategy_id,
+               COUNT(*),
+               SUM(success = 1),
+               SUM(success = 0 AND message LIKE '%重复签到%'),
+               SUM(success = 0 AND (message IS NULL OR message NOT LIKE '%重复签到%'))
+        FROM checkin_records
+        GROUP BY 1, 2, 3, 4
+    ''')
+    return conn.execute("SELECT COUNT(*) FROM checkin_daily_stats").fetchone()[0]
+
+def rebuild_daily_stats():
+    """根据 checkin_records 全量重建 checkin_daily_stats，用于回填历史数据。"""
+    conn = _get_connection()
+    with conn:
+        row_count = _rebuild_daily_stats(conn)
+    logger.info(f"已重建签到统计汇总表，共 {row_count} 行。")
+    return row_count
+
+# 分组维度 -> (GROUP BY 表达式, 输出列)
+_STATS_GROUPS = {
+    "day": ("s.day", ["s.day"]),
+    "user": ("s.user_id", ["u.telegram_id AS user_telegram_id", "u.nickname AS user_nickname"]),
+    "target": ("s.target_id", ["t.target_type", "t.identifier AS target_identifier", "t.display_name AS target_name"]),
+    "strategy": ("s.strategy_id", ["st.dim_key AS strategy_id"]),
+}
+
+def query_daily_stats(start_date=None, end_date=None, group_by="user", user_nickname=None, target_name=None):
+    """只读取 checkin_daily_stats 汇总表，按维度聚合成功率。"""
+    group_names = [name.strip() for name in (group_by or "").split(",") if name.strip()]
+    unknown = [name for name in group_names if name not in _STATS_GROUPS]
+    if unknown:
+        raise ValueError(f"不支持的分组维度: {', '.join(unknown)}")
+    group_exprs = [_STATS_GROUPS[name][0] for name in group_names]
+    output_columns = [column for name in group_names for column in _STATS_GROUPS[name][1]]
+
+    conditions = []
+    params = []
+    for value, condition in ((start_date, "s.day >= ?"), (end_date, "s.day <= ?")):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+            conditions.append(condition)
+            params.append(value)
+    if user_nickname:
+        conditions.append("s.user_id IN (SELECT id FROM log_users WHERE nickname = ?)")
+        params.append(user_nickname)
+    if target_name:
+        condition, condition_params = _target_filter(target_name, column="s.target_id")
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    select_columns = ", ".join(output_columns + [
+        "SUM(s.attempts) AS attempts", "SUM(s.successes) AS successes",
+        "SUM(s.duplicates) AS duplicates", "SUM(s.failures) AS failures"])
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    group_clause = f"GROUP BY {', '.join(group_exprs)} ORDER BY {', '.join(group_exprs)}" if group_exprs else ""
+    conn = _get_connection()
+    rows = conn.execute(f'''
+        SELECT {select_columns}
+        FROM checkin_daily_stats s
+        LEFT JOIN log_users u ON u.id = s.user_id
+        LEFT JOIN log_targets t ON t.id = s.target_id
+        LEFT JOIN log_strategies st ON st.id = s.strategy_id
+        {where_clause} {group_clause}
+    ''', params).fetchall()
+
+    results = []
+    for row in rows:
+        item = dict(row)
+        if not item["attempts"]:
+            continue
+        item["success_rate"] = round(item["successes"] / item["attempts"], 4)
+        results.append(item)
+    return results
+
+def has_successful_checkin(day_str, user_telegram_id, target_type, target_identifier):
+    """当天该用户在该目标上是否已有成功或重复签到的记录（读取汇总表），用于避免多余的重试。"""
+    conn = _get_connection()
+    row = conn.execute('''
+        SELECT 1 FROM checkin_daily_stats s
+        JOIN log_users u ON u.id = s.user_id
+        JOIN log_targets t ON t.id = s.target_id
+        WHERE s.day = ? AND u.dim_key = ? AND t.dim_key = ? AND (s.successes > 0 OR s.duplicates > 0)
+        LIMIT 1
+    ''', (day_str, str(user_telegram_id), f"{target_type}:{target_identifier}")).fetchone()
+    return row is not None
+
+def archive_old_logs(retention_days=None):
+    """将超过保留天数的记录按月追加到 data/log_archive 下的压缩归档中，删除热库中的对应行并增量回收空间。"""
+    if retention_days is None:
+        retention_days = LOG_RETENTION_DAYS
+    if retention_days <= 0:
+        return 0
+    cutoff = (date.today() - timedelta(days=retention_days)).isoformat() + "T00:00:00"
+    conn = _get_connection()
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(timestamp, 1, 7) FROM checkin_records WHERE timestamp < ? ORDER BY 1", (cutoff,))]
+    if not months:
+        return 0
+
+    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+    archived_count = 0
+    for month_str in months:
+        month_end = min(cutoff, month_str + "-32")
+        cursor = conn.execute(f'''
+            {_RECORD_SELECT}
+            WHERE r.timestamp >= ? AND r.timestamp < ?
+            ORDER BY r.timestamp, r.id
+        ''', (month_str, month_end))
+        archived_ids = []
+        # 归档中保存展开后的显示字段，不依赖维度表即可读取；
+        # 追加写入一个新的 gzip 成员，先落盘归档再删除，中途失败只会在归档中留下可去重的重复行
+        with gzip.open(_archive_path(month_str), 'at', encoding='utf-8') as f:
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    f.write(json.dumps(_record_from_row(row), ensure_ascii=False) + "\n")
+                    archived_ids.append(row["id"])
+        with conn:
+            conn.executemany("DELETE FROM checkin_records WHERE id = ?", ((record_id,) for record_id in archived_ids))
+        archived_count += len(archived_ids)
+        logger.info(f"已归档 {month_str} 的 {len(archived_ids)} 条签到日志到 {_archive_path(month_str)}。")
+
+    conn.execute('PRAGMA incremental_vacuum')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    logger.info(f"签到日志保留清理完成: 共归档 {archived_count} 条超过 {retention_days} 天的记录。")
+    return archived_count
+
+def run_log_retention():
+    checkin_log_writer.flush()
+    try:
+        archive_old_logs()
+    except Exception as e:
+        logger.error(f"签到日志保留清理失败: {e}", exc_info=True)
+
+class CheckinLogWriter:
+    """后台日志写入线程：调用方入队后立即返回，按条数或时间批量落盘。"""
+
+    _STOP = object()
+
+    def __init__(self, batch_size=LOG_WRITER_BATCH_SIZE, flush_interval=LOG_WRITER_FLUSH_INTERVAL,
+                 max_retries=LOG_WRITER_MAX_RETRIES, retry_delay=LOG_WRITER_RETRY_DELAY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written_count = 0
+        self.batch_count = 0
+        self.retry_count = 0
+        self.dropped_count = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="checkin-log-writer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, log_entry):
+        entry = dict(log_entry)
+        entry.setdefault("timestamp", datetime.now().isoformat())
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _write_batch(self, batch):
+        """写入失败（如 database is locked）时按指数退避重试，超过 max_retries 次才放弃并计入 dropped。"""
+        if not batch:
+            return
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retry_count += 1
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            written = save_checkin_logs(batch)
+            if written:
+                self.written_count += written
+                self.batch_count += 1
+                return
+        self.dropped_count += len(batch)
+        logger.error(f"后台写入签到日志重试 {self.max_retries} 次后仍失败，已丢弃 {len(batch)} 条记录。")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.dropped_count += len(batch)
+                logger.error(f"后台写入 {len(batch)} 条签到日志失败: {e}", exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """阻塞直到当前队列中的日志全部写入。"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        logger.info(f"签到日志写入线程已停止，共写入 {self.written_count} 条记录。")
+
+    def get_stats(self):
+        return {"queue_depth": self.queue_depth(), "written": self.written_count, "batches": self.batch_count,
+                "retries": self.retry_count, "dropped": self.dropped_count}
+
+checkin_log_writer = CheckinLogWriter()
+atexit.register(checkin_log_writer.stop)
+
+def enqueue_checkin_log(log_entry):
+    checkin_log_writer.enqueue(log_entry)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'rebuild-stats':
+        init_log_db()
+        rebuild_daily_stats()
+    elif command == 'archive':
+        init_log_db()
+        archive_old_logs(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        print("用法: python -m utils.log rebuild-stats | archive [保留天数]")
@@ -5,20 +5,42 @@ import threading
 import asyncio
 import os
 import httpx
+from datetime import date, datetime, timedelta
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from utils.tgservice_api import execute_action
+from utils.tgservice_api import execute_action, tgservice_client
 from tgservice.checkin_strategies import get_strategy_display_name
-from utils.config import load_config
-from utils.log import save_daily_checkin_log
+from utils.config import get_config_index
+from utils.log import enqueue_checkin_log, checkin_log_writer, run_log_retention, has_successful_checkin
+
+# thread: 每个作业在线程池中 asyncio.run；loop: 作业提交到一个常驻事件循环线程，共享 HTTP 连接池
+SCHEDULER_EXECUTION_MODE = os.environ.get("SCHEDULER_EXECUTION_MODE", "loop").lower()
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("SCHEDULER_MAX_CONCURRENCY", "20"))
+DEFERRED_JOB_PREFIX = "deferred_checkin_"
+RETRY_JOB_PREFIX = "retry_checkin_"
+CHECKIN_RETRY_MAX_ATTEMPTS = int(os.environ.get("CHECKIN_RETRY_MAX_ATTEMPTS", "3"))
+CHECKIN_RETRY_BASE_DELAY = float(os.environ.get("CHECKIN_RETRY_BASE_DELAY", "120"))
+CHECKIN_RETRY_MAX_DELAY = float(os.environ.get("CHECKIN_RETRY_MAX_DELAY", "1800"))
+
+# 先匹配终止性失败（配置错误、重复签到等，重试也不会成功），再匹配可重试的临时性失败；都不匹配时视为终止
+_TERMINAL_FAILURE_MARKERS = (
+    "重复签到", "未在配置中找到", "API ID/Hash 未配置", "Unknown strategy", "is not executable",
+    "Could not find entity", "没有权限", "消息内容未在任务中配置",
+)
+_RETRYABLE_FAILURE_MARKERS = (
+    "超时", "无法连接到TG服务", "TG服务暂时不可用", "not found or not connected", "服务内部错误",
+    "An unexpected error occurred", "未知错误", "未收到",
+)
 
 jobstores = {
     'default': SQLAlchemyJobStore(url='sqlite:///data/jobs.sqlite')
 }
 
 executors = {
-    'default': {'type': 'threadpool', 'max_workers': 20}
+    # loop 模式下线程池只负责把作业投递到事件循环，几个线程就够了
+    'default': {'type': 'threadpool', 'max_workers': 4 if SCHEDULER_EXECUTION_MODE == 'loop' else 20}
 }
 
 job_defaults = {
@@ -63,12 +85,68 @@ def get_random_time_in_range(start_h, start_m, end_h, end_m, start_s=0, end_s=0)
     rand_s = random_total_seconds % 60
     return rand_h, rand_m, rand_s
 
-async def run_checkin_task(user_telegram_id, target_type, target_identifier, task_config):
-    config = load_config()
+def classify_failure(result):
+    """根据执行结果判断失败类型：返回 'success'、'retryable' 或 'terminal'。"""
+    if result.get("success"):
+        return "success"
+    message = result.get("message") or ""
+    if any(marker in message for marker in _TERMINAL_FAILURE_MARKERS):
+        return "terminal"
+    if any(marker in message for marker in _RETRYABLE_FAILURE_MARKERS):
+        return "retryable"
+    return "terminal"
+
+def _retry_window_end(task_config, now):
+    """重试必须落在任务所选时间段内；未指定时间段时以当天结束为界。"""
+    day_end = now.replace(hour=23, minute=59, second=59, microsecond=0)
+    selected_slot_id = task_config.get('selected_time_slot_id')
+    time_slot = get_config_index().time_slot(selected_slot_id) if selected_slot_id else None
+    if not time_slot:
+        return day_end
+    end = now.replace(hour=time_slot.get('end_hour', 22), minute=time_slot.get('end_minute', 0),
+                      second=time_slot.get('end_second', 0), microsecond=0)
+    start = now.replace(hour=time_slot.get('start_hour', 8), minute=time_slot.get('start_minute', 0),
+                        second=time_slot.get('start_second', 0), microsecond=0)
+    if start >= end and now >= start:
+        # 跨午夜的时间段，当前处于前半段
+        return day_end
+    return end
+
+def schedule_checkin_retry(user_telegram_id, target_type, target_identifier, task_config, attempt, job_name):
+    """以指数退避加抖动安排一次性重试作业，返回计划执行时间；超出次数或时间段时返回 None。"""
+    if attempt >= CHECKIN_RETRY_MAX_ATTEMPTS:
+        logger.info(f"任务 {job_name} 已重试 {attempt} 次，达到上限，今日不再重试。")
+        return None
+    delay = min(CHECKIN_RETRY_MAX_DELAY, CHECKIN_RETRY_BASE_DELAY * (2 ** attempt))
+    delay = random.uniform(delay / 2, delay)
+    now = datetime.now(scheduler.timezone)
+    run_at = now + timedelta(seconds=delay)
+    if run_at > _retry_window_end(task_config, now):
+        logger.info(f"任务 {job_name} 的下一次重试将超出时间段，今日不再重试。")
+        return None
+    scheduler.add_job(
+        run_checkin_task_sync,
+        trigger=DateTrigger(run_date=run_at),
+        args=[user_telegram_id, target_type, target_identifier, task_config],
+        kwargs={"attempt": attempt + 1},
+        id=f"{RETRY_JOB_PREFIX}{user_telegram_id}_{target_identifier}",
+        name=job_name,
+        replace_existing=True
+    )
+    logger.info(f"任务 {job_name} 将于 {run_at.strftime('%H:%M:%S')} 进行第 {attempt + 1} 次重试。")
+    return run_at
+
+async def run_checkin_task(user_telegram_id, target_type, target_identifier, task_config, attempt=0):
+    if attempt and has_successful_checkin(date.today().isoformat(), user_telegram_id, target_type, target_identifier):
+        logger.info(f"计划任务: User {user_telegram_id}, Target {target_identifier} 今日已签到成功，跳过第 {attempt} 次重试。")
+        return
+
+    config_index = get_config_index()
+    config = config_index.config
     api_id = config.get('api_id')
     api_hash = config.get('api_hash')
 
-    user_config = next((u for u in config.get('users', []) if u.get('telegram_id') == user_telegram_id), None)
+    user_config = config_index.user(user_telegram_id)
     if not user_config:
         logger.error(f"计划任务: 未找到 TGID 为 {user_telegram_id} 的用户配置。")
         return
@@ -88,16 +166,9 @@ async def run_checkin_task(user_telegram_id, target_type, target_identifier, tas
         target_config_item = None
         log_target_display_name = str(target_identifier)
 
-        if target_type == 'bot':
-            target_config_item = next((b for b in config.get('bots', []) if isinstance(b, dict) and b.get('bot_username') == target_identifier), None)
-        elif target_type == 'chat':
-            try:
-                chat_id_int = int(target_identifier)
-                target_config_item = next((c for c in config.get('chats', []) if isinstance(c, dict) and c.get('chat_id') == chat_id_int), None)
-                if target_config_item:
-                    log_target_display_name = target_config_item.get('chat_title', str(chat_id_int))
-            except ValueError:
-                target_config_item = None
+        target_config_item = config_index.target(target_type, target_identifier)
+        if target_type == 'chat' and target_config_item:
+            log_target_display_name = target_config_item.get('chat_title', str(target_config_item.get('chat_id')))
         
         if not target_config_item:
             result = {"success": False, "message": f"目标 '{target_identifier}' 未在配置中找到。"}
@@ -114,24 +185,158 @@ async def run_checkin_task(user_telegram_id, target_type, target_identifier, tas
                 task_config=task_config
             )
 
+    retry_after = result.get("retry_after")
+    if retry_after:
+        run_at = defer_checkin_task(user_telegram_id, target_type, target_identifier, task_config, retry_after,
+                                    f"Deferred: {user_nickname} -> {log_target_display_name}", attempt)
+        if run_at:
+            result = {**result, "message": f"{result.get('message')} 已推迟至 {run_at.strftime('%H:%M:%S')} 重新执行。"}
+        else:
+            result = {**result, "message": f"{result.get('message')} 已达重试次数上限或等待时间超出时间段，今日不再重试。"}
+    elif classify_failure(result) == "retryable":
+        run_at = schedule_checkin_retry(user_telegram_id, target_type, target_identifier, task_config, attempt,
+                                        f"Retry: {user_nickname} -> {log_target_display_name}")
+        if run_at:
+            result = {**result, "message": f"{result.get('message')} 将于 {run_at.strftime('%H:%M:%S')} 重试。"}
+    if attempt:
+        result = {**result, "message": f"{result.get('message')} (第 {attempt} 次重试)"}
+
     eff_strat_id = task_config.get('strategy_identifier') or \
                    (target_config_item.get('strategy') if target_config_item and 'strategy' in target_config_item else "未知") if target_config_item else "未知"
     strategy_display = get_strategy_display_name(eff_strat_id)
 
     log_entry = {
         "checkin_type": f"计划任务 ({strategy_display})",
+        "strategy_id": eff_strat_id,
+        "user_telegram_id": user_telegram_id,
         "user_nickname": user_nickname,
         "target_type": target_type,
+        "target_identifier": target_identifier,
         "target_name": log_target_display_name,
         "success": result.get("success"),
-        "message": result.get("message")
+        "message": result.get("message"),
+        "timings": result.get("timings")
     }
-    save_daily_checkin_log(log_entry)
+    enqueue_checkin_log(log_entry)
     logger.info(f"计划任务: User: {user_nickname}, Target: {log_target_display_name} 执行完毕. Result: {result.get('success')}")
 
-def run_checkin_task_sync(user_telegram_id, target_type, target_identifier, task_config):
+def defer_checkin_task(user_telegram_id, target_type, target_identifier, task_config, retry_after, job_name, attempt=0):
+    """Telegram 要求等待时，在等待结束后以一次性作业重新执行签到，返回计划执行时间；
+    推迟与失败重试共用 CHECKIN_RETRY_MAX_ATTEMPTS 次数上限和任务时间段，超出时放弃并返回 None。"""
+    if attempt >= CHECKIN_RETRY_MAX_ATTEMPTS:
+        logger.info(f"任务 {job_name} 已推迟或重试 {attempt} 次，达到上限，今日不再执行。")
+        return None
+    now = datetime.now(scheduler.timezone)
+    run_at = now + timedelta(seconds=retry_after + random.randint(5, 60))
+    if run_at > _retry_window_end(task_config, now):
+        logger.warning(f"任务 {job_name} 需等待 {retry_after} 秒，将超出时间段，放弃推迟执行。")
+        return None
+    scheduler.add_job(
+        run_checkin_task_sync,
+        trigger=DateTrigger(run_date=run_at),
+        args=[user_telegram_id, target_type, target_identifier, task_config],
+        kwargs={"attempt": attempt + 1},
+        id=f"{DEFERRED_JOB_PREFIX}{user_telegram_id}_{target_identifier}",
+        name=job_name,
+        replace_existing=True
+    )
+    logger.info(f"任务 {job_name} 因限流推迟至 {run_at.strftime('%Y-%m-%d %H:%M:%S')} 执行。")
+    return run_at
+
+class AsyncJobRunner:
+    """常驻事件循环线程：签到作业以协程方式在同一个循环中执行，通过 tgservice_client 复用该循环上的连接池，并发由信号量限制。"""
+
+    def __init__(self, max_concurrency=SCHEDULER_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        tgservice_client.register_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._ready.clear()
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run_loop, name="scheduler-async-runner", daemon=True)
+                self._thread.start()
+                self._ready.wait()
+                logger.info(f"调度器异步执行线程已启动 (最大并发: {self.max_concurrency})。")
+
+    async def _run_job(self, user_telegram_id, target_type, target_identifier, task_config, attempt=0):
+        try:
+            async with self._semaphore:
+                with self._stats_lock:
+                    self.pending -= 1
+                self.running += 1
+                try:
+                    await run_checkin_task(user_telegram_id, target_type, target_identifier, task_config, attempt)
+                    self.completed += 1
+                finally:
+                    self.running -= 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"在异步执行线程中执行任务 (User: {user_telegram_id}, Target: {target_identifier}) 时发生错误: {e}", exc_info=True)
+
+    def submit(self, user_telegram_id, target_type, target_identifier, task_config, attempt=0):
+        self._ensure_started()
+        with self._stats_lock:
+            self.pending += 1
+        return asyncio.run_coroutine_threadsafe(
+            self._run_job(user_telegram_id, target_type, target_identifier, task_config, attempt), self._loop)
+
+    def stop(self, timeout=30):
+        if self._thread is None or not self._thread.is_alive():
+            return
+
+        async def _drain():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=timeout)
+            await tgservice_client.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_drain(), self._loop).result(timeout=timeout + 5)
+        except Exception as e:
+            logger.error(f"停止调度器异步执行线程时出错: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        logger.info("调度器异步执行线程已停止。")
+
+    def get_stats(self):
+        return {
+            "mode": SCHEDULER_EXECUTION_MODE,
+            "max_concurrency": self.max_concurrency,
+            "pending": self.pending,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "alive": bool(self._thread and self._thread.is_alive()),
+        }
+
+async_job_runner = AsyncJobRunner()
+
+def run_checkin_task_sync(user_telegram_id, target_type, target_identifier, task_config, attempt=0):
+    if SCHEDULER_EXECUTION_MODE == 'loop':
+        async_job_runner.submit(user_telegram_id, target_type, target_identifier, task_config, attempt)
+        return
     try:
-        asyncio.run(run_checkin_task(user_telegram_id, target_type, target_identifier, task_config))
+        asyncio.run(run_checkin_task(user_telegram_id, target_type, target_identifier, task_config, attempt))
     except Exception as e:
         logger.error(f"在同步包装器内执行任务 (User: {user_telegram_id}, Target: {target_identifier}) 时发生错误: {e}", exc_info=True)
 
@@ -152,7 +357,8 @@ def log_scheduled_jobs():
 
 def reconcile_tasks(force_reschedule_ids: list = None):
     logger.info("开始核对任务...")
-    config = load_config()
+    config_index = get_config_index()
+    config = config_index.config
 
     if not config.get('scheduler_enabled'):
         logger.info("调度器已禁用，跳过任务核对。")
@@ -167,7 +373,7 @@ def reconcile_tasks(force_reschedule_ids: list = None):
         selected_slot_id = task_entry.get('selected_time_slot_id')
         time_slot = None
         if selected_slot_id:
-            time_slot = next((s for s in scheduler_time_slots if s.get('id') == selected_slot_id), None)
+            time_slot = config_index.time_slot(selected_slot_id)
 
         if not time_slot:
             time_slot = random.choice(scheduler_time_slots)
@@ -200,16 +406,7 @@ def reconcile_tasks(force_reschedule_ids: list = None):
                     user_id = int(parts[2])
                     identifier_str = "_".join(parts[3:])
 
-                    fresh_task_entry = None
-                    for task in config.get('checkin_tasks', []):
-                        if task.get('user_telegram_id') != user_id:
-                            continue
-                        
-                        current_identifier = str(task.get('bot_username') or task.get('target_chat_id'))
-                        if current_identifier == identifier_str:
-                            fresh_task_entry = task
-                            break
-                    
+                    fresh_task_entry = config_index.task(user_id, identifier_str)
                     if not fresh_task_entry:
                         logger.warning(f"无法在当前配置中找到任务 {full_job_id} 的条目，跳过。")
                         failed.append({"task_id": task_id, "error": "Task entry not found in current config"})
@@ -246,10 +443,9 @@ def reconcile_tasks(force_reschedule_ids: list = None):
         return result
 
     expected_job_ids = set()
-    user_map_by_id = {user['telegram_id']: user for user in config.get('users', []) if 'telegram_id' in user}
     for task_entry in config.get('checkin_tasks', []):
         user_telegram_id = task_entry.get('user_telegram_id')
-        user_config = user_map_by_id.get(user_telegram_id)
+        user_config = config_index.user(user_telegram_id)
         if not user_config or user_config.get('status') != 'logged_in':
             continue
 
@@ -293,13 +489,13 @@ def reconcile_tasks(force_reschedule_ids: list = None):
         job_id = f"checkin_job_{user_telegram_id}_{identifier}"
 
         if job_id in new_job_ids:
-            user_config_for_task = user_map_by_id.get(user_telegram_id)
+            user_config_for_task = config_index.user(user_telegram_id)
             current_task_user_nickname = user_config_for_task.get('nickname', f"TGID_{user_telegram_id}")
             target_identifier = identifier
             
             chat_info = None
             if target_type == 'chat':
-                 chat_info = next((c for c in config.get('chats', []) if c.get('chat_id') == target_identifier), None)
+                 chat_info = config_index.chat(target_identifier)
             display_target_name = chat_info.get('chat_title', str(target_identifier)) if chat_info else str(target_identifier)
 
             new_trigger = _get_new_cron_trigger(task_entry, config)
@@ -324,7 +520,7 @@ def reconcile_tasks(force_reschedule_ids: list = None):
 def daily_reschedule_tasks():
     logger.info("开始每日重调度...")
     for job in scheduler.get_jobs():
-        if job.id and job.id.startswith("checkin_job_"):
+        if job.id and job.id.startswith(("checkin_job_", DEFERRED_JOB_PREFIX, RETRY_JOB_PREFIX)):
             scheduler.remove_job(job.id)
     logger.info("已移除所有昨日的任务作业。")
     reconcile_tasks()
@@ -345,6 +541,15 @@ def run_scheduler():
     )
     logger.info("已设置每日任务重调度作业 (01:00 Asia/Shanghai)。")
 
+    scheduler.add_job(
+        run_log_retention,
+        trigger=CronTrigger(hour=1, minute=30, timezone='Asia/Shanghai'),
+        id='daily_log_retention',
+        name='Daily Log Retention',
+        replace_existing=True
+    )
+    logger.info("已设置每日签到日志归档作业 (01:30 Asia/Shanghai)。")
+
     logger.info("启动时执行任务核对...")
     reconcile_tasks()
     log_scheduled_jobs()
@@ -355,6 +560,8 @@ def run_scheduler():
             time.sleep(2)
     except (KeyboardInterrupt, SystemExit):
         scheduler.shutdown()
+        async_job_runner.stop()
+        checkin_log_writer.stop()
         logger.info("调度器已关闭。")
 
 SCHEDULER_HOST = os.environ.get("SCHEDULER_HOST", "localhost")
@@ -1,124 +1,291 @@
 import httpx
 import logging
 import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
 
 TG_SERVICE_HOST = os.environ.get("TG_SERVICE_HOST", "localhost")
 TG_SERVICE_PORT = os.environ.get("TG_SERVICE_PORT", "5056")
 TG_SERVICE_URL = f"http://{TG_SERVICE_HOST}:{TG_SERVICE_PORT}"
+TG_SERVICE_POOL_SIZE = int(os.environ.get("TG_SERVICE_POOL_SIZE", "20"))
+TG_SERVICE_MAX_RETRIES = int(os.environ.get("TG_SERVICE_MAX_RETRIES", "2"))
+TG_SERVICE_BREAKER_THRESHOLD = int(os.environ.get("TG_SERVICE_BREAKER_THRESHOLD", "5"))
+TG_SERVICE_BREAKER_COOLDOWN = float(os.environ.get("TG_SERVICE_BREAKER_COOLDOWN", "30"))
+
+# 各接口的总超时（秒）；执行签到需要在 tgservice 的会话队列中排队并等待机器人响应，明显长于其他接口
+TG_SERVICE_TIMEOUTS = {
+    "execute_action": float(os.environ.get("TG_SERVICE_EXECUTE_TIMEOUT", "300")),
+    "send_code": 30.0,
+    "sign_in": 60.0,
+    "manage_session": 30.0,
+    "resolve_entity": 30.0,
+}
+_RETRYABLE_STATUS_CODES = (502, 503, 504)
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期内直接失败；冷却结束后放行一个探测请求，成功则恢复。"""
+
+    def __init__(self, threshold=TG_SERVICE_BREAKER_THRESHOLD, cooldown=TG_SERVICE_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("TG 服务已恢复，熔断器关闭。")
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """探测请求没有结果就结束（如被取消）时释放探测名额，下一个请求可以重新探测。"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._consecutive_failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning(f"TG 服务连续 {self._consecutive_failures} 次请求失败，熔断 {self.cooldown} 秒。")
+                self._opened_at = time.monotonic()
+
+    def get_stats(self):
+        return {"state": self.state, "consecutive_failures": self._consecutive_failures}
+
+class TGServiceClient:
+    """调用 tgservice 的内部 RPC 客户端：常驻事件循环上复用长连接池，按接口设置超时，
+    幂等请求带抖动重试，tgservice 不可用时熔断，并统计各接口的延迟与错误。"""
+
+    def __init__(self, base_url=TG_SERVICE_URL, pool_size=TG_SERVICE_POOL_SIZE, max_retries=TG_SERVICE_MAX_RETRIES, transport=None):
+        self.base_url = base_url
+        self.transport = transport
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self._clients = weakref.WeakKeyDictionary()
+        self._pooled_loops = weakref.WeakSet()
+        self._clients_lock = threading.Lock()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def register_loop(self, loop):
+        """登记常驻事件循环，该循环上的请求复用同一个连接池，退出前需在循环内调用 aclose。"""
+        with self._clients_lock:
+            self._pooled_loops.add(loop)
+
+    @asynccontextmanager
+    async def _http_client(self):
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            pooled = loop in self._pooled_loops
+            client = self._clients.get(loop)
+            if pooled and (client is None or client.is_closed):
+                client = httpx.AsyncClient(
+                    base_url=self.base_url, transport=self.transport,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+                self._clients[loop] = client
+        if pooled:
+            yield client
+            return
+        # 未登记的事件循环（如 Flask 每个请求新建的循环）随时可能结束，连接池用完即关闭，避免泄漏
+        async with httpx.AsyncClient(base_url=self.base_url, transport=self.transport) as client:
+            yield client
+
+    async def aclose(self):
+        """关闭当前事件循环上的连接池，供常驻事件循环退出前调用。"""
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            self._pooled_loops.discard(loop)
+            client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    def _record(self, endpoint, latency_ms, error=None, retries=0):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {
+                "calls": 0, "errors": 0, "retries": 0, "total_latency_ms": 0.0, "max_latency_ms": 0.0, "last_error": None
+            })
+            stats["calls"] += 1
+            stats["retries"] += retries
+            stats["total_latency_ms"] += latency_ms
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+            if error:
+                stats["errors"] += 1
+                stats["last_error"] = error
+
+    def get_stats(self):
+        with self._stats_lock:
+            endpoints = {}
+            for endpoint, stats in self._stats.items():
+                endpoints[endpoint] = {
+                    **stats,
+                    "total_latency_ms": round(stats["total_latency_ms"], 1),
+                    "max_latency_ms": round(stats["max_latency_ms"], 1),
+                    "avg_latency_ms": round(stats["total_latency_ms"] / stats["calls"], 1) if stats["calls"] else 0.0,
+                }
+        return {"breaker": self.breaker.get_stats(), "endpoints": endpoints}
+
+    def _rate_limited_result(self, response):
+        """tgservice 因 Telegram 限流返回 429 时，把需要等待的秒数透传给调用方。"""
+        try:
+            detail = response.json().get("detail") or {}
+        except ValueError:
+            detail = {}
+        if not isinstance(detail, dict):
+            detail = {"message": str(detail)}
+        retry_after = detail.get("retry_after") or int(response.headers.get("Retry-After", "0") or 0)
+        logger.warning(f"TG 服务返回限流响应，需等待 {retry_after} 秒: {detail.get('message')}")
+        return {
+            "success": False,
+            "message": detail.get("message") or f"账号被 Telegram 限流，需等待 {retry_after} 秒。",
+            "retry_after": retry_after,
+            "reason": detail.get("reason"),
+        }
+
+    def _retry_delay(self, attempt):
+        return random.uniform(0, 0.5 * (2 ** attempt))
+
+    async def call(self, endpoint, path, payload, action_description, idempotent=False):
+        if not self.breaker.allow_request():
+            self._record(endpoint, 0.0, error="circuit_open")
+            return {"success": False, "message": "TG服务暂时不可用（连续请求失败，已暂停调用），请稍后重试。"}
+
+        started = time.perf_counter()
+        attempt = 0
+        async with self._http_client() as http_client:
+            while True:
+                try:
+                    response = await http_client.post(path, json=payload, timeout=TG_SERVICE_TIMEOUTS[endpoint])
+                    if response.status_code in _RETRYABLE_STATUS_CODES:
+                        self.breaker.record_failure()
+                        if idempotent and attempt < self.max_retries and self.breaker.state == "closed":
+                            attempt += 1
+                            await asyncio.sleep(self._retry_delay(attempt))
+                            continue
+                    response.raise_for_status()
+                    result = response.json()
+                    self.breaker.record_success()
+                    self._record(endpoint, (time.perf_counter() - started) * 1000, retries=attempt)
+                    return result
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in _RETRYABLE_STATUS_CODES:
+                        self.breaker.record_success()
+                    if e.response.status_code == 429:
+                        self._record(endpoint, (time.perf_counter() - started) * 1000, error="HTTP 429", retries=attempt)
+                        return self._rate_limited_result(e.response)
+                    self._record(endpoint, (time.perf_counter() - started) * 1000, error=f"HTTP {e.response.status_code}", retries=attempt)
+                    logger.error(f"调用 TG 服务{action_description}失败 (HTTP {e.response.status_code}): {e.response.text}")
+                    return {"success": False, "message": f"服务内部错误: {e.response.text}"}
+                except httpx.RequestError as e:
+                    self.breaker.record_failure()
+                    # 连接未建立时请求不可能已到达 tgservice，非幂等请求也可以安全重试
+                    retry_safe = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                    if retry_safe and attempt < self.max_retries and self.breaker.state == "closed":
+                        attempt += 1
+                        logger.warning(f"调用 TG 服务{action_description}时网络错误，第 {attempt} 次重试: {e}")
+                        await asyncio.sleep(self._retry_delay(attempt))
+                        continue
+                    self._record(endpoint, (time.perf_counter() - started) * 1000, error=type(e).__name__, retries=attempt)
+                    logger.error(f"调用 TG 服务时发生网络请求错误: {e}")
+                    return {"success": False, "message": f"无法连接到TG服务: {e}"}
+                except asyncio.CancelledError:
+                    # 被取消的请求没有结果可记录，需释放探测名额，否则熔断器会一直停在半开状态
+                    self.breaker.release_probe()
+                    raise
+                except Exception as e:
+                    self.breaker.record_failure()
+                    self._record(endpoint, (time.perf_counter() - started) * 1000, error=type(e).__name__, retries=attempt)
+                    logger.error(f"调用 TG 服务时发生未知错误: {e}", exc_info=True)
+                    return {"success": False, "message": f"未知错误: {e}"}
+
+    async def execute_action(self, session_name, target_entity_identifier, strategy_id, task_config=None):
+        payload = {
+            "session_name": session_name,
+            "target_entity_identifier": target_entity_identifier,
+            "strategy_id": strategy_id,
+            "task_config": task_config or {}
+        }
+        request_started = time.perf_counter()
+        result = await self.call("execute_action", "/actions/execute", payload, "执行动作")
+        if isinstance(result, dict) and "timings" in result:
+            round_trip_ms = round((time.perf_counter() - request_started) * 1000, 1)
+            timings = result["timings"]
+            timings["http_round_trip"] = round_trip_ms
+            if "total" in timings:
+                timings["http_overhead"] = round(round_trip_ms - timings["total"], 1)
+        return result
+
+    async def send_code(self, phone):
+        return await self.call("send_code", "/login/send_code", {"phone": phone}, "发送验证码")
+
+    async def sign_in(self, phone, code, phone_code_hash, password=None):
+        payload = {
+            "phone": phone,
+            "code": code,
+            "phone_code_hash": phone_code_hash,
+            "password": password
+        }
+        return await self.call("sign_in", "/login/signin", payload, "登录")
+
+    async def manage_session(self, action, session_name, nickname):
+        payload = {
+            "action": action,
+            "session_name": session_name,
+            "nickname": nickname
+        }
+        return await self.call("manage_session", "/sessions/manage", payload, "管理会话")
+
+    async def resolve_chat_identifier(self, session_name, entity_identifier):
+        payload = {
+            "session_name": session_name,
+            "entity_identifier": entity_identifier
+        }
+        return await self.call("resolve_entity", "/entities/resolve", payload, "解析实体", idempotent=True)
+
+tgservice_client = TGServiceClient()
 
 async def execute_action(session_name: str, target_entity_identifier: str, strategy_id: str, task_config: dict = None):
-    if task_config is None:
-        task_config = {}
-    
-    url = f"{TG_SERVICE_URL}/actions/execute"
-    payload = {
-        "session_name": session_name,
-        "target_entity_identifier": target_entity_identifier,
-        "strategy_id": strategy_id,
-        "task_config": task_config
-    }
-    
-    try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        logger.error(f"调用 TG 服务执行动作失败 (HTTP {e.response.status_code}): {e.response.text}")
-        return {"success": False, "message": f"服务内部错误: {e.response.text}"}
-    except httpx.RequestError as e:
-        logger.error(f"调用 TG 服务时发生网络请求错误: {e}")
-        return {"success": False, "message": f"无法连接到TG服务: {e}"}
-    except Exception as e:
-        logger.error(f"调用 TG 服务时发生未知错误: {e}", exc_info=True)
-        return {"success": False, "message": f"未知错误: {e}"}
+    return await tgservice_client.execute_action(session_name, target_entity_identifier, strategy_id, task_config)
 
 async def send_code(phone: str):
-    url = f"{TG_SERVICE_URL}/login/send_code"
-    payload = {"phone": phone}
-    
-    try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        logger.error(f"调用 TG 服务发送验证码失败 (HTTP {e.response.status_code}): {e.response.text}")
-        return {"success": False, "message": f"服务内部错误: {e.response.text}"}
-    except httpx.RequestError as e:
-        logger.error(f"调用 TG 服务时发生网络请求错误: {e}")
-        return {"success": False, "message": f"无法连接到TG服务: {e}"}
-    except Exception as e:
-        logger.error(f"调用 TG 服务时发生未知错误: {e}", exc_info=True)
-        return {"success": False, "message": f"未知错误: {e}"}
+    return await tgservice_client.send_code(phone)
 
 async def sign_in(phone: str, code: str, phone_code_hash: str, password: str = None):
-    url = f"{TG_SERVICE_URL}/login/signin"
-    payload = {
-        "phone": phone,
-        "code": code,
-        "phone_code_hash": phone_code_hash,
-        "password": password
-    }
-    
-    try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        logger.error(f"调用 TG 服务登录失败 (HTTP {e.response.status_code}): {e.response.text}")
-        return {"success": False, "message": f"服务内部错误: {e.response.text}"}
-    except httpx.RequestError as e:
-        logger.error(f"调用 TG 服务时发生网络请求错误: {e}")
-        return {"success": False, "message": f"无法连接到TG服务: {e}"}
-    except Exception as e:
-        logger.error(f"调用 TG 服务时发生未知错误: {e}", exc_info=True)
-        return {"success": False, "message": f"未知错误: {e}"}
+    return await tgservice_client.sign_in(phone, code, phone_code_hash, password)
 
 async def manage_session(action: str, session_name: str, nickname: str):
-    url = f"{TG_SERVICE_URL}/sessions/manage"
-    payload = {
-        "action": action,
-        "session_name": session_name,
-        "nickname": nickname
-    }
-    
-    try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        logger.error(f"调用 TG 服务管理会话失败 (HTTP {e.response.status_code}): {e.response.text}")
-        return {"success": False, "message": f"服务内部错误: {e.response.text}"}
-    except httpx.RequestError as e:
-        logger.error(f"调用 TG 服务时发生网络请求错误: {e}")
-        return {"success": False, "message": f"无法连接到TG服务: {e}"}
-    except Exception as e:
-        logger.error(f"调用 TG 服务时发生未知错误: {e}", exc_info=True)
-        return {"success": False, "message": f"未知错误: {e}"}
+    return await tgservice_client.manage_session(action, session_name, nickname)
 
 async def resolve_chat_identifier(session_name: str, entity_identifier: str):
-    url = f"{TG_SERVICE_URL}/entities/resolve"
-    payload = {
-        "session_name": session_name,
-        "entity_identifier": entity_identifier
-    }
-    
-    try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        logger.error(f"调用 TG 服务解析实体失败 (HTTP {e.response.status_code}): {e.response.text}")
-        return {"success": False, "message": f"服务内部错误: {e.response.text}"}
-    except httpx.RequestError as e:
-        logger.error(f"调用 TG 服务时发生网络请求错误: {e}")
-        return {"success": False, "message": f"无法连接到TG服务: {e}"}
-    except Exception as e:
-        logger.error(f"调用 TG 服务时发生未知错误: {e}", exc_info=True)
-        return {"success": False, "message": f"未知错误: {e}"}
+    return await tgservice_client.resolve_chat_identifier(session_name, entity_identifier)
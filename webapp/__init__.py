@@ -1,17 +1,25 @@
 import os
 import logging
-from flask import Flask
+from flask import Flask, request, jsonify, flash, redirect
 from flask_login import LoginManager
-from utils.config import load_config, save_config, migrate_session_names
+from utils.config import load_config, save_config, run_config_migrations, ConfigConflictError
 from utils.log import init_log_db
 from utils.common import format_datetime_filter
 
-migrate_session_names()
+run_config_migrations()
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message = ""
 
+def handle_config_conflict(e):
+    logging.warning(f"保存配置时检测到并发修改: {e}")
+    message = "配置已被其他操作修改，请刷新页面后重试。"
+    if request.path.startswith('/api/'):
+        return jsonify({"success": False, "message": message}), 409
+    flash(message, 'warning')
+    return redirect(request.url)
+
 def create_app():
     app = Flask(__name__, instance_relative_config=True)
 
@@ -27,6 +35,7 @@ def create_app():
         init_log_db()
 
     login_manager.init_app(app)
+    app.register_error_handler(ConfigConflictError, handle_config_conflict)
 
     app.jinja_env.filters['format_datetime'] = format_datetime_filter
 
@@ -1,8 +1,10 @@
-import logging, os, asyncio, httpx, base64, json, threading
-from flask import Blueprint, request, jsonify, current_app, flash
+import logging, os, asyncio, httpx, base64, json, threading, csv, io
+from datetime import date
+from flask import Blueprint, request, jsonify, current_app, flash, Response, stream_with_context
 from flask_login import login_required
-from utils.config import load_config, save_config
-from utils.log import save_daily_checkin_log
+from utils.config import load_config, save_config, update_config_items, get_config_index, get_config_cache_stats
+from utils.log import enqueue_checkin_log, checkin_log_writer, query_checkin_logs, query_daily_stats, iter_checkin_logs, search_checkin_logs
+from utils.common import format_datetime_filter
 from utils.tgservice_api import execute_action, manage_session
 from utils.scheduler_api import notify_scheduler_to_reconcile
 from tgservice.checkin_strategies import STRATEGY_MAPPING, get_strategy_display_name
@@ -185,8 +187,7 @@ async def submit_otp():
                 "session_name": user_info.get("session_name"),
                 "status": "logged_in"
             }
-            config['users'].append(new_user_data)
-            save_config(config)
+            update_config_items(upserts={"users": [new_user_data]})
             
         if phone in temp_otp_store:
             del temp_otp_store[phone]
@@ -206,8 +207,6 @@ async def delete_user():
     if not nickname_to_delete:
         return jsonify({"success": False, "message": "未提供用户昵称。"}), 400
 
-    original_user_count = len(config.get('users', []))
-    
     user_to_delete_obj = next((u for u in config.get('users', []) if u.get('nickname') == nickname_to_delete), None)
 
     if not user_to_delete_obj:
@@ -216,12 +215,12 @@ async def delete_user():
     user_telegram_id_to_delete = user_to_delete_obj.get('telegram_id')
     session_name_to_delete = user_to_delete_obj.get('session_name')
 
-    config['users'] = [u for u in config.get('users', []) if u.get('nickname') != nickname_to_delete]
-    
-    if 'checkin_tasks' in config and user_telegram_id_to_delete is not None:
-        config['checkin_tasks'] = [
+    users_to_delete = [u for u in config.get('users', []) if u.get('nickname') == nickname_to_delete]
+    tasks_to_delete = []
+    if user_telegram_id_to_delete is not None:
+        tasks_to_delete = [
             task for task in config.get('checkin_tasks', [])
-            if task.get('user_telegram_id') != user_telegram_id_to_delete
+            if task.get('user_telegram_id') == user_telegram_id_to_delete
         ]
 
     if session_name_to_delete:
@@ -229,8 +228,8 @@ async def delete_user():
         if not result.get("success"):
             logger.warning(f"调用TG服务移除会话 {session_name_to_delete} 失败: {result.get('message')}")
 
-    if len(config.get('users', [])) < original_user_count:
-        save_config(config)
+    if users_to_delete:
+        update_config_items(deletes={"users": users_to_delete, "checkin_tasks": tasks_to_delete})
         notify_scheduler_to_reconcile()
         logger.info(f"用户 {nickname_to_delete} 已删除。")
         return jsonify({"success": True, "message": f"用户 {nickname_to_delete} 已删除。"})
@@ -254,21 +253,17 @@ def add_bot():
     if strategy not in STRATEGY_MAPPING:
         return jsonify({"success": False, "message": f"无效的签到策略: {strategy}。"}), 400
 
-    if 'bots' not in config or not isinstance(config['bots'], list):
-        config['bots'] = []
-    
     existing_bot = next((b for b in config.get('bots', []) if isinstance(b, dict) and b.get('bot_username') == bot_username), None)
 
     if not existing_bot:
         new_bot_entry = {"bot_username": bot_username, "strategy": strategy}
-        config['bots'].append(new_bot_entry)
-        save_config(config)
+        update_config_items(upserts={"bots": [new_bot_entry]})
         logger.info(f"机器人 {bot_username} (策略: {strategy}) 已添加。")
         return jsonify({"success": True, "message": "机器人已添加。"})
     else:
         if existing_bot.get('strategy') != strategy:
              existing_bot['strategy'] = strategy
-             save_config(config)
+             update_config_items(upserts={"bots": [existing_bot]})
              logger.info(f"机器人 {bot_username} 的策略已更新为: {strategy}。")
              return jsonify({"success": True, "message": f"机器人 {bot_username} 的策略已更新。"})
         else:
@@ -281,13 +276,11 @@ def delete_bot():
     if not bot_to_delete_username:
         return jsonify({"success": False, "message": "未提供机器人用户名。"}), 400
 
-    original_bot_count = len(config.get('bots', []))
-    config['bots'] = [b for b in config.get('bots', []) if not (isinstance(b, dict) and b.get('bot_username') == bot_to_delete_username)]
+    bots_to_delete = [b for b in config.get('bots', []) if isinstance(b, dict) and b.get('bot_username') == bot_to_delete_username]
     
-    if len(config.get('bots',[])) < original_bot_count:
-        if 'checkin_tasks' in config:
-            config['checkin_tasks'] = [t for t in config['checkin_tasks'] if t.get('bot_username') != bot_to_delete_username]
-        save_config(config)
+    if bots_to_delete:
+        tasks_to_delete = [t for t in config.get('checkin_tasks', []) if t.get('bot_username') == bot_to_delete_username]
+        update_config_items(deletes={"bots": bots_to_delete, "checkin_tasks": tasks_to_delete})
         notify_scheduler_to_reconcile()
         logger.info(f"机器人 {bot_to_delete_username} 已删除。")
         return jsonify({"success": True, "message": "机器人已删除。"})
@@ -370,11 +363,8 @@ def add_task():
     else:
         return jsonify({"success": False, "message": "无效的目标类型。"}), 400
     
-    if 'checkin_tasks' not in config or not isinstance(config['checkin_tasks'], list):
-        config['checkin_tasks'] = []
-
     task_exists = False
-    for t in config['checkin_tasks']:
+    for t in config.get('checkin_tasks', []):
         if t.get('user_telegram_id') == new_task['user_telegram_id']:
             if target_type == 'bot' and t.get('bot_username') == new_task.get('bot_username'):
                 task_exists = True
@@ -384,8 +374,7 @@ def add_task():
                 break
     
     if not task_exists:
-        config['checkin_tasks'].append(new_task)
-        save_config(config)
+        update_config_items(upserts={"checkin_tasks": [new_task]})
         notify_scheduler_to_reconcile()
         logger.info(f"任务已添加: 用户 {user_nickname} -> {log_target_name}")
         return jsonify({"success": True, "message": "任务已添加，调度器将很快进行同步。"})
@@ -412,7 +401,7 @@ def add_tasks_batch():
     if 'checkin_tasks' not in config or not isinstance(config['checkin_tasks'], list):
         config['checkin_tasks'] = []
 
-    added_count = 0
+    new_tasks = []
     existing_count = 0
     
     for user_id in user_telegram_ids:
@@ -468,12 +457,13 @@ def add_tasks_batch():
 
             if not task_exists:
                 config['checkin_tasks'].append(new_task)
-                added_count += 1
+                new_tasks.append(new_task)
             else:
                 existing_count += 1
 
+    added_count = len(new_tasks)
     if added_count > 0:
-        save_config(config)
+        update_config_items(upserts={"checkin_tasks": new_tasks})
         notify_scheduler_to_reconcile()
         message = f"成功添加 {added_count} 个新任务。"
         if existing_count > 0:
@@ -491,10 +481,7 @@ def delete_tasks_batch():
     if not tasks_to_delete:
         return jsonify({"success": False, "message": "未选择要删除的任务。"}), 400
 
-    original_task_count = len(config.get('checkin_tasks', []))
-    
-    tasks_to_keep = []
-    deleted_count = 0
+    tasks_to_remove = []
 
     for task in config.get('checkin_tasks', []):
         task_key = (
@@ -513,14 +500,12 @@ def delete_tasks_batch():
                     should_delete = True
                     break
         
-        if not should_delete:
-            tasks_to_keep.append(task)
-        else:
-            deleted_count += 1
+        if should_delete:
+            tasks_to_remove.append(task)
 
+    deleted_count = len(tasks_to_remove)
     if deleted_count > 0:
-        config['checkin_tasks'] = tasks_to_keep
-        save_config(config)
+        update_config_items(deletes={"checkin_tasks": tasks_to_remove})
         notify_scheduler_to_reconcile()
         return jsonify({"success": True, "message": f"成功删除 {deleted_count} 个任务。"})
     else:
@@ -543,18 +528,18 @@ def update_task_slot():
     except ValueError:
         return jsonify({"success": False, "message": "无效的ID格式。"}), 400
 
-    task_found = False
+    task_found = None
     for task in config.get('checkin_tasks', []):
         task_key_user = task.get('user_telegram_id')
         task_key_target = str(task.get('bot_username') or task.get('target_chat_id'))
 
         if task_key_user == user_telegram_id and task_key_target == identifier:
             task['selected_time_slot_id'] = new_slot_id
-            task_found = True
+            task_found = task
             break
     
     if task_found:
-        save_config(config)
+        update_config_items(upserts={"checkin_tasks": [task_found]})
         notify_scheduler_to_reconcile()
         return jsonify({"success": True, "message": "任务的时间段已更新。"})
     else:
@@ -577,15 +562,15 @@ def update_task_message():
    except ValueError:
        return jsonify({"success": False, "message": "无效的ID格式。"}), 400
 
-   task_found = False
+   task_found = None
    for task in config.get('checkin_tasks', []):
        if task.get('user_telegram_id') == user_telegram_id and task.get('target_chat_id') == target_chat_id:
            task['message_content'] = message_content
-           task_found = True
+           task_found = task
            break
    
    if task_found:
-       save_config(config)
+       update_config_items(upserts={"checkin_tasks": [task_found]})
        notify_scheduler_to_reconcile()
        return jsonify({"success": True, "message": "任务的消息内容已更新。"})
    else:
@@ -606,17 +591,12 @@ def delete_task():
     except ValueError:
         return jsonify({"success": False, "message": "无效的用户TG ID格式。"}), 400
 
-    if 'checkin_tasks' not in config or not isinstance(config['checkin_tasks'], list):
-        config['checkin_tasks'] = []
-    
     user_for_log = next((u for u in config.get('users', []) if u.get('telegram_id') == user_telegram_id), None)
     log_identifier_user = user_for_log.get('nickname') if user_for_log else f"TGID_{user_telegram_id}"
     log_target_name = identifier
 
-    original_task_count = len(config['checkin_tasks'])
-    
-    tasks_to_keep = []
-    for t in config['checkin_tasks']:
+    tasks_to_remove = []
+    for t in config.get('checkin_tasks', []):
         keep_task = True
         if t.get('user_telegram_id') == user_telegram_id:
             if target_type == 'bot' and t.get('bot_username') == identifier:
@@ -628,13 +608,11 @@ def delete_task():
                         keep_task = False
                 except ValueError:
                     pass
-        if keep_task:
-            tasks_to_keep.append(t)
-            
-    config['checkin_tasks'] = tasks_to_keep
+        if not keep_task:
+            tasks_to_remove.append(t)
 
-    if len(config['checkin_tasks']) < original_task_count:
-        save_config(config)
+    if tasks_to_remove:
+        update_config_items(deletes={"checkin_tasks": tasks_to_remove})
         notify_scheduler_to_reconcile()
         logger.info(f"任务已删除: 用户 {log_identifier_user} -> {target_type.upper()} {log_target_name}")
         return jsonify({"success": True, "message": "任务已删除。"})
@@ -676,9 +654,132 @@ def reconcile_scheduler_tasks():
         return jsonify({"success": False, "message": f"请求错误: {e}"}), 500
 
 
+@api.route('/system/config_cache', methods=['GET'])
+@login_required
+def config_cache_stats():
+    return jsonify({"success": True, "stats": get_config_cache_stats()})
+
+@api.route('/system/log_writer', methods=['GET'])
+@login_required
+def log_writer_stats():
+    return jsonify({"success": True, "stats": checkin_log_writer.get_stats()})
+
+@api.route('/logs', methods=['GET'])
+@login_required
+def list_checkin_logs():
+    try:
+        log_page = query_checkin_logs(
+            date_str=request.args.get('date') or None,
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', 50, type=int),
+            user_nickname=request.args.get('user') or None,
+            target_name=request.args.get('target') or None,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"查询参数无效: {e}"}), 400
+    for record in log_page["records"]:
+        record["timestamp_display"] = format_datetime_filter(record["timestamp"])
+    return jsonify({"success": True, **log_page})
+
+@api.route('/logs/search', methods=['GET'])
+@login_required
+def search_logs():
+    try:
+        result = search_checkin_logs(
+            request.args.get('q', ''),
+            offset=request.args.get('offset', 0, type=int),
+            limit=request.args.get('limit', 50, type=int),
+            start_date_str=request.args.get('start') or None,
+            end_date_str=request.args.get('end') or None,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"查询参数无效: {e}"}), 400
+    for record in result["records"]:
+        record["timestamp_display"] = format_datetime_filter(record["timestamp"])
+    return jsonify({"success": True, **result})
+
+EXPORT_COLUMNS = ["id", "timestamp", "checkin_type", "strategy_id", "user_telegram_id", "user_nickname",
+                  "target_type", "target_identifier", "target_name", "success", "message", "timings"]
+
+def _export_csv(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for count, record in enumerate(records, 1):
+        writer.writerow([json.dumps(value, ensure_ascii=False) if isinstance(value, dict) else value
+                         for value in (record.get(column) for column in EXPORT_COLUMNS)])
+        if count % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_ndjson(records):
+    lines = []
+    for record in records:
+        lines.append(json.dumps({column: record.get(column) for column in EXPORT_COLUMNS}, ensure_ascii=False))
+        if len(lines) >= 500:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+@api.route('/logs/export', methods=['GET'])
+@login_required
+def export_checkin_logs():
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"success": False, "message": "导出格式仅支持 csv 或 ndjson。"}), 400
+    success_arg = request.args.get('success')
+    success_filter = None if success_arg in (None, '') else success_arg.lower() in ('1', 'true', 'yes')
+    start_date = request.args.get('start') or None
+    end_date = request.args.get('end') or None
+
+    try:
+        records = iter_checkin_logs(
+            start_date_str=start_date,
+            end_date_str=end_date,
+            user_nickname=request.args.get('user') or None,
+            target_name=request.args.get('target') or None,
+            success=success_filter,
+        )
+        first_record = next(records, None)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"查询参数无效: {e}"}), 400
+
+    def all_records():
+        if first_record is not None:
+            yield first_record
+            yield from records
+
+    if export_format == 'csv':
+        body, mimetype = _export_csv(all_records()), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = _export_ndjson(all_records()), 'application/x-ndjson; charset=utf-8'
+    filename = f"checkin_logs_{start_date or 'all'}_{end_date or date.today().isoformat()}.{export_format}"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@api.route('/stats', methods=['GET'])
+@login_required
+def checkin_stats():
+    try:
+        stats = query_daily_stats(
+            start_date=request.args.get('start') or None,
+            end_date=request.args.get('end') or None,
+            group_by=request.args.get('group_by', 'user'),
+            user_nickname=request.args.get('user') or None,
+            target_name=request.args.get('target') or None,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"查询参数无效: {e}"}), 400
+    return jsonify({"success": True, "stats": stats})
+
 @api.route('/checkin/manual', methods=['POST'])
 async def manual_action():
-    config = load_config()
+    config_index = get_config_index()
+    config = config_index.config
     api_id = config.get('api_id')
     api_hash = config.get('api_hash')
 
@@ -700,8 +801,8 @@ async def manual_action():
     except ValueError:
         return jsonify({"success": False, "message": "无效的用户TG ID格式。"}), 400
 
-    user_config = next((u for u in config.get('users', []) if u.get('telegram_id') == user_telegram_id and u.get('status') == 'logged_in'), None)
-    if not user_config:
+    user_config = config_index.user(user_telegram_id)
+    if not user_config or user_config.get('status') != 'logged_in':
         return jsonify({"success": False, "message": f"用户TG ID '{user_telegram_id}' 未找到或未登录。"}), 400
 
     session_name_from_config = user_config.get('session_name')
@@ -712,22 +813,20 @@ async def manual_action():
     target_config_item = None
     log_target_display_name = identifier
     
-    task_for_manual_action = next((t for t in config.get('checkin_tasks', [])
-                                   if t.get('user_telegram_id') == user_telegram_id and
-                                      (str(t.get('bot_username')) == identifier or str(t.get('target_chat_id')) == identifier)),
-                                  None)
+    task_for_manual_action = config_index.task(user_telegram_id, identifier)
 
     if not task_for_manual_action:
         return jsonify({"success": False, "message": "在配置中未找到匹配的原始任务。"}), 404
+    task_for_manual_action = dict(task_for_manual_action)
 
     if target_type == 'bot':
-        target_config_item = next((b for b in config.get('bots', []) if isinstance(b, dict) and b.get('bot_username') == identifier), None)
+        target_config_item = config_index.bot(identifier)
         if target_config_item and task_strategy_manual:
             task_for_manual_action['strategy_identifier'] = task_strategy_manual
     elif target_type == 'chat':
         try:
             chat_id_int = int(identifier)
-            target_config_item = next((c for c in config.get('chats', []) if isinstance(c, dict) and c.get('chat_id') == chat_id_int), None)
+            target_config_item = config_index.chat(chat_id_int)
             if target_config_item:
                 log_target_display_name = target_config_item.get('chat_title', identifier)
                 if message_content_manual is not None:
@@ -761,13 +860,17 @@ async def manual_action():
 
     log_entry = {
         "checkin_type": f"手动操作 ({strategy_display})",
+        "strategy_id": effective_strategy_id,
+        "user_telegram_id": user_telegram_id,
         "user_nickname": user_nickname, 
         "target_type": target_type,
+        "target_identifier": identifier,
         "target_name": log_target_display_name,
         "success": result.get("success"),
-        "message": result.get("message")
+        "message": result.get("message"),
+        "timings": result.get("timings")
     }
-    save_daily_checkin_log(log_entry)
+    enqueue_checkin_log(log_entry)
 
     return jsonify(result)
 
@@ -785,7 +888,8 @@ def run_async_tasks_in_background(app):
             loop.close()
 
 async def execute_all_tasks_internal(source="http_manual_all"):
-    config = load_config()
+    config_index = get_config_index()
+    config = config_index.config
     api_id = config.get('api_id')
     api_hash = config.get('api_hash')
 
@@ -802,13 +906,10 @@ async def execute_all_tasks_internal(source="http_manual_all"):
 
 
     results_list = []
-    user_map_by_id = {user['telegram_id']: user for user in config.get('users', []) if 'telegram_id' in user}
-    bot_map_by_username = {bot['bot_username']: bot for bot in config.get('bots', []) if 'bot_username' in bot}
-    chat_map_by_id = {chat['chat_id']: chat for chat in config.get('chats', []) if 'chat_id' in chat}
 
     for task_config_entry in tasks_to_run:
         user_telegram_id = task_config_entry.get('user_telegram_id')
-        user_config = user_map_by_id.get(user_telegram_id)
+        user_config = config_index.user(user_telegram_id)
         user_nickname = user_config.get('nickname', f"TGID_{user_telegram_id}") if user_config else f"TGID_{user_telegram_id}_(未知用户)"
 
         target_config_item = None
@@ -816,11 +917,11 @@ async def execute_all_tasks_internal(source="http_manual_all"):
         log_target_name = "未知"
 
         if task_config_entry.get('bot_username'):
-            target_config_item = bot_map_by_username.get(task_config_entry['bot_username'])
+            target_config_item = config_index.bot(task_config_entry['bot_username'])
             target_type = "bot"
             log_target_name = task_config_entry['bot_username']
         elif task_config_entry.get('target_chat_id'):
-            target_config_item = chat_map_by_id.get(task_config_entry['target_chat_id'])
+            target_config_item = config_index.chat(task_config_entry['target_chat_id'])
             target_type = "chat"
             log_target_name = target_config_item.get('chat_title', str(task_config_entry['target_chat_id'])) if target_config_item else str(task_config_entry['target_chat_id'])
         
@@ -856,14 +957,18 @@ async def execute_all_tasks_internal(source="http_manual_all"):
     
         log_entry = {
             "checkin_type": f"批量手动操作 ({strategy_display})",
+            "strategy_id": eff_strat_id,
+            "user_telegram_id": user_telegram_id,
             "user_nickname": user_nickname,
             "target_type": target_type,
+            "target_identifier": task_config_entry.get('bot_username') or task_config_entry.get('target_chat_id'),
             "target_name": log_target_name,
             "success": current_task_result.get("success"),
-            "message": current_task_result.get("message")
+            "message": current_task_result.get("message"),
+            "timings": current_task_result.get("timings")
         }
-        save_daily_checkin_log(log_entry)
-        
+        enqueue_checkin_log(log_entry)
+
     final_response = {"all_tasks_results": results_list, "message": "所有任务执行完毕。"}
     if source.startswith("http"):
         return jsonify(final_response)
@@ -2,7 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from .models import User
-from utils.config import load_config, save_config
+from utils.config import load_config, update_config_items
 from . import login_manager
 
 auth = Blueprint('auth', __name__)
@@ -34,9 +34,7 @@ def login():
             new_user_id = 1
             hashed_password = generate_password_hash(password)
             new_user_data = {'id': new_user_id, 'username': username, 'password_hash': hashed_password}
-            web_users.append(new_user_data)
-            config['web_users'] = web_users
-            save_config(config)
+            update_config_items(upserts={"web_users": [new_user_data]})
             
             new_user = User(new_user_id, username, hashed_password)
             login_user(new_user)
@@ -79,15 +77,15 @@ def change_password():
             flash('新密码长度至少为6位。', 'danger')
         else:
             config = load_config()
-            user_updated = False
+            user_updated = None
             for user_data in config.get('web_users', []):
                 if user_data.get('id') == current_user.id:
                     user_data['password_hash'] = generate_password_hash(new_password)
-                    user_updated = True
+                    user_updated = user_data
                     break
             
             if user_updated:
-                save_config(config)
+                update_config_items(upserts={"web_users": [user_updated]})
                 flash('密码修改成功！请使用新密码重新登录。', 'success')
                 logout_user()
                 return redirect(url_for('auth.login'))
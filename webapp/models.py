@@ -1,5 +1,5 @@
 from flask_login import UserMixin
-from utils.config import load_config
+from utils.config import get_config_snapshot
 
 class User(UserMixin):
     def __init__(self, id, username, password_hash=None):
@@ -9,7 +9,7 @@ class User(UserMixin):
 
     @staticmethod
     def get(user_id):
-        config = load_config()
+        config = get_config_snapshot()
         try:
             uid_to_check = int(user_id)
         except ValueError:
@@ -22,7 +22,7 @@ class User(UserMixin):
 
     @staticmethod
     def get_by_username(username):
-        config = load_config()
+        config = get_config_snapshot()
         for user_data in config.get('web_users', []):
             if user_data.get('username') == username:
                 return User(user_data['id'], user_data['username'], user_data.get('password_hash'))
@@ -1,8 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
 from datetime import date, datetime
-from utils.config import load_config, save_config
-from utils.log import load_checkin_log_by_date
+from utils.config import load_config, save_config, update_config_items, get_config_snapshot, get_config_index
+from utils.log import query_checkin_logs
 from utils.common import get_masked_api_credentials, get_processed_bots_list, update_api_credential
 from utils.tgservice_api import resolve_chat_identifier
 from tgservice.checkin_strategies import STRATEGY_DISPLAY_NAMES, get_strategy_display_name
@@ -11,13 +11,14 @@ import logging
 
 logger = logging.getLogger(__name__)
 views = Blueprint('views', __name__)
+LOG_PAGE_SIZE = 50
 
 @views.before_app_request
 def require_api_setup():
     exempt_endpoints = ['auth.login', 'auth.logout', 'static', 'views.check_first_run_status', 'views.api_settings_page', 'views.chats', 'views.delete_chat']
     
     if current_user.is_authenticated and request.endpoint not in exempt_endpoints:
-        config = load_config()
+        config = get_config_snapshot()
         if not config.get('api_id') or not config.get('api_hash'):
             if request.endpoint != 'views.api_settings_page':
                 flash('请首先完成 Telegram API 设置以使用其他功能。', 'warning')
@@ -25,14 +26,14 @@ def require_api_setup():
 
 @views.route('/check_first_run_status', methods=['GET'])
 def check_first_run_status():
-    config = load_config()
+    config = get_config_snapshot()
     web_users = config.get('web_users', [])
     return {'is_first_run': not web_users}
 
 @views.route('/')
 @login_required
 def index():
-    config = load_config()
+    config = get_config_snapshot()
     selected_date_str = date.today().isoformat()
     display_date_label = "今日"
     
@@ -46,11 +47,13 @@ def index():
         except ValueError:
             flash(f"提供的日期格式无效: {requested_date_str}。请使用 YYYY-MM-DD 格式。", "warning")
             
-    checkin_log_for_display = load_checkin_log_by_date(selected_date_str)
+    log_page = query_checkin_logs(selected_date_str, limit=LOG_PAGE_SIZE)
         
     return render_template('index.html', 
                            config=config, 
-                           checkin_log=checkin_log_for_display, 
+                           checkin_log=log_page["records"], 
+                           next_log_cursor=log_page["next_cursor"],
+                           log_page_size=LOG_PAGE_SIZE,
                            selected_date=selected_date_str,
                            display_date_label=display_date_label)
 
@@ -167,19 +170,19 @@ def scheduler_settings_page():
 @views.route('/settings/llm', methods=['GET', 'POST'])
 @login_required
 def llm_settings_page():
-   config = load_config()
+   config = get_config_snapshot()
    return render_template('llm_settings.html', llm_settings=config.get('llm_settings', {}))
 
 @views.route('/users', methods=['GET'])
 @login_required
 def users_page():
-    config = load_config()
+    config = get_config_snapshot()
     return render_template('users.html', users=config.get('users', []))
 
 @views.route('/bots', methods=['GET'])
 @login_required
 def bots_page():
-    config = load_config()
+    config = get_config_snapshot()
     
     available_strategies_for_template = []
     for key, strategy_info in STRATEGY_DISPLAY_NAMES.items():
@@ -229,10 +232,7 @@ async def chats():
                         
                         final_chat_title = custom_chat_title if custom_chat_title else chat_name_from_telegram
 
-                        if 'chats' not in config or not isinstance(config['chats'], list):
-                            config['chats'] = []
-                        
-                        existing_chat = next((c for c in config['chats'] if c.get('chat_id') == chat_id), None)
+                        existing_chat = next((c for c in config.get('chats', []) if c.get('chat_id') == chat_id), None)
                         if existing_chat:
                             flash(f"群组 '{final_chat_title}' (ID: {chat_id}) 已经存在。", 'warning')
                         else:
@@ -241,8 +241,7 @@ async def chats():
                                 "chat_title": final_chat_title,
                                 "strategy_identifier": strategy_identifier
                             }
-                            config['chats'].append(new_chat_entry)
-                            save_config(config)
+                            update_config_items(upserts={"chats": [new_chat_entry]})
                             flash(f"群组 '{final_chat_title}' 添加成功！", 'success')
                             logger.info(f"群组 '{final_chat_title}' (ID: {chat_id}) 已添加。")
                     else:
@@ -265,15 +264,12 @@ async def chats():
 def delete_chat(chat_idx):
     config = load_config()
     if 'chats' in config and 0 <= chat_idx < len(config['chats']):
-        deleted_chat = config['chats'].pop(chat_idx)
-        
-        if 'checkin_tasks' in config:
-            config['checkin_tasks'] = [
-                task for task in config['checkin_tasks']
-                if task.get('target_chat_id') != deleted_chat.get('chat_id')
-            ]
-        
-        save_config(config)
+        deleted_chat = config['chats'][chat_idx]
+        tasks_to_delete = [
+            task for task in config.get('checkin_tasks', [])
+            if task.get('target_chat_id') == deleted_chat.get('chat_id')
+        ]
+        update_config_items(deletes={"chats": [deleted_chat], "checkin_tasks": tasks_to_delete})
         notify_scheduler_to_reconcile()
         flash(f"群组 '{deleted_chat.get('chat_title')}' 已删除。", 'success')
         logger.info(f"群组 '{deleted_chat.get('chat_title')}' (ID: {deleted_chat.get('chat_id')}) 已删除。")
@@ -284,7 +280,8 @@ def delete_chat(chat_idx):
 @views.route('/tasks', methods=['GET'])
 @login_required
 def tasks_page():
-    config = load_config()
+    config_index = get_config_index()
+    config = config_index.config
 
     processed_bots_data = get_processed_bots_list(config.get('bots', []))
     configured_chats_data = config.get('chats', [])
@@ -292,14 +289,12 @@ def tasks_page():
     logged_in_users = [u for u in config.get('users', []) if u.get('status') == 'logged_in' and u.get('telegram_id')]
     
     valid_tasks = []
-    user_map_by_id = {user['telegram_id']: user for user in config.get('users', []) if 'telegram_id' in user}
     bot_strategy_map = {b['bot_username']: b.get('strategy', 'start_button_alert') for b in processed_bots_data}
-    chat_strategy_map = {c['chat_id']: c.get('strategy_identifier', 'send_custom_message') for c in configured_chats_data}
-    
-    scheduler_time_slots_map = {slot['id']: slot for slot in config.get('scheduler_time_slots', []) if isinstance(slot, dict) and 'id' in slot}
+    first_slot = config_index.first_time_slot()
 
-    for task_data in config.get('checkin_tasks', []):
-        user_for_task = user_map_by_id.get(task_data.get('user_telegram_id'))
+    for task_entry in config.get('checkin_tasks', []):
+        task_data = dict(task_entry)
+        user_for_task = config_index.user(task_data.get('user_telegram_id'))
         if user_for_task:
             task_data['display_nickname'] = user_for_task.get('nickname', f"TGID: {task_data['user_telegram_id']}")
         else:
@@ -311,21 +306,21 @@ def tasks_page():
             task_data['strategy_used'] = bot_strategy_map.get(task_data['bot_username'], 'start_button_alert')
         elif task_data.get('target_chat_id'):
             task_data['target_type'] = 'chat'
-            chat_info = next((c for c in configured_chats_data if c.get('chat_id') == task_data['target_chat_id']), None)
+            chat_info = config_index.chat(task_data['target_chat_id'])
             task_data['target_name'] = chat_info.get('chat_title', str(task_data['target_chat_id'])) if chat_info else str(task_data['target_chat_id'])
-            task_data['strategy_used'] = chat_strategy_map.get(task_data['target_chat_id'], 'send_custom_message')
+            task_data['strategy_used'] = chat_info.get('strategy_identifier', 'send_custom_message') if chat_info else 'send_custom_message'
             task_data['message_content_display'] = task_data.get('message_content', '')
 
         task_data['strategy_display_name'] = get_strategy_display_name(task_data.get('strategy_used'))
         
         selected_slot_id = task_data.get('selected_time_slot_id')
-        selected_slot_info = scheduler_time_slots_map.get(selected_slot_id)
+        selected_slot_info = config_index.time_slot(selected_slot_id)
         if selected_slot_info:
             task_data['selected_time_slot_name'] = selected_slot_info.get('name', f"时段ID: {selected_slot_id}")
         else:
-            first_slot = next(iter(scheduler_time_slots_map.values()), None)
             if first_slot:
-                 task_data['selected_time_slot_name'] = f"默认为: {first_slot.get('name', f'时段ID: {first_slot.get_id}')} (原ID {selected_slot_id} 无效)"
+                 first_slot_name = first_slot.get('name', f"时段ID: {first_slot.get('id')}")
+                 task_data['selected_time_slot_name'] = f"默认为: {first_slot_name} (原ID {selected_slot_id} 无效)"
                  task_data['selected_time_slot_id'] = first_slot.get('id')
             else:
                  task_data['selected_time_slot_name'] = "未分配或时段无效"